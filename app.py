@@ -1,9 +1,19 @@
 import streamlit as st
+import contextlib
 import datetime
-from projets import project_exists, create_project, get_project, is_valid_project_id
+import os
+from projets import project_exists, create_project, get_project, is_valid_project_id, lister_projets, TRIS_ANNUAIRE
 from morceaux import gestion_morceaux
 from paroles import edition_paroles_tableur
 from utils import init_databases
+from connexion import serveur
+from flux import synchroniser_session, surveiller_modifications
+from prechauffage import prechauffer_projet, arreter_prechauffage
+from archives import projet_archive, archiver_projet, restaurer_projet
+from maintenance import demarrer_maintenance
+from sauvegardes import demarrer_sauvegardes, telechargement_base
+from traces import etape, configurer_collecte, terminer_collecte, resume_flamme
+from profilage import profiler_requetes, totaux_par_page
 import requests
 
 # Configuration de la page
@@ -16,6 +26,50 @@ st.set_page_config(
 
 # Initialiser la base de données
 init_databases()
+# Pages libérées rendues au système en arrière-plan (une fois par processus)
+demarrer_maintenance()
+# Instantanés vérifiés des bases, pris à chaud en arrière-plan (sauvegardes.py)
+demarrer_sauvegardes()
+
+# Récupérer un query parameter (None s'il est absent)
+def get_query_param(nom):
+    if hasattr(st, 'query_params'):
+        return st.query_params.get(nom, None)
+    return st.experimental_get_query_params().get(nom, [None])[0]
+
+# Panneau de débogage (?debug=1) : étapes de l'exécution et temps passé dans chacune
+mode_debug = get_query_param("debug") == "1"
+configurer_collecte(mode_debug)
+
+# Profilage des requêtes SQL par page : en mode débogage, ou pour tout le processus avec SURTITRES_PROFIL=1
+profilage_actif = mode_debug or os.environ.get('SURTITRES_PROFIL', '') not in ('', '0')
+profil_execution = None
+
+def profiler_page(page):
+    return profiler_requetes(page) if profilage_actif else contextlib.nullcontext()
+
+def afficher_panneau_traces(etapes, profil):
+    with st.expander("🔍 Débogage : temps passé par étape pendant cette exécution", expanded=True):
+        if etapes:
+            st.dataframe(resume_flamme(etapes), use_container_width=True, hide_index=True)
+        else:
+            st.info("Aucune étape mesurée pendant cette exécution.")
+
+        if profil is not None:
+            resume = profil.resume()
+            st.write(
+                f"**Requêtes SQL ({resume['page']})** : {resume['requetes']} requêtes "
+                f"(+ {resume['requetes_triggers']} dans les triggers), {resume['connexions']} connexions, "
+                f"{resume['lignes']} lignes lues, {resume['duree_ms']} ms"
+            )
+            for requete, nombre in resume['n_plus_un']:
+                st.warning(f"Motif N+1 : {nombre} × `{requete}`")
+            for requete, duree in resume['lentes']:
+                st.warning(f"Requête lente ({duree} ms) : `{requete}`")
+            st.dataframe(
+                [{'page': page, **total} for page, total in totaux_par_page.items()],
+                use_container_width=True, hide_index=True
+            )
 
 # Récupérer le projet depuis les query parameters
 def get_project_from_query_params():
@@ -66,7 +120,9 @@ with content:
         project_id_from_params = get_project_from_query_params()
         
         if project_id_from_params:
-            if project_exists(project_id_from_params):
+            # Un projet archivé est restauré quand on le rouvre
+            if project_exists(project_id_from_params) or \
+                    (projet_archive(project_id_from_params) and restaurer_projet(project_id_from_params)):
                 st.session_state.project_id = project_id_from_params
                 st.session_state.project_data = get_project(project_id_from_params)
             else:
@@ -75,6 +131,7 @@ with content:
 
     # Page d'accueil - Sélection/Création de projet
     if st.session_state.project_id is None:
+        arreter_prechauffage()
         st.title("🎶 Accéder à un projet")
         st.markdown("---")
         
@@ -84,7 +141,7 @@ with content:
             del st.session_state.just_left_project
         
         # Onglets pour choisir entre rejoindre ou créer un projet
-        tab1, tab2 = st.tabs(["📁 Rejoindre un projet existant", "➕ Créer un nouveau projet"])
+        tab1, tab2, tab3 = st.tabs(["📁 Rejoindre un projet existant", "➕ Créer un nouveau projet", "📚 Annuaire des projets"])
         
         with tab1:
             st.subheader("Rejoindre un projet")
@@ -94,7 +151,7 @@ with content:
                 if existing_id:
                     is_valid, error_msg = is_valid_project_id(existing_id)
                     if is_valid:
-                        if project_exists(existing_id):
+                        if project_exists(existing_id) or (projet_archive(existing_id) and restaurer_projet(existing_id)):
                             st.session_state.project_id = existing_id
                             st.session_state.project_data = get_project(existing_id)
                             # Sauvegarder dans les query params
@@ -146,7 +203,7 @@ with content:
                 else:
                     is_valid, error_msg = is_valid_project_id(new_id)
                     if is_valid:
-                        if project_exists(new_id):
+                        if project_exists(new_id) or projet_archive(new_id):
                             st.error("❌ Cet identifiant est déjà utilisé. Choisissez-en un autre.")
                         else:
                             create_project(new_id, creator, description)
@@ -159,8 +216,67 @@ with content:
                     else:
                         st.error(f"❌ {error_msg}")
 
+        with tab3:
+            st.subheader("Annuaire des projets")
+            col_recherche, col_createur, col_prefixe, col_tri = st.columns([3, 2, 2, 2])
+            with col_recherche:
+                recherche = st.text_input("Rechercher", placeholder="Mots du pseudo ou de la description...",
+                                          key="annuaire_recherche")
+            with col_createur:
+                createur = st.text_input("Créateur", placeholder="Pseudo...", key="annuaire_createur")
+            with col_prefixe:
+                prefixe = st.text_input("Début de l'identifiant", placeholder="mon_proj...", key="annuaire_prefixe")
+            with col_tri:
+                tri = st.selectbox("Trier par", list(TRIS_ANNUAIRE), key="annuaire_tri",
+                                   format_func={'modification': "Dernière modification", 'creation': "Date de création"}.get)
+
+            # Curseur de chaque page déjà affichée (pagination par clé), remis à zéro quand les critères changent
+            criteres = (recherche, createur, prefixe, tri)
+            if st.session_state.get('annuaire_criteres') != criteres:
+                st.session_state.annuaire_criteres = criteres
+                st.session_state.annuaire_pages = [None]
+            pages = st.session_state.annuaire_pages
+            projets, suivant = lister_projets(tri, pages[-1], recherche=recherche, createur=createur, prefixe=prefixe)
+
+            if not projets:
+                st.info("Aucun projet trouvé. Les projets archivés se rouvrent par leur identifiant.")
+            for projet in projets:
+                col_id, col_infos, col_ouvrir = st.columns([3, 6, 1])
+                with col_id:
+                    st.markdown(f"`{projet[0]}`")
+                with col_infos:
+                    date = projet[2] if tri == 'modification' else projet[1]
+                    libelle = "Modifié le" if tri == 'modification' else "Créé le"
+                    st.caption(f"**{projet[3]}** · {projet[4]} · {libelle} "
+                               f"{datetime.datetime.fromisoformat(date).strftime('%d/%m/%Y %H:%M')}")
+                with col_ouvrir:
+                    if st.button("Ouvrir", key=f"annuaire_ouvrir_{projet[0]}"):
+                        if project_exists(projet[0]) or (projet_archive(projet[0]) and restaurer_projet(projet[0])):
+                            st.session_state.project_id = projet[0]
+                            st.session_state.project_data = get_project(projet[0])
+                            # Sauvegarder dans les query params
+                            set_project_to_query_params(projet[0])
+                            st.rerun()
+                        else:
+                            st.error("❌ Projet non trouvé.")
+
+            col_precedents, col_page, col_suivants = st.columns([1, 4, 1])
+            with col_precedents:
+                if st.button("← Précédents", disabled=len(pages) == 1, key="annuaire_precedents"):
+                    pages.pop()
+                    st.rerun()
+            with col_page:
+                st.caption(f"Page {len(pages)}")
+            with col_suivants:
+                if st.button("Suivants →", disabled=suivant is None, key="annuaire_suivants"):
+                    pages.append(suivant)
+                    st.rerun()
+
     # Page principale de l'application
     else:
+        # Lire les textes et compiler l'aperçu en arrière-plan pendant l'affichage de la page
+        prechauffer_projet(st.session_state.project_id)
+
         # En-tête avec le bouton "Quitter le projet"
         col1, col2 = st.columns([3, 1])
         
@@ -169,6 +285,7 @@ with content:
         
         with col2:
             if st.button("🚪 Retour à l'accès projets"):
+                arreter_prechauffage()
                 st.session_state.project_id = None
                 st.session_state.project_data = None
                 st.session_state.just_left_project = True
@@ -187,17 +304,37 @@ with content:
             with col2:
                 st.subheader("Description")
                 st.write(project_data[4])
+            with st.expander("📦 Archiver le projet"):
+                st.info("Un concert terminé peut être archivé : il quitte la base et sera restauré "
+                        "automatiquement la prochaine fois que quelqu'un le rejoindra.")
+                if st.button("📦 Archiver", key="archiver_projet"):
+                    if archiver_projet(st.session_state.project_id) is not None:
+                        arreter_prechauffage()
+                        st.session_state.project_id = None
+                        st.session_state.project_data = None
+                        st.session_state.just_left_project = True
+                        set_project_to_query_params(None)
+                        st.rerun()
             st.markdown("---")
+
+        # Ne rafraîchir que ce que les autres éditeurs ont modifié depuis la dernière exécution
+        with etape('synchronisation', projet=st.session_state.project_id):
+            synchroniser_session(st.session_state.project_id)
+        surveiller_modifications(st.session_state.project_id)
             
         # Vérifier si on est en mode édition de paroles
         if 'current_morceau_id' in st.session_state:
-            edition_paroles_tableur(
-                st.session_state.current_morceau_id,
-                st.session_state.get('current_morceau_titre', '')
-            )
+            with etape('page.edition_paroles', projet=st.session_state.project_id, morceau=st.session_state.current_morceau_id), \
+                    profiler_page('edition_paroles') as profil_execution:
+                edition_paroles_tableur(
+                    st.session_state.current_morceau_id,
+                    st.session_state.get('current_morceau_titre', '')
+                )
         else:
             # Sinon afficher la gestion des morceaux
-            gestion_morceaux(st.session_state.project_id)
+            with etape('page.gestion_morceaux', projet=st.session_state.project_id), \
+                    profiler_page('gestion_morceaux') as profil_execution:
+                gestion_morceaux(st.session_state.project_id)
 
     # Pied de page
     st.markdown("---")
@@ -206,4 +343,8 @@ with content:
         unsafe_allow_html=True
     )
 
-    st.download_button("Télécharger la base de données", data=open("projects.db", "rb").read(), file_name="projects.db")
\ No newline at end of file
+    if not serveur():
+        telechargement_base()
+
+    if mode_debug:
+        afficher_panneau_traces(terminer_collecte(), profil_execution)
\ No newline at end of file
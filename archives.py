@@ -0,0 +1,231 @@
+"""Archivage des projets terminés.
+
+Un projet archivé quitte la base : ses morceaux, ses tableurs (contenus compris)
+et la diapositive de titre sont écrits dans une archive ZIP compressée du dossier
+DOSSIER_ARCHIVES, puis ses lignes sont supprimées (les pages libérées sont rendues
+au système par maintenance.py). La table projets_archives garde la liste des
+projets archivés ; un projet est restauré à l'identique, mêmes identifiants de
+morceaux compris, quand on le rouvre.
+
+La mémoire de traduction garde les vers des projets archivés : ils restent
+proposés dans les autres projets.
+
+Usage : python archives.py archiver <projet> | restaurer <projet> | liste
+"""
+import datetime
+import json
+import os
+import sys
+import tempfile
+import zipfile
+import streamlit as st
+from connexion import get_connection, debuter_ecriture, reparti, numero_base, CHEMIN_BASE
+from blobs import stocker_blob, lire_blob, liberer_blob_si_orphelin
+from paroles import ecrire_tableur, paroles_indexables
+from recherche import desindexer_morceau
+from surtitres import materialiser_titres
+from traces import tracer
+
+# Dossier archives à côté du fichier de la base (et non du dossier de lancement), comme blobs.DOSSIER_BLOBS ;
+# avec un serveur PostgreSQL, ce dossier doit être partagé par toutes les instances
+DOSSIER_ARCHIVES = os.environ.get('SURTITRES_ARCHIVES') or os.path.join(os.path.dirname(os.path.abspath(CHEMIN_BASE)), 'archives')
+
+COLONNES_PROJET = ['id', 'created_date', 'modified_date', 'creator', 'description', 'concert_frame']
+COLONNES_MORCEAU = ['id', 'ordre', 'air', 'extrait_de', 'compositeur', 'annee', 'text_status']
+COLONNES_TABLEUR = ['morceau_id', 'nom_fichier', 'date_import', 'empreinte', 'taille']
+
+
+def nom_archive(projet_id):
+    return f'{projet_id}.zip'
+
+
+def chemin_archive(fichier):
+    """Chemin d'une archive à partir de son nom inscrit dans projets_archives (basename : inscriptions avec un chemin)"""
+    return os.path.join(DOSSIER_ARCHIVES, os.path.basename(fichier))
+
+
+def base_separee(projet_id):
+    """Indiquer si le projet a sa propre base, distincte du catalogue (connexion.reparti)"""
+    return reparti() and numero_base(projet_id) != 0
+
+
+def projet_archive(projet_id):
+    """Informations d'un projet archivé (projet_id, fichier, taille, creator, description, date_archivage), ou None"""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('SELECT * FROM projets_archives WHERE projet_id = ?', (projet_id,))
+    result = c.fetchone()
+    conn.close()
+    return result
+
+
+def lister_archives():
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('SELECT * FROM projets_archives ORDER BY date_archivage')
+    result = c.fetchall()
+    conn.close()
+    return result
+
+
+def ecrire_archive(chemin, contenu, empreintes):
+    """Écrire l'archive d'un projet (description JSON et contenus des tableurs) par renommage atomique"""
+    os.makedirs(DOSSIER_ARCHIVES, exist_ok=True)
+    fd, chemin_temp = tempfile.mkstemp(dir=DOSSIER_ARCHIVES, prefix='.tmp_')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            with zipfile.ZipFile(f, 'w', compression=zipfile.ZIP_LZMA) as archive:
+                archive.writestr('projet.json', json.dumps(contenu, ensure_ascii=False))
+                for empreinte in empreintes:
+                    # Un contenu à la fois
+                    archive.writestr(f'tableurs/{empreinte}', lire_blob(empreinte))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(chemin_temp, chemin)
+    except Exception:
+        os.remove(chemin_temp)
+        raise
+    return os.path.getsize(chemin)
+
+
+@tracer('archives.archiver')
+def archiver_projet(projet_id):
+    """Archiver un projet et le retirer de la base ; retourne la taille de l'archive, ou None en cas d'erreur"""
+    separee = base_separee(projet_id)
+    conn = get_connection(projet_id=projet_id)
+    c = conn.cursor()
+    try:
+        # Aucune modification du projet entre sa lecture et sa suppression
+        debuter_ecriture(c)
+        c.execute(f'SELECT {", ".join(COLONNES_PROJET)} FROM projects WHERE id = ?', (projet_id,))
+        projet = c.fetchone()
+        if projet is None:
+            raise ValueError(f"projet introuvable : {projet_id}")
+        c.execute(f'SELECT {", ".join(COLONNES_MORCEAU)} FROM morceaux WHERE projet_id = ? ORDER BY ordre', (projet_id,))
+        morceaux = c.fetchall()
+        c.execute(f'''
+            SELECT {", ".join('t.' + colonne for colonne in COLONNES_TABLEUR)}
+            FROM tableurs_paroles t
+            JOIN morceaux m ON m.id = t.morceau_id
+            WHERE m.projet_id = ? AND t.empreinte IS NOT NULL
+        ''', (projet_id,))
+        tableurs = c.fetchall()
+        contenu = {
+            'projet': dict(zip(COLONNES_PROJET, projet)),
+            'morceaux': [dict(zip(COLONNES_MORCEAU, morceau)) for morceau in morceaux],
+            'tableurs': [dict(zip(COLONNES_TABLEUR, tableur)) for tableur in tableurs],
+        }
+        empreintes = sorted({tableur[3] for tableur in tableurs})
+        # Seul le nom du fichier est inscrit : le dossier peut changer (SURTITRES_ARCHIVES)
+        fichier = nom_archive(projet_id)
+        taille = ecrire_archive(chemin_archive(fichier), contenu, empreintes)
+
+        for morceau in morceaux:
+            desindexer_morceau(c, morceau[0])
+        sous_requete = '(SELECT id FROM morceaux WHERE projet_id = ?)'
+        c.execute(f'DELETE FROM fragments_tex WHERE morceau_id IN {sous_requete}', (projet_id,))
+        c.execute(f'DELETE FROM tableurs_paroles WHERE morceau_id IN {sous_requete}', (projet_id,))
+        c.execute('DELETE FROM morceaux WHERE projet_id = ?', (projet_id,))
+        c.execute('DELETE FROM journal_modifications WHERE projet_id = ?', (projet_id,))
+        c.execute('DELETE FROM projects WHERE id = ?', (projet_id,))
+
+        inscription = (projet_id, fichier, taille, projet[3], projet[4], datetime.datetime.now().isoformat())
+        if not separee:
+            inscrire_archive(c, inscription)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        st.error(f"Erreur lors de l'archivage : {e}")
+        return None
+    finally:
+        conn.close()
+
+    if separee:
+        # Le projet quitte la liste du catalogue ; sa base reste, vide, pour sa restauration
+        conn = get_connection()
+        c = conn.cursor()
+        c.execute('DELETE FROM projects WHERE id = ?', (projet_id,))
+        inscrire_archive(c, inscription)
+        conn.commit()
+        conn.close()
+
+    for empreinte in empreintes:
+        liberer_blob_si_orphelin(empreinte)
+    return taille
+
+
+def inscrire_archive(c, inscription):
+    c.execute('''
+        INSERT INTO projets_archives (projet_id, fichier, taille, creator, description, date_archivage)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', inscription)
+
+
+@tracer('archives.restaurer')
+def restaurer_projet(projet_id):
+    """Restaurer un projet archivé dans la base ; retourne True s'il a été restauré"""
+    archive = projet_archive(projet_id)
+    if archive is None:
+        return False
+    fichier = chemin_archive(archive[1])
+    separee = base_separee(projet_id)
+    conn = get_connection(projet_id=projet_id)
+    c = conn.cursor()
+    try:
+        with zipfile.ZipFile(fichier) as zip_archive:
+            contenu = json.loads(zip_archive.read('projet.json'))
+            projet = contenu['projet']
+            debuter_ecriture(c)
+            c.execute(f'''
+                INSERT INTO projects ({", ".join(COLONNES_PROJET)}) VALUES ({", ".join('?' * len(COLONNES_PROJET))})
+            ''', [projet[colonne] for colonne in COLONNES_PROJET])
+            # Identifiants d'origine : jamais réattribués (AUTOINCREMENT), les liens vers les morceaux restent valables
+            for morceau in contenu['morceaux']:
+                c.execute(f'''
+                    INSERT INTO morceaux (projet_id, {", ".join(COLONNES_MORCEAU)})
+                    VALUES (?, {", ".join('?' * len(COLONNES_MORCEAU))})
+                ''', [projet_id] + [morceau[colonne] for colonne in COLONNES_MORCEAU])
+                materialiser_titres(c, morceau['id'])
+            for tableur in contenu['tableurs']:
+                donnees = zip_archive.read(f"tableurs/{tableur['empreinte']}")
+                ecrire_tableur(c, tableur['morceau_id'], tableur['nom_fichier'], stocker_blob(donnees), len(donnees),
+                               paroles_indexables(tableur['nom_fichier'], donnees))
+                c.execute('UPDATE tableurs_paroles SET date_import = ? WHERE morceau_id = ?',
+                          (tableur['date_import'], tableur['morceau_id']))
+        # Dates d'origine, après les triggers qui datent chaque modification
+        c.execute('UPDATE projects SET created_date = ?, modified_date = ? WHERE id = ?',
+                  (projet['created_date'], projet['modified_date'], projet_id))
+        if not separee:
+            c.execute('DELETE FROM projets_archives WHERE projet_id = ?', (projet_id,))
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        st.error(f"Erreur lors de la restauration : {e}")
+        return False
+    finally:
+        conn.close()
+
+    if separee:
+        conn = get_connection()
+        c = conn.cursor()
+        c.execute('''
+            INSERT INTO projects (id, created_date, modified_date, creator, description)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (projet_id, projet['created_date'], projet['modified_date'], projet['creator'], projet['description']))
+        c.execute('DELETE FROM projets_archives WHERE projet_id = ?', (projet_id,))
+        conn.commit()
+        conn.close()
+    os.remove(fichier)
+    return True
+
+
+if __name__ == '__main__':
+    action = sys.argv[1] if len(sys.argv) > 1 else 'liste'
+    if action == 'archiver':
+        taille = archiver_projet(sys.argv[2])
+        print(f"{sys.argv[2]} archivé ({taille / 1024:.0f} Kio)" if taille is not None else "Échec de l'archivage")
+    elif action == 'restaurer':
+        print(f"{sys.argv[2]} restauré" if restaurer_projet(sys.argv[2]) else "Échec de la restauration")
+    else:
+        for projet_id, fichier, taille, creator, description, date_archivage in lister_archives():
+            print(f"{projet_id}\t{date_archivage}\t{taille / 1024:.0f} Kio\t{creator}\t{chemin_archive(fichier)}")
@@ -0,0 +1,185 @@
+import os
+import signal
+import subprocess
+import time
+
+# Exécution de pdflatex dans un bac à sable : le code LaTeX (dont la diapositive de titre du concert)
+# est modifiable par les utilisateurs et ne doit pas pouvoir bloquer ou saturer le serveur.
+# Limites réglables par variables d'environnement.
+DUREE_MAX = float(os.environ.get('SURTITRES_PDFLATEX_DUREE', 60))                  # secondes, temps réel
+CPU_MAX = int(os.environ.get('SURTITRES_PDFLATEX_CPU', 30))                        # secondes de processeur
+MEMOIRE_MAX = int(os.environ.get('SURTITRES_PDFLATEX_MEMOIRE', 1024)) * 1024 ** 2  # espace d'adressage (Mio)
+FICHIER_MAX = int(os.environ.get('SURTITRES_PDFLATEX_FICHIER', 64)) * 1024 ** 2    # taille d'un fichier écrit (Mio)
+QUOTA_REPERTOIRE = int(os.environ.get('SURTITRES_PDFLATEX_QUOTA', 128)) * 1024 ** 2  # total du répertoire de travail (Mio)
+
+# Intervalle de surveillance du processus (durée et quota)
+INTERVALLE = 0.05
+# Seule la fin des sorties est conservée pour l'affichage des erreurs
+SORTIE_MAX = 256 * 1024
+
+MOTIFS_ARRET = {
+    'duree': f"durée maximale dépassée ({DUREE_MAX:g} s)",
+    'cpu': f"temps de calcul maximal dépassé ({CPU_MAX} s)",
+    'fichier': f"fichier trop volumineux (plus de {FICHIER_MAX // 1024 ** 2} Mio)",
+    'quota': f"fichiers trop volumineux (plus de {QUOTA_REPERTOIRE // 1024 ** 2} Mio au total)",
+    'annule': "compilation annulée",
+}
+
+
+class Compilation(subprocess.CompletedProcess):
+    """Résultat de pdflatex, avec le motif d'un éventuel arrêt forcé et les ressources consommées
+
+    arret : None, ou une clé de MOTIFS_ARRET ; ressources : durée et temps de calcul (s),
+    mémoire résidente maximale de pdflatex (Kio, memoire_programme) et octets écrits
+    dans le répertoire de travail.
+    """
+
+    def __init__(self, args, returncode, stdout, stderr, arret, ressources):
+        super().__init__(args, returncode, stdout, stderr)
+        self.arret = arret
+        self.ressources = ressources
+
+    def motif_arret(self):
+        return MOTIFS_ARRET.get(self.arret)
+
+
+def commande_limitee(args, basse_priorite):
+    """Préfixer args de prlimit (et nice) : les limites sont posées avant l'exec de pdflatex
+
+    Aucun code Python ne s'exécute entre le fork et l'exec (compilations lancées depuis
+    des threads) ; prlimit et nice font chacun un exec, le pid reste celui de pdflatex.
+    """
+    prefixe = [
+        "prlimit",
+        # Limite CPU douce : SIGXCPU, puis SIGKILL une seconde plus tard si le signal est ignoré
+        f"--cpu={CPU_MAX}:{CPU_MAX + 1}",
+        f"--as={MEMOIRE_MAX}",
+        f"--fsize={FICHIER_MAX}",
+        "--core=0",
+    ]
+    if basse_priorite:
+        prefixe += ["nice", "-n", "10"]
+    return prefixe + args
+
+
+def taille_repertoire(chemin):
+    total = 0
+    for racine, _, fichiers in os.walk(chemin):
+        for nom in fichiers:
+            try:
+                total += os.lstat(os.path.join(racine, nom)).st_size
+            except FileNotFoundError:
+                pass
+    return total
+
+
+def _lire_fin(chemin):
+    with open(chemin, 'rb') as f:
+        f.seek(0, os.SEEK_END)
+        f.seek(max(0, f.tell() - SORTIE_MAX))
+        return f.read()
+
+
+def memoire_programme(pid):
+    """Pic de mémoire résidente (Kio) du programme que le processus pid exécute, 0 s'il n'est plus lisible
+
+    ru_maxrss ne convient pas pour pdflatex : il cumule les programmes exécutés par le même
+    processus (prlimit, nice, puis pdflatex), alors que VmHWM repart de zéro à chaque exec.
+    """
+    try:
+        with open(f'/proc/{pid}/status') as f:
+            for ligne in f:
+                if ligne.startswith('VmHWM:'):
+                    return int(ligne.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def tuer_groupe(pid):
+    """Tuer pdflatex et les processus qu'il a lancés (le groupe dont il est chef)"""
+    try:
+        os.killpg(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+def executer_pdflatex(tex_path, repertoire, basse_priorite=False, annule=None, lance=None):
+    """Compiler tex_path dans repertoire (répertoire de travail propre à la compilation)
+
+    pdflatex est lancé sans shell-escape, avec des limites de temps de calcul, de
+    mémoire et de taille de fichier ; la durée totale et le volume écrit dans le
+    répertoire sont surveillés. En cas de dépassement, tout le groupe de processus
+    est tué. Retourne une Compilation.
+    annule : threading.Event qui arrête la compilation (arret 'annule') ;
+    lance : appelée avec le processus dès son lancement, pour qu'il puisse être tué
+    sans attendre la surveillance (tuer_groupe).
+    """
+    args = ["pdflatex", "-no-shell-escape", "-interaction=nonstopmode", tex_path]
+    # Écritures limitées au répertoire de travail (pas de chemins absolus ni de ..)
+    env = {**os.environ, 'openout_any': 'p', 'shell_escape': 'f'}
+    env.pop('TEXMFOUTPUT', None)
+
+    sortie_path = os.path.join(repertoire, '.sortie')
+    erreurs_path = os.path.join(repertoire, '.erreurs')
+    debut = time.perf_counter()
+    with open(sortie_path, 'wb') as sortie, open(erreurs_path, 'wb') as erreurs:
+        processus = subprocess.Popen(
+            commande_limitee(args, basse_priorite),
+            cwd=repertoire,
+            env=env,
+            stdin=subprocess.DEVNULL,
+            stdout=sortie,
+            stderr=erreurs,
+            start_new_session=True
+        )
+    if lance is not None:
+        lance(processus)
+
+    arret = None
+    memoire_max = 0
+    try:
+        while True:
+            # Relevé avant l'attente : la mémoire d'un processus terminé n'est plus lisible
+            memoire_max = max(memoire_max, memoire_programme(processus.pid))
+            pid, statut, usage = os.wait4(processus.pid, os.WNOHANG)
+            if pid:
+                break
+            if annule is not None and annule.is_set():
+                arret = 'annule'
+            elif time.perf_counter() - debut > DUREE_MAX:
+                arret = 'duree'
+            elif taille_repertoire(repertoire) > QUOTA_REPERTOIRE:
+                arret = 'quota'
+            if arret:
+                tuer_groupe(processus.pid)
+                _, statut, usage = os.wait4(processus.pid, 0)
+                break
+            time.sleep(INTERVALLE)
+    except BaseException:
+        # Exécution interrompue (arrêt du script) : ne pas laisser pdflatex tourner
+        tuer_groupe(processus.pid)
+        processus.wait()
+        raise
+    # Processus éventuellement lancés par pdflatex et restés dans le groupe
+    tuer_groupe(processus.pid)
+    processus.returncode = os.waitstatus_to_exitcode(statut)
+
+    if arret is None and os.WIFSIGNALED(statut):
+        signal_recu = os.WTERMSIG(statut)
+        if annule is not None and annule.is_set():
+            # Tué par celui qui a annulé la compilation (lance)
+            arret = 'annule'
+        elif signal_recu == signal.SIGXCPU or (signal_recu == signal.SIGKILL and usage.ru_utime + usage.ru_stime >= CPU_MAX):
+            arret = 'cpu'
+        elif signal_recu == signal.SIGXFSZ:
+            arret = 'fichier'
+
+    ressources = {
+        'duree_s': round(time.perf_counter() - debut, 3),
+        'cpu_s': round(usage.ru_utime + usage.ru_stime, 3),
+        # Relevée toutes les INTERVALLE secondes (la croissance après le dernier relevé échappe à la mesure)
+        'memoire_max_kio': memoire_max,
+        'octets_ecrits': taille_repertoire(repertoire),
+    }
+    return Compilation(args, processus.returncode, _lire_fin(sortie_path), _lire_fin(erreurs_path), arret, ressources)
@@ -0,0 +1,148 @@
+import functools
+import os
+import re
+import threading
+from psycopg_pool import ConnectionPool
+
+# Base PostgreSQL partagée par plusieurs instances de l'application (SURTITRES_BASE=postgresql://...).
+# Les connexions retournées ici ont la même interface que sqlite3 (cursor, execute, executemany,
+# commit, close). Les requêtes communes aux deux moteurs sont écrites avec les paramètres de sqlite3
+# (?, :nom), récrits dans le style de psycopg ; les requêtes propres à PostgreSQL sont dans stockage_serveur.
+
+CONNEXIONS_MIN = int(os.environ.get('SURTITRES_BASE_CONNEXIONS_MIN', 1))
+CONNEXIONS_MAX = int(os.environ.get('SURTITRES_BASE_CONNEXIONS_MAX', 10))
+
+_pools = {}
+_verrou_pools = threading.Lock()
+
+# Éléments d'une requête : ceux dont le texte est recopié tel quel (chaînes, identifiants entre guillemets,
+# commentaires, corps $$ ... $$, conversions ::) et ceux à récrire (paramètres, % à doubler pour psycopg)
+_element = re.compile(r"""
+    '(?:[^']|'')*'
+  | "(?:[^"]|"")*"
+  | --[^\n]*
+  | \$(?P<etiquette>\w*)\$.*?\$(?P=etiquette)\$
+  | ::
+  | \?
+  | :(?P<nom>[A-Za-z_]\w*)
+  | %
+""", re.VERBOSE | re.DOTALL)
+
+def _parametre(element):
+    texte = element.group(0)
+    if texte == '?':
+        return '%s'
+    if element.group('nom'):
+        return f"%({element.group('nom')})s"
+    return texte.replace('%', '%%')
+
+
+@functools.lru_cache(maxsize=512)
+def parametres_psycopg(requete):
+    """Écrire les paramètres d'une requête (?, :nom) dans le style de psycopg (%s, %(nom)s)
+
+    Seuls les paramètres changent (mise en cache : les requêtes sont des constantes).
+    """
+    return _element.sub(_parametre, requete)
+
+
+class CurseurServeur:
+    """Curseur psycopg présenté comme un curseur sqlite3"""
+
+    def __init__(self, curseur):
+        self._curseur = curseur
+
+    def execute(self, requete, parametres=None):
+        # Sans paramètres, psycopg envoie la requête telle quelle
+        self._curseur.execute(requete if parametres is None else parametres_psycopg(requete), parametres)
+        return self
+
+    def executemany(self, requete, suite_parametres):
+        # psycopg envoie les exécutions en mode pipeline : un aller-retour par lot, pas par ligne
+        suite_parametres = list(suite_parametres)
+        if suite_parametres:
+            self._curseur.executemany(parametres_psycopg(requete), suite_parametres)
+        return self
+
+    def fetchone(self):
+        return self._curseur.fetchone()
+
+    def fetchall(self):
+        return self._curseur.fetchall()
+
+    def fetchmany(self, taille=1):
+        return self._curseur.fetchmany(taille)
+
+    def __iter__(self):
+        return iter(self._curseur)
+
+    @property
+    def rowcount(self):
+        return self._curseur.rowcount
+
+    @property
+    def description(self):
+        return self._curseur.description
+
+    def close(self):
+        self._curseur.close()
+
+
+class ConnexionServeur:
+    """Connexion empruntée au pool, rendue par close() (transaction en cours annulée, comme sqlite3)"""
+
+    def __init__(self, pool):
+        self._pool = pool
+        self._connexion = pool.getconn()
+
+    def cursor(self):
+        return CurseurServeur(self._connexion.cursor())
+
+    def execute(self, requete, parametres=None):
+        return self.cursor().execute(requete, parametres)
+
+    def executemany(self, requete, suite_parametres):
+        return self.cursor().executemany(requete, suite_parametres)
+
+    def commit(self):
+        self._connexion.commit()
+
+    def rollback(self):
+        self._connexion.rollback()
+
+    def close(self):
+        if self._connexion is not None:
+            self._connexion.rollback()
+            self._pool.putconn(self._connexion)
+            self._connexion = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, type_exc, exc, tb):
+        # Même comportement que sqlite3 : validation ou annulation, sans fermeture
+        if type_exc is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
+
+
+def pool(url):
+    """Pool de connexions du processus pour une URL (ouvert à la première utilisation)"""
+    with _verrou_pools:
+        if url not in _pools:
+            _pools[url] = ConnectionPool(url, min_size=CONNEXIONS_MIN, max_size=CONNEXIONS_MAX, open=True)
+        return _pools[url]
+
+
+def connecter(url):
+    return ConnexionServeur(pool(url))
+
+
+def fermer(url):
+    """Fermer le pool de connexions d'une URL (avant de supprimer sa base)"""
+    with _verrou_pools:
+        pool_url = _pools.pop(url, None)
+    if pool_url is not None:
+        pool_url.close()
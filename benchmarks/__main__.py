@@ -0,0 +1,191 @@
+"""Mesures de performance de la génération des surtitres et du stockage.
+
+Usage (depuis la racine du dépôt) :
+    python -m benchmarks                  # mesure et compare à benchmarks/reference.json
+    python -m benchmarks --enregistrer    # mesure et enregistre la nouvelle référence
+    python -m benchmarks --taille grande  # 100 morceaux x 500 lignes
+
+Les mesures tournent dans un dossier temporaire (base et blobs synthétiques) :
+la vraie base projects.db n'est jamais touchée. Le code de sortie vaut 1 si une
+mesure dépasse sa référence de plus que le seuil autorisé.
+"""
+import argparse
+import datetime
+import itertools
+import json
+import os
+import platform
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+RACINE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RACINE)
+
+import streamlit.logger
+streamlit.logger.set_log_level('error')  # st.* hors de l'application : avertissements sans intérêt ici
+
+import morceaux_back
+from utils import init_databases
+from surtitres import generate_text, generate_frame_title, generate_concert, assembler_concert, compile_latex
+from paroles import charger_paroles_depuis_tableur, charger_tableur, lire_tableur, normaliser_colonnes, tableur_depuis_paroles
+from relecture import relire_textes
+from benchmarks.donnees import generer_projet, generer_paroles
+
+REFERENCE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'reference.json')
+
+# Écart toléré par rapport à la référence avant de signaler une régression (+25 %)
+SEUIL_DEFAUT = 0.25
+
+# (nombre de morceaux, nombre de lignes par morceau)
+TAILLES = {
+    'petite': (10, 50),
+    'moyenne': (30, 200),
+    'grande': (100, 500),
+}
+
+PROJET = 'benchmark_projet'
+
+def mesurer(fonction, repetitions):
+    """Exécuter une fonction plusieurs fois et retourner la médiane et le minimum des durées"""
+    durees = []
+    for _ in range(repetitions):
+        debut = time.perf_counter()
+        fonction()
+        durees.append(time.perf_counter() - debut)
+    return {'mediane_s': statistics.median(durees), 'min_s': min(durees), 'repetitions': repetitions}
+
+def cas_de_mesure(morceau_ids, nb_lignes):
+    """Construire la liste des mesures (nom, fonction, répétitions)"""
+    premier = morceau_ids[0]
+    df = generer_paroles(nb_lignes)
+    paroles = {morceau_id: charger_paroles_depuis_tableur(morceau_id) for morceau_id in morceau_ids}
+    nom_fichier, donnees = charger_tableur(premier)
+    donnees = bytes(donnees)
+    titre = generate_frame_title(premier, mode='poème')
+    ordre_max = morceaux_back.get_max_ordre(PROJET)
+
+    def ajouter_puis_supprimer():
+        morceau_id = morceaux_back.ajouter_morceau(PROJET, ordre_max + 1, "Air temporaire", "", "", "")
+        morceaux_back.supprimer_morceau(morceau_id)
+
+    positions = itertools.cycle([len(morceau_ids) // 2 + 1, 1])
+    ordres = itertools.cycle([list(reversed(morceau_ids)), list(morceau_ids)])
+
+    def modifier_morceau():
+        _, ordre, air, compositeur, annee, extrait_de, text_status = morceaux_back.get_morceau(premier)
+        morceaux_back.mettre_a_jour_morceau(premier, ordre, air, compositeur, annee, extrait_de,
+                                            'draft' if text_status != 'draft' else 'validated')
+
+    cas = [
+        # Génération du LaTeX
+        ('generate_text_opera', lambda: generate_text(df, mode='opéra'), 20),
+        ('generate_text_poeme', lambda: generate_text(df, mode='poème', title=titre), 20),
+        ('generate_frame_title', lambda: generate_frame_title(premier, mode='opéra'), 200),
+        ('concert_opera', lambda: generate_concert(morceau_ids, paroles.get, mode='opéra'), 3),
+        ('concert_poeme', lambda: generate_concert(morceau_ids, paroles.get, mode='poème'), 3),
+        ('assembler_concert_opera', lambda: assembler_concert(PROJET, mode='opéra'), 50),
+        ('assembler_concert_poeme', lambda: assembler_concert(PROJET, mode='poème'), 50),
+        # Tableurs
+        ('tableur_lecture', lambda: normaliser_colonnes(lire_tableur(nom_fichier, donnees)), 10),
+        ('tableur_ecriture', lambda: tableur_depuis_paroles(df), 10),
+        ('charger_paroles_depuis_tableur', lambda: charger_paroles_depuis_tableur(premier), 10),
+        # Relecture de tous les textes du projet
+        ('relire_textes', lambda: relire_textes(list(paroles.items())), 10),
+        # Requêtes de morceaux_back
+        ('charger_morceaux', lambda: morceaux_back.charger_morceaux(PROJET), 200),
+        ('get_max_ordre', lambda: morceaux_back.get_max_ordre(PROJET), 200),
+        ('get_morceau', lambda: morceaux_back.get_morceau(premier), 200),
+        ('get_concert_frame', lambda: morceaux_back.get_concert_frame(PROJET), 200),
+        ('get_project', lambda: morceaux_back.get_project(PROJET), 200),
+        ('get_revision_morceau', lambda: morceaux_back.get_revision_morceau(premier), 200),
+        ('morceaux_modifies_depuis', lambda: morceaux_back.morceaux_modifies_depuis(PROJET, 0), 200),
+        ('update_concert_frame', lambda: morceaux_back.update_concert_frame(PROJET, f"% {time.time()}"), 50),
+        ('mettre_a_jour_morceau', modifier_morceau, 50),
+        ('deplacer_morceau', lambda: morceaux_back.deplacer_morceau(premier, next(positions)), 50),
+        ('reordonner_morceaux', lambda: morceaux_back.reordonner_morceaux(PROJET, next(ordres)), 10),
+        ('nettoyer_ordre_morceaux', lambda: morceaux_back.nettoyer_ordre_morceaux(PROJET), 10),
+        ('ajouter_supprimer_morceau', ajouter_puis_supprimer, 20),
+    ]
+    if shutil.which('pdflatex'):
+        frames = generate_concert(morceau_ids[:3], paroles.get, mode='opéra')
+        cas.append(('compilation_pdflatex', lambda: compile_latex(frames, mode='opéra'), 1))
+    else:
+        print("pdflatex introuvable : la mesure de compilation est ignorée")
+    return cas
+
+def comparer(resultats, reference):
+    """Comparer les médianes à la référence ; retourne la liste des régressions"""
+    regressions = []
+    for nom, mesure in resultats.items():
+        ref = reference.get('resultats', {}).get(nom)
+        if ref is None:
+            continue
+        seuil = reference.get('seuils', {}).get(nom, SEUIL_DEFAUT)
+        if mesure['mediane_s'] > ref['mediane_s'] * (1 + seuil):
+            regressions.append((nom, ref['mediane_s'], mesure['mediane_s'], seuil))
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="Mesures de performance des surtitres")
+    parser.add_argument('--taille', choices=TAILLES, default='petite')
+    parser.add_argument('--enregistrer', action='store_true', help="Enregistrer les résultats comme nouvelle référence")
+    parser.add_argument('--sortie', help="Écrire aussi les résultats bruts dans ce fichier JSON")
+    args = parser.parse_args()
+
+    nb_morceaux, nb_lignes = TAILLES[args.taille]
+    dossier_initial = os.getcwd()
+    with tempfile.TemporaryDirectory() as dossier:
+        os.chdir(dossier)
+        try:
+            init_databases()
+            print(f"Génération de {nb_morceaux} morceaux x {nb_lignes} lignes...")
+            morceau_ids = generer_projet(PROJET, nb_morceaux, nb_lignes)
+
+            resultats = {}
+            for nom, fonction, repetitions in cas_de_mesure(morceau_ids, nb_lignes):
+                resultats[nom] = mesurer(fonction, repetitions)
+                print(f"  {nom:<32} {resultats[nom]['mediane_s'] * 1000:10.3f} ms")
+        finally:
+            os.chdir(dossier_initial)
+
+    execution = {
+        'taille': args.taille,
+        'date': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'machine': platform.platform(),
+        'resultats': resultats,
+    }
+    if args.sortie:
+        with open(args.sortie, 'w') as f:
+            json.dump(execution, f, indent=2)
+
+    references = {}
+    if os.path.exists(REFERENCE):
+        with open(REFERENCE) as f:
+            references = json.load(f)
+
+    if args.enregistrer:
+        # Les seuils personnalisés de la référence existante sont conservés
+        execution['seuils'] = references.get(args.taille, {}).get('seuils', {})
+        references[args.taille] = execution
+        with open(REFERENCE, 'w') as f:
+            json.dump(references, f, indent=2)
+        print(f"Référence '{args.taille}' enregistrée dans {REFERENCE}")
+        return 0
+
+    if args.taille not in references:
+        print(f"Aucune référence '{args.taille}' : relancez avec --enregistrer pour en créer une")
+        return 0
+
+    regressions = comparer(resultats, references[args.taille])
+    for nom, ref, mesure, seuil in regressions:
+        print(f"RÉGRESSION {nom} : {ref * 1000:.3f} ms -> {mesure * 1000:.3f} ms (seuil +{seuil:.0%})")
+    if not regressions:
+        print("Aucune régression")
+    return 1 if regressions else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
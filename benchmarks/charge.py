@@ -0,0 +1,350 @@
+"""Test de charge : plusieurs utilisateurs simultanés sur l'application.
+
+Usage (depuis la racine du dépôt) :
+    python -m benchmarks.charge                              # 10 utilisateurs, 60 s, un projet
+    python -m benchmarks.charge --utilisateurs 25 --duree 120
+    python -m benchmarks.charge --projets 3 --sortie charge.json
+
+Chaque utilisateur est une session de app.py pilotée sans navigateur par l'API
+de test de Streamlit (AppTest), dans son propre fil : il rejoint un projet, puis
+enchaîne au hasard des éditions de lignes (edition_paroles_tableur), des
+déplacements de morceaux et des changements d'options de l'aperçu (nouvelle
+compilation). Tout tourne dans un dossier temporaire, sur des projets
+synthétiques : la vraie base n'est jamais touchée.
+
+Le rapport donne les percentiles de latence des exécutions de la page par
+action, les attentes du verrou d'écriture de la base (BEGIN IMMEDIATE) et les
+erreurs « database is locked », la mémoire résidente maximale du processus et
+des compilations, et le nombre maximal de pdflatex simultanés. pdflatex doit
+être installé : sans lui, le test s'arrête avant de commencer.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import random
+import resource
+import shutil
+import sqlite3
+import sys
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+RACINE = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RACINE)
+
+import streamlit.logger
+streamlit.logger.set_log_level('error')  # st.* hors de l'application : avertissements sans intérêt ici
+from streamlit.runtime import Runtime
+from streamlit.testing.v1 import AppTest
+import streamlit.testing.v1.app_test as app_test
+import streamlit.testing.v1.local_script_runner as local_script_runner
+
+import connexion
+import surtitres
+from utils import init_databases
+from morceaux_back import charger_morceaux
+from benchmarks.donnees import generer_projet
+
+APPLICATION = os.path.join(RACINE, 'app.py')
+# Délai maximal d'une exécution de la page (compilation comprise)
+DELAI_EXECUTION = 300
+# Poids des actions tirées au hasard par chaque utilisateur
+ACTIONS = {'edition': 5, 'deplacement': 2, 'apercu': 3}
+PERCENTILES = (50, 90, 99)
+
+
+class Mesures:
+    """Mesures partagées par tous les utilisateurs"""
+
+    def __init__(self):
+        self.verrou = threading.Lock()
+        self.latences = {}
+        self.erreurs = {}
+        self.attentes_verrou = []
+        self.base_verrouillee = 0
+        self.pdflatex_en_cours = 0
+        self.pdflatex_max = 0
+        # Compilations menées à leur terme par pdflatex (ni lancement impossible, ni arrêt forcé)
+        self.durees_pdflatex = []
+        self.memoire_pdflatex_kio = 0
+        self.pdflatex_echecs = 0
+
+    def latence(self, action, duree, erreurs):
+        with self.verrou:
+            self.latences.setdefault(action, []).append(duree)
+            if erreurs:
+                self.erreurs.setdefault(action, []).extend(erreurs)
+
+
+mesures = Mesures()
+
+
+class CurseurMesure(sqlite3.Cursor):
+    """Curseur qui mesure l'attente du verrou d'écriture"""
+
+    def execute(self, sql, parametres=()):
+        debut = time.perf_counter()
+        try:
+            resultat = super().execute(sql, parametres)
+        except sqlite3.OperationalError as e:
+            if 'locked' in str(e):
+                with mesures.verrou:
+                    mesures.base_verrouillee += 1
+            raise
+        if sql.lstrip().upper().startswith('BEGIN IMMEDIATE'):
+            with mesures.verrou:
+                mesures.attentes_verrou.append(time.perf_counter() - debut)
+        return resultat
+
+
+class ConnexionMesure(sqlite3.Connection):
+    def cursor(self, factory=CurseurMesure):
+        return super().cursor(factory)
+
+    def execute(self, sql, parametres=()):
+        return self.cursor().execute(sql, parametres)
+
+
+def connecter_mesure(chemin):
+    return sqlite3.connect(chemin, factory=ConnexionMesure)
+
+
+def executer_pdflatex_mesure(executer):
+    """Envelopper executer_pdflatex pour compter les compilations simultanées
+
+    Seules les compilations que pdflatex a menées à leur terme entrent dans les
+    durées et la mémoire maximale (celle du processus pdflatex lui-même,
+    bac_a_sable.Compilation.ressources) ; les autres sont comptées comme échecs.
+    """
+    def envelopper(*args, **kwargs):
+        with mesures.verrou:
+            mesures.pdflatex_en_cours += 1
+            mesures.pdflatex_max = max(mesures.pdflatex_max, mesures.pdflatex_en_cours)
+        resultat = None
+        try:
+            resultat = executer(*args, **kwargs)
+            return resultat
+        finally:
+            with mesures.verrou:
+                mesures.pdflatex_en_cours -= 1
+                if resultat is None or resultat.arret is not None:
+                    mesures.pdflatex_echecs += 1
+                else:
+                    mesures.durees_pdflatex.append(resultat.ressources['duree_s'])
+                    mesures.memoire_pdflatex_kio = max(mesures.memoire_pdflatex_kio,
+                                                       resultat.ressources['memoire_max_kio'])
+    return envelopper
+
+
+def partager_runtime():
+    """Un seul Runtime factice et un seul cache du script compilé pour toutes les sessions, comme sur le serveur
+
+    AppTest installe un Runtime factice global au début de chaque exécution et le
+    retire à la fin : avec des sessions simultanées, la première qui se termine le
+    retirerait à toutes les autres. Il recompile aussi app.py à chaque exécution.
+    """
+    runtime = app_test.MagicMock(spec=Runtime)
+    cache = app_test.ScriptCache()
+    app_test.ScriptCache = local_script_runner.ScriptCache = lambda: cache
+    app_test.MagicMock = lambda *args, **kwargs: runtime
+    Runtime.instance = classmethod(lambda cls: runtime)
+    Runtime.exists = classmethod(lambda cls: True)
+
+
+class Utilisateur:
+    """Une session de l'application, pilotée comme par un navigateur"""
+
+    def __init__(self, numero, projet_id, graine):
+        self.numero = numero
+        self.projet_id = projet_id
+        self.hasard = random.Random(graine)
+        self.at = AppTest.from_file(APPLICATION, default_timeout=DELAI_EXECUTION)
+
+    def executer(self, action):
+        """Exécuter la page et enregistrer sa latence pour cette action"""
+        debut = time.perf_counter()
+        self.at.run()
+        erreurs = [str(e.value) for e in self.at.exception] + [str(e.value) for e in self.at.error]
+        mesures.latence(action, time.perf_counter() - debut, erreurs)
+
+    def bouton(self, cle=None, libelle=None):
+        for bouton in self.at.button:
+            if (cle is not None and bouton.key == cle) or (libelle is not None and libelle in bouton.label):
+                return bouton
+        return None
+
+    def rejoindre(self):
+        self.executer('accueil')
+        self.at.text_input(key='join_id').set_value(self.projet_id)
+        self.bouton('join_btn').click()
+        self.executer('rejoindre')
+
+    def edition(self):
+        """Ouvrir un texte, modifier la traduction d'une ligne, l'enregistrer et revenir à la liste"""
+        morceau_id = self.hasard.choice([m[0] for m in charger_morceaux(self.projet_id)])
+        ouvrir = self.bouton(f'paroles_btn_{morceau_id}')
+        if ouvrir is None:
+            return
+        ouvrir.click()
+        self.executer('ouvrir_texte')
+        lignes = [b.key for b in self.at.button if b.key and b.key.startswith('edit_') and b.key[5:].isdigit()]
+        if lignes:
+            index = self.hasard.choice(lignes)[5:]
+            self.bouton(f'edit_{index}').click()
+            self.executer('editer_ligne')
+            champ = [t for t in self.at.text_area if t.key == f'edit_trad_{index}']
+            if champ:
+                champ[0].set_value(f"Traduction {self.numero} {time.time():.3f}")
+                self.bouton(f'save_line_{index}').click()
+                self.executer('sauver_ligne')
+        retour = self.bouton(libelle='Retour à la liste des morceaux')
+        if retour is not None:
+            retour.click()
+            self.executer('retour_liste')
+
+    def deplacement(self):
+        """Changer la position d'un morceau par son formulaire d'édition"""
+        morceaux = charger_morceaux(self.projet_id)
+        morceau_id = self.hasard.choice([m[0] for m in morceaux])
+        editer = self.bouton(f'edit_btn_{morceau_id}')
+        if editer is None:
+            return
+        editer.click()
+        self.executer('editer_morceau')
+        position = [n for n in self.at.number_input if n.key == f'edit_ordre_{morceau_id}']
+        if position:
+            position[0].set_value(self.hasard.randint(1, len(morceaux)))
+            self.bouton(f'save_{morceau_id}').click()
+            self.executer('deplacer_morceau')
+
+    def apercu(self):
+        """Changer une option de l'aperçu : le document change et est recompilé (ou repris du cache)"""
+        case = [c for c in self.at.checkbox if 'diapositive blanche' in c.label]
+        if case:
+            case[0].set_value(not case[0].value)
+        self.executer('apercu')
+
+    def jouer(self, fin):
+        self.rejoindre()
+        actions, poids = zip(*ACTIONS.items())
+        while time.monotonic() < fin:
+            action = self.hasard.choices(actions, poids)[0]
+            try:
+                getattr(self, action)()
+            except Exception as e:
+                mesures.latence(action, 0.0, [f"{type(e).__name__} : {e}"])
+                # Session dans un état inattendu : l'utilisateur recharge la page
+                self.at = AppTest.from_file(APPLICATION, default_timeout=DELAI_EXECUTION)
+                self.rejoindre()
+
+
+def percentiles(valeurs):
+    if not valeurs:
+        return {}
+    resultats = {f'p{p}_ms': round(float(np.percentile(valeurs, p)) * 1000, 1) for p in PERCENTILES}
+    resultats['max_ms'] = round(max(valeurs) * 1000, 1)
+    resultats['nombre'] = len(valeurs)
+    return resultats
+
+
+def rapport():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return {
+        'latences': {action: percentiles(durees) for action, durees in sorted(mesures.latences.items())},
+        'erreurs': {action: len(erreurs) for action, erreurs in mesures.erreurs.items()},
+        'exemples_erreurs': sorted({e for erreurs in mesures.erreurs.values() for e in erreurs})[:10],
+        'attente_verrou': percentiles(mesures.attentes_verrou),
+        'base_verrouillee': mesures.base_verrouillee,
+        # ru_maxrss en Kio sous Linux ; pour pdflatex, le plus gros des processus compilés (bac_a_sable.memoire_programme)
+        'rss_max_mio': round(usage.ru_maxrss / 1024, 1),
+        'rss_max_pdflatex_mio': round(mesures.memoire_pdflatex_kio / 1024, 1),
+        'pdflatex': {'simultanes_max': mesures.pdflatex_max, 'echecs': mesures.pdflatex_echecs,
+                     **percentiles(mesures.durees_pdflatex)},
+    }
+
+
+def afficher(resultats):
+    print(f"\n{'action':<20} {'nombre':>7} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9} {'erreurs':>8}")
+    for action, p in resultats['latences'].items():
+        print(f"{action:<20} {p['nombre']:>7} {p['p50_ms']:>9} {p['p90_ms']:>9} {p['p99_ms']:>9} {p['max_ms']:>9} "
+              f"{resultats['erreurs'].get(action, 0):>8}")
+    attente = resultats['attente_verrou']
+    if attente:
+        print(f"\nAttente du verrou d'écriture : {attente['nombre']} transactions, p50 {attente['p50_ms']} ms, "
+              f"p99 {attente['p99_ms']} ms, max {attente['max_ms']} ms")
+    print(f"Erreurs « database is locked » : {resultats['base_verrouillee']}")
+    pdflatex = resultats['pdflatex']
+    print(f"pdflatex : {pdflatex.get('nombre', 0)} compilations, {pdflatex['simultanes_max']} simultanées au plus"
+          + (f", p50 {pdflatex['p50_ms']} ms, max {pdflatex['max_ms']} ms" if 'nombre' in pdflatex else "")
+          + f", {pdflatex['echecs']} échouées ou arrêtées")
+    print(f"Mémoire résidente maximale : {resultats['rss_max_mio']} Mio (pdflatex : {resultats['rss_max_pdflatex_mio']} Mio)")
+    for erreur in resultats['exemples_erreurs']:
+        print(f"  erreur : {erreur[:200]}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test de charge de l'application des surtitres")
+    parser.add_argument('--utilisateurs', type=int, default=10)
+    parser.add_argument('--duree', type=float, default=60, help="durée du test en secondes")
+    parser.add_argument('--projets', type=int, default=1, help="projets rejoints (répartis entre les utilisateurs)")
+    parser.add_argument('--morceaux', type=int, default=20)
+    parser.add_argument('--lignes', type=int, default=40)
+    parser.add_argument('--graine', type=int, default=0)
+    parser.add_argument('--sortie', help="Écrire aussi les résultats dans ce fichier JSON")
+    args = parser.parse_args()
+
+    if not shutil.which('pdflatex'):
+        # Sans pdflatex, chaque aperçu échoue aussitôt : les latences mesurées n'auraient pas de sens
+        print("pdflatex introuvable : installez TeX Live (packages.txt) avant le test de charge", file=sys.stderr)
+        return 1
+    dossier_initial = os.getcwd()
+    with tempfile.TemporaryDirectory() as dossier:
+        os.chdir(dossier)
+        try:
+            partager_runtime()
+            connexion.connecter = connecter_mesure
+            surtitres.executer_pdflatex = executer_pdflatex_mesure(surtitres.executer_pdflatex)
+            init_databases()
+            projets = [f'charge_projet_{i + 1}' for i in range(args.projets)]
+            for i, projet_id in enumerate(projets):
+                generer_projet(projet_id, args.morceaux, args.lignes, graine=args.graine + i)
+            print(f"{args.utilisateurs} utilisateurs, {args.projets} projet(s) de {args.morceaux} morceaux "
+                  f"x {args.lignes} lignes, {args.duree:g} s")
+            # Première exécution hors mesure : imports et compilation de app.py (ast.parse n'est pas sûr
+            # entre fils en Python 3.11)
+            AppTest.from_file(APPLICATION, default_timeout=DELAI_EXECUTION).run()
+            # Tous les utilisateurs arrivent en même temps, comme une classe en début de répétition
+            fin = time.monotonic() + args.duree
+            fils = [
+                threading.Thread(target=Utilisateur(i, projets[i % len(projets)], args.graine * 1000 + i).jouer,
+                                 args=(fin,), name=f'utilisateur_{i}')
+                for i in range(args.utilisateurs)
+            ]
+            for fil in fils:
+                fil.start()
+            for fil in fils:
+                fil.join()
+        finally:
+            os.chdir(dossier_initial)
+
+    resultats = {
+        'date': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'machine': platform.platform(),
+        'parametres': vars(args),
+        **rapport(),
+    }
+    afficher(resultats)
+    if args.sortie:
+        with open(args.sortie, 'w') as f:
+            json.dump(resultats, f, indent=2)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,43 @@
+import random
+import pandas as pd
+from projets import create_project
+from morceaux_back import ajouter_morceau
+from paroles import sauvegarder_paroles_vers_tableur
+
+# Vocabulaire pour des vers plausibles (longueur proche de celle des vrais textes)
+MOTS_ORIGINAL = ["amore", "cuore", "notte", "giorno", "mano", "presto", "dolce", "pena",
+                 "madre", "noche", "luna", "canto", "fiore", "mio", "la", "del", "con", "che"]
+MOTS_TRADUCTION = ["amour", "cœur", "nuit", "jour", "main", "vite", "douce", "peine",
+                   "mère", "lune", "chant", "fleur", "mon", "la", "du", "avec", "que", "et"]
+
+def generer_vers(rng, mots):
+    """Générer un vers de 4 à 10 mots"""
+    return " ".join(rng.choice(mots) for _ in range(rng.randint(4, 10))).capitalize()
+
+def generer_paroles(nb_lignes, graine=0):
+    """Générer un DataFrame de paroles avec des lignes vides et des COUPURE comme dans les vrais tableurs"""
+    rng = random.Random(graine)
+    originaux, traductions = [], []
+    for i in range(nb_lignes):
+        if i % 12 == 11:
+            originaux.append("COUPURE")
+            traductions.append(None)
+        elif rng.random() < 0.05:
+            originaux.append(None)
+            traductions.append(None)
+        else:
+            originaux.append(generer_vers(rng, MOTS_ORIGINAL))
+            traductions.append(generer_vers(rng, MOTS_TRADUCTION))
+    return pd.DataFrame({'Original': originaux, 'Traduction': traductions})
+
+def generer_projet(projet_id, nb_morceaux, nb_lignes, graine=0):
+    """Créer dans la base courante un projet synthétique ; retourne les identifiants des morceaux"""
+    rng = random.Random(graine)
+    create_project(projet_id, "benchmark", f"Projet synthétique {nb_morceaux} x {nb_lignes}")
+    morceau_ids = []
+    for ordre in range(1, nb_morceaux + 1):
+        air = generer_vers(rng, MOTS_ORIGINAL)
+        morceau_id = ajouter_morceau(projet_id, ordre, air, "Compositeur", "1787", rng.choice(["Don Giovanni", ""]))
+        sauvegarder_paroles_vers_tableur(morceau_id, generer_paroles(nb_lignes, graine=graine + ordre), air)
+        morceau_ids.append(morceau_id)
+    return morceau_ids
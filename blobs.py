@@ -0,0 +1,44 @@
+import hashlib
+import os
+from connexion import stockage, CHEMIN_BASE
+
+# Stockage des tableurs hors de la base, un fichier par contenu (adressé par son empreinte SHA-256),
+# dans le dossier blobs à côté du fichier de la base (et non du dossier de lancement).
+# Avec un serveur PostgreSQL (connexion.serveur), les contenus sont dans sa table blobs,
+# partagée par toutes les instances de l'application (stockage_sqlite / stockage_serveur).
+DOSSIER_BLOBS = os.environ.get('SURTITRES_BLOBS') or os.path.join(os.path.dirname(os.path.abspath(CHEMIN_BASE)), 'blobs')
+
+# Un blob plus récent que ce délai (en secondes) n'est jamais supprimé : il peut appartenir
+# à une écriture dont la transaction n'est pas encore validée
+DELAI_GRACE = 3600
+
+def empreinte_donnees(donnees):
+    """Calculer l'empreinte SHA-256 d'un contenu"""
+    return hashlib.sha256(donnees).hexdigest()
+
+def chemin_blob(empreinte):
+    """Chemin du fichier d'un blob (sous-dossier par préfixe pour garder des dossiers petits)"""
+    return os.path.join(DOSSIER_BLOBS, empreinte[:2], empreinte)
+
+def stocker_blob(donnees):
+    """Stocker un contenu s'il n'existe pas déjà et retourner son empreinte"""
+    empreinte = empreinte_donnees(donnees)
+    stockage().stocker_blob(empreinte, donnees)
+    return empreinte
+
+def lire_blob(empreinte):
+    """Lire le contenu d'un blob (bytes)"""
+    return stockage().lire_blob(empreinte)
+
+def liberer_blob_si_orphelin(empreinte):
+    """Supprimer un blob qui n'est plus référencé par aucun tableur"""
+    if empreinte is None:
+        return False
+    return stockage().liberer_blob_si_orphelin(empreinte)
+
+def collecter_blobs_orphelins():
+    """Supprimer tous les blobs non référencés ; retourne le nombre de blobs supprimés"""
+    return stockage().collecter_blobs_orphelins()
+
+if __name__ == '__main__':
+    print(f"{collecter_blobs_orphelins()} blob(s) orphelin(s) supprimé(s)")
@@ -0,0 +1,157 @@
+import os
+import sqlite3
+import threading
+from profilage import profil_courant
+
+# Base de données des projets : fichier SQLite (par défaut projects.db, relatif au dossier de lancement
+# de l'application) ou URL d'un serveur PostgreSQL (postgresql://...) partagé par plusieurs instances
+BASE = os.environ.get('SURTITRES_BASE', 'projects.db')
+CHEMIN_BASE = BASE
+
+# Répartition optionnelle (SQLite seulement) : chaque nouveau projet a sa propre base dans ce dossier,
+# pour que l'écriture d'un projet ne bloque jamais les autres. projects.db reste le catalogue (liste
+# des projets, table bases_projets) et garde les projets créés avant la répartition.
+DOSSIER_BASES_PROJETS = os.environ.get('SURTITRES_BASES_PROJETS', '')
+# Chaque base de projet a sa plage d'identifiants de morceaux : la base d'un morceau se déduit de son
+# identifiant (numéro de base = morceau_id // PLAGE_MORCEAUX, 0 pour le catalogue)
+PLAGE_MORCEAUX = 10 ** 9
+
+# Numéro de base de chaque projet déjà routé (0 : projet du catalogue) ; un projet ne change jamais de base
+_numeros_projets = {}
+_verrou_numeros = threading.Lock()
+
+def serveur():
+    """Indiquer si la base est un serveur PostgreSQL (sinon un fichier SQLite)"""
+    return BASE.startswith(('postgresql://', 'postgres://'))
+
+def stockage():
+    """Module des requêtes propres au moteur de la base : stockage_serveur (PostgreSQL) ou stockage_sqlite
+
+    Les deux modules ont les mêmes fonctions (schéma, transactions d'écriture, index de
+    recherche, mémoire de traduction, annuaire, contenus des tableurs) ; les autres
+    modules n'écrivent que des requêtes communes aux deux moteurs.
+    """
+    # Imports différés : les modules de stockage importent ceux qui importent celui-ci
+    if serveur():
+        import stockage_serveur
+        return stockage_serveur
+    import stockage_sqlite
+    return stockage_sqlite
+
+def debuter_ecriture(c):
+    """Ouvrir une transaction d'écriture sur le curseur c, sérialisée avec les autres écritures de la base"""
+    stockage().debuter_ecriture(c)
+
+def reparti():
+    """Indiquer si les projets sont répartis en une base SQLite par projet"""
+    return bool(DOSSIER_BASES_PROJETS) and not serveur()
+
+def chemin_base_projet(numero):
+    """Fichier de la base de projet numéro numero (0 : le catalogue)"""
+    if not numero:
+        return CHEMIN_BASE
+    return os.path.join(DOSSIER_BASES_PROJETS, f'projet_{numero}.db')
+
+def numero_base(projet_id):
+    """Numéro de la base d'un projet (0 s'il est dans le catalogue)"""
+    with _verrou_numeros:
+        if projet_id in _numeros_projets:
+            return _numeros_projets[projet_id]
+    conn = connecter(CHEMIN_BASE)
+    c = conn.cursor()
+    # Un projet archivé (archives.py) garde sa base : il y est restauré
+    c.execute('''
+        SELECT (SELECT numero FROM bases_projets WHERE projet_id = :id),
+               EXISTS (SELECT 1 FROM projects WHERE id = :id)
+    ''', {'id': projet_id})
+    numero, existe = c.fetchone()
+    conn.close()
+    if numero is None and not existe:
+        # Projet inconnu (pas encore créé) : rien n'est mémorisé
+        return 0
+    with _verrou_numeros:
+        _numeros_projets[projet_id] = numero or 0
+    return numero or 0
+
+def connecter(chemin):
+    """Ouvrir une connexion à un fichier SQLite (instrumentée si un profilage est en cours)"""
+    profil = profil_courant()
+    if profil is not None:
+        return profil.connecter(chemin)
+    return sqlite3.connect(chemin)
+
+def get_connection(projet_id=None, morceau_id=None):
+    """Ouvrir une connexion à la base des projets (instrumentée si un profilage est en cours)
+
+    Avec la répartition, projet_id ou morceau_id désigne la base du projet
+    concerné ; sans l'un ni l'autre, la connexion est ouverte sur le catalogue.
+    Avec un serveur, la connexion est empruntée à un pool et rendue par close().
+    """
+    if serveur():
+        # Import différé : psycopg n'est nécessaire qu'avec un serveur
+        from base_serveur import connecter as connecter_serveur
+        return connecter_serveur(BASE)
+    if not reparti():
+        return connecter(CHEMIN_BASE)
+    if morceau_id is not None:
+        return connecter(chemin_base_projet(morceau_id // PLAGE_MORCEAUX))
+    if projet_id is not None:
+        return connecter(chemin_base_projet(numero_base(projet_id)))
+    return connecter(CHEMIN_BASE)
+
+def numeros_bases():
+    """Numéros des bases de projets, dans l'ordre de création"""
+    conn = connecter(CHEMIN_BASE)
+    c = conn.cursor()
+    c.execute('SELECT numero FROM bases_projets ORDER BY numero')
+    numeros = [ligne[0] for ligne in c.fetchall()]
+    conn.close()
+    return numeros
+
+def chemins_bases():
+    """Fichiers de toutes les bases : le catalogue puis les bases de projets"""
+    if not reparti():
+        return [CHEMIN_BASE]
+    return [CHEMIN_BASE] + [chemin_base_projet(numero) for numero in numeros_bases()]
+
+def connexions_bases():
+    """Ouvrir une connexion sur chaque base l'une après l'autre (le catalogue puis les bases de projets)
+
+    Chaque connexion est à fermer par l'appelant.
+    """
+    if not reparti():
+        yield get_connection()
+        return
+    for chemin in chemins_bases():
+        yield connecter(chemin)
+
+def bases_attachees():
+    """Parcourir toutes les bases pour une requête commune à plusieurs projets (administration, recherche)
+
+    Produit des couples (connexion, schémas) : une connexion au catalogue avec des
+    bases de projets attachées (ATTACH), par lots pour rester sous la limite de
+    SQLite, et les noms de schémas à interroger ('main', 'base_3', ...). La
+    connexion est fermée à la fin de chaque lot. Sans répartition, un seul lot :
+    la base des projets, schéma 'main'.
+    """
+    numeros = numeros_bases() if reparti() else []
+    if not numeros:
+        conn = connecter(CHEMIN_BASE)
+        try:
+            yield conn, ['main']
+        finally:
+            conn.close()
+        return
+    conn = connecter(CHEMIN_BASE)
+    lot = conn.getlimit(sqlite3.SQLITE_LIMIT_ATTACHED)
+    conn.close()
+    lots = [numeros[debut:debut + lot] for debut in range(0, len(numeros), lot)]
+    for i, numeros_lot in enumerate(lots):
+        conn = connecter(CHEMIN_BASE)
+        try:
+            for numero in numeros_lot:
+                conn.execute(f'ATTACH DATABASE ? AS base_{numero}', (chemin_base_projet(numero),))
+            # Le catalogue n'est interrogé qu'avec le premier lot
+            yield conn, (['main'] if i == 0 else []) + [f'base_{numero}' for numero in numeros_lot]
+        finally:
+            conn.close()
@@ -0,0 +1,220 @@
+"""Représentation intermédiaire des diapositives, indépendante du rendu.
+
+Le texte d'un morceau (DataFrame Original / Traduction) est lu une fois par
+révision dans un Morceau compact : ses deux colonnes sont gardées en tuples
+(un vers répété n'est stocké qu'une fois), et ses diapositives en bornes de
+lignes (un tableau d'entiers pour les strophes du mode poème ; deux lignes par
+diapositive en mode opéra, rien à stocker). Les Diapo sont des vues créées à la
+demande : chacune a un identifiant stable (morceau, mode, première ligne du
+tableur) et donne ses lignes avec leur numéro dans le tableur. Les rendus
+(beamer dans surtitres.py, et tout autre rendu : aperçu HTML, vue en direct,
+cache par diapositive) partent de ces objets sans relire le DataFrame.
+
+Les morceaux construits sont gardés en mémoire pour leur dernière révision,
+partagés par les sessions du processus.
+"""
+import array
+import collections
+import threading
+
+OPERA, POEME = 'opéra', 'poème'
+COUPURE = "COUPURE"
+
+# Morceaux construits gardés en mémoire (un par morceau, à sa dernière révision construite)
+MORCEAUX_EN_MEMOIRE_MAX = 200
+_morceaux_en_memoire = collections.OrderedDict()
+_verrou_morceaux = threading.Lock()
+
+
+class Diapo:
+    """Une diapositive d'un morceau : nature ('texte', 'titre' ou 'blanche'), lignes debut à fin (exclue) du texte
+
+    avec_titre : le titre du morceau est en tête de la diapositive (mode poème).
+    Les lignes ne sont pas copiées : la diapositive ne garde que leurs positions.
+    """
+    __slots__ = ('morceau', 'mode', 'nature', 'debut', 'fin', 'avec_titre')
+
+    def __init__(self, morceau, mode, nature, debut=0, fin=0, avec_titre=False):
+        self.morceau = morceau
+        self.mode = mode
+        self.nature = nature
+        self.debut = debut
+        self.fin = fin
+        self.avec_titre = avec_titre
+
+    @property
+    def id(self):
+        """Identifiant stable : morceau, mode et première ligne du tableur ; inchangé quand le texte de la diapositive change"""
+        if self.nature != 'texte':
+            return f'{self.morceau.id}-{self.nature}'
+        return f'{self.morceau.id}-{self.mode[0]}{self.debut + 1}'
+
+    @property
+    def originaux(self):
+        return self.morceau.originaux[self.debut:self.fin]
+
+    @property
+    def traductions(self):
+        return self.morceau.traductions[self.debut:self.fin]
+
+    def lignes(self):
+        """(rang dans le tableur, original, traduction) de chaque ligne de la diapositive"""
+        return zip(range(self.debut + 1, self.fin + 1), self.originaux, self.traductions)
+
+    def plage(self):
+        """Lignes du tableur [première, dernière] de la diapositive, ou None si elle n'en affiche aucune"""
+        if self.fin <= self.debut:
+            return None
+        return [self.debut + 1, self.fin]
+
+    def __repr__(self):
+        return f"Diapo({self.id!r}, {self.plage()})"
+
+
+class Morceau:
+    """Un morceau à une révision : métadonnées du titre, colonnes du texte et bornes des strophes
+
+    originaux, traductions : textes des lignes (None si la cellule est vide) ;
+    strophes : bornes debut, fin (exclue) de chaque diapositive du mode poème, à plat.
+    """
+    __slots__ = ('id', 'revision', 'air', 'compositeur', 'annee', 'extrait_de', 'originaux', 'traductions', 'strophes')
+
+    def __init__(self, id, revision, air, compositeur, annee, extrait_de, originaux=(), traductions=(), strophes=None):
+        self.id = id
+        self.revision = revision
+        self.air = air
+        self.compositeur = compositeur
+        self.annee = annee
+        self.extrait_de = extrait_de
+        self.originaux = originaux
+        self.traductions = traductions
+        self.strophes = strophes if strophes is not None else array.array('i')
+
+    def diapos(self, mode):
+        """Diapositives du texte du morceau dans un mode (sans le titre ni la diapositive blanche)"""
+        if mode == OPERA:
+            return decouper_opera(self)
+        if mode == POEME:
+            return tuple(
+                Diapo(self, POEME, 'texte', self.strophes[i], self.strophes[i + 1], avec_titre=i == 0)
+                for i in range(0, len(self.strophes), 2)
+            )
+        return ()
+
+    def ligne_morceau(self):
+        """Ligne (id, ordre, air, compositeur, annee, extrait_de) attendue par surtitres.generate_frame_title"""
+        return (self.id, None, self.air, self.compositeur, self.annee, self.extrait_de)
+
+    def __repr__(self):
+        return f"Morceau({self.id}, {self.air!r}, {len(self.originaux)} lignes)"
+
+
+class Concert:
+    """Les morceaux d'un concert dans l'ordre, avec les options de l'aperçu"""
+    __slots__ = ('mode', 'morceaux', 'textes', 'blanche')
+
+    def __init__(self, mode, morceaux, textes=True, blanche=False):
+        self.mode = mode
+        self.morceaux = morceaux
+        self.textes = textes
+        self.blanche = blanche
+
+    def diapositives(self, morceau):
+        """Toutes les diapositives d'un morceau du concert, titre et diapositive blanche compris"""
+        diapos = []
+        if self.mode == OPERA:
+            diapos.append(Diapo(morceau, self.mode, 'titre'))
+        if self.textes:
+            diapos.extend(morceau.diapos(self.mode))
+        if self.blanche:
+            diapos.append(Diapo(morceau, self.mode, 'blanche'))
+        return diapos
+
+    def __iter__(self):
+        """(morceau, diapositive) de tout le concert, dans l'ordre"""
+        for morceau in self.morceaux:
+            for diapo in self.diapositives(morceau):
+                yield morceau, diapo
+
+
+def nettoyer(valeur, uniques):
+    """Texte d'une cellule sans les crochets, ou None si elle est vide (NaN)
+
+    uniques : textes déjà lus, pour ne garder qu'une fois les vers répétés (refrains).
+    """
+    if isinstance(valeur, float):
+        return None
+    texte = valeur.replace('[', '').replace(']', '')
+    return uniques.setdefault(texte, texte)
+
+
+def lire_colonnes(paroles_df):
+    """Colonnes Original et Traduction d'un DataFrame, nettoyées, et valeurs brutes de Original (pour les coupures)"""
+    if paroles_df is None:
+        return (), (), []
+    originaux = paroles_df["Original"].tolist()
+    uniques = {}
+    return (
+        tuple(nettoyer(valeur, uniques) for valeur in originaux),
+        tuple(nettoyer(valeur, uniques) for valeur in paroles_df["Traduction"].tolist()),
+        originaux,
+    )
+
+
+def decouper_opera(morceau):
+    """Deux lignes par diapositive, coupures comprises"""
+    nb_lignes = len(morceau.originaux)
+    return tuple(
+        Diapo(morceau, OPERA, 'texte', debut, min(debut + 2, nb_lignes))
+        for debut in range(0, nb_lignes, 2)
+    )
+
+
+def decouper_poeme(originaux):
+    """Bornes des strophes, jusqu'à chaque ligne COUPURE (exacte) de la colonne Original (le titre est sur la première)"""
+    strophes = array.array('i')
+    debut = 0
+    while debut < len(originaux):
+        fin = debut
+        while fin < len(originaux) and originaux[fin] != COUPURE:
+            fin += 1
+        strophes.extend((debut, fin))
+        debut = fin + 1
+    return strophes
+
+
+def construire_morceau(morceau_id, paroles_df, morceau=None, revision=None):
+    """Construire un morceau à partir de son texte
+
+    morceau : ligne (id, ordre, air, compositeur, annee, extrait_de, ...) pour le titre,
+    ou None (texte seul) ; paroles_df None : titre seul.
+    """
+    originaux, traductions, bruts = lire_colonnes(paroles_df)
+    air, compositeur, annee, extrait_de = morceau[2:6] if morceau is not None else ("", "", "", "")
+    return Morceau(morceau_id, revision, air, compositeur, annee, extrait_de,
+                   originaux, traductions, decouper_poeme(bruts))
+
+
+def decouper(paroles_df, mode, morceau_id=0):
+    """Diapositives du texte d'un DataFrame dans un seul mode"""
+    return construire_morceau(morceau_id, paroles_df).diapos(mode)
+
+
+def morceau_a_la_revision(morceau_id, revision, paroles_df, morceau=None):
+    """Morceau construit une seule fois par révision : repris de la mémoire du processus s'il y est déjà
+
+    Seule la dernière révision construite de chaque morceau est gardée : une
+    nouvelle révision remplace la précédente au lieu de s'y ajouter.
+    """
+    with _verrou_morceaux:
+        construit = _morceaux_en_memoire.get(morceau_id)
+        if construit is not None and construit.revision == revision:
+            _morceaux_en_memoire.move_to_end(morceau_id)
+            return construit
+    construit = construire_morceau(morceau_id, paroles_df, morceau, revision)
+    with _verrou_morceaux:
+        _morceaux_en_memoire[morceau_id] = construit
+        _morceaux_en_memoire.move_to_end(morceau_id)
+        while len(_morceaux_en_memoire) > MORCEAUX_EN_MEMOIRE_MAX:
+            _morceaux_en_memoire.popitem(last=False)
+    return construit
@@ -0,0 +1,92 @@
+from connexion import get_connection
+import json
+import streamlit as st
+from projets import get_project_revision
+
+# Intervalle (en secondes) entre deux vérifications des modifications faites par d'autres éditeurs
+INTERVALLE_SURVEILLANCE = 5
+
+def dernier_curseur(projet_id):
+    """Position actuelle du journal des modifications pour un projet"""
+    conn = get_connection(projet_id=projet_id)
+    c = conn.cursor()
+    c.execute('SELECT MAX(id) FROM journal_modifications WHERE projet_id = ?', (projet_id,))
+    result = c.fetchone()[0] or 0
+    conn.close()
+    return result
+
+def lire_modifications(projet_id, curseur):
+    """Lire les modifications d'un projet publiées après le curseur
+
+    Retourne (nouveau_curseur, modifications), chaque modification étant un
+    dictionnaire (morceau_id, objet, operation, lignes). lignes vaut None quand
+    toutes les lignes du texte sont à considérer comme modifiées.
+    """
+    conn = get_connection(projet_id=projet_id)
+    c = conn.cursor()
+    c.execute('''
+        SELECT id, morceau_id, objet, operation, lignes
+        FROM journal_modifications
+        WHERE projet_id = ? AND id > ?
+        ORDER BY id
+    ''', (projet_id, curseur))
+    result = c.fetchall()
+    conn.close()
+
+    modifications = [
+        {'morceau_id': morceau_id, 'objet': objet, 'operation': operation,
+         'lignes': json.loads(lignes) if lignes else None}
+        for _, morceau_id, objet, operation, lignes in result
+    ]
+    return (result[-1][0] if result else curseur), modifications
+
+def synchroniser_session(projet_id):
+    """Appliquer à la session les modifications publiées depuis sa dernière exécution
+
+    Seuls les morceaux modifiés sont retirés du cache de la session. Quand rien n'a
+    changé, le coût se limite à la lecture de la révision du projet.
+    Retourne la liste des modifications appliquées.
+    """
+    etat = st.session_state.get('flux')
+    revision = get_project_revision(projet_id)
+
+    if etat is None or etat['projet_id'] != projet_id:
+        # Nouveau projet : on repart d'un cache vide
+        st.session_state.flux = {'projet_id': projet_id, 'revision': revision, 'curseur': dernier_curseur(projet_id)}
+        st.session_state.cache_paroles = {}
+        st.session_state.lignes_modifiees = {}
+        return []
+
+    if revision == etat['revision']:
+        return []
+
+    curseur, modifications = lire_modifications(projet_id, etat['curseur'])
+    cache = st.session_state.setdefault('cache_paroles', {})
+    lignes_modifiees = st.session_state.setdefault('lignes_modifiees', {})
+    for modification in modifications:
+        morceau_id = modification['morceau_id']
+        if morceau_id is None:
+            continue
+        cache.pop(morceau_id, None)
+        if modification['objet'] == 'paroles':
+            lignes = lignes_modifiees.setdefault(morceau_id, set())
+            if modification['lignes'] is None:
+                lignes.add(None)
+            else:
+                lignes.update(modification['lignes'])
+
+    etat['revision'] = revision
+    etat['curseur'] = curseur
+    return modifications
+
+if hasattr(st, 'fragment'):
+    @st.fragment(run_every=INTERVALLE_SURVEILLANCE)
+    def surveiller_modifications(projet_id):
+        """Relancer la page quand un autre éditeur a modifié le projet"""
+        etat = st.session_state.get('flux')
+        if etat is not None and get_project_revision(projet_id) != etat['revision']:
+            st.rerun(scope="app")
+else:
+    def surveiller_modifications(projet_id):
+        """Sans fragments (Streamlit ancien), les modifications sont vues à la prochaine exécution"""
+        pass
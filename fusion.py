@@ -0,0 +1,73 @@
+from difflib import SequenceMatcher
+
+# Levée quand une écriture conditionnelle trouve une révision différente de celle attendue
+class ConflitEdition(Exception):
+    pass
+
+# Lister les blocs modifiés de base -> version sous la forme (debut, fin, nouvelles_lignes)
+def _modifications(base, version):
+    sm = SequenceMatcher(None, base, version, autojunk=False)
+    return [(i1, i2, list(version[j1:j2])) for tag, i1, i2, j1, j2 in sm.get_opcodes() if tag != 'equal']
+
+# Deux blocs se chevauchent s'ils touchent les mêmes lignes, ou insèrent au même endroit
+def _se_chevauchent(a, b):
+    (a1, a2, _), (b1, b2, _) = a, b
+    if a1 == a2 and b1 == b2:
+        return a1 == b1
+    return a1 < b2 and b1 < a2
+
+# Fusion à trois voies de deux versions d'une liste de lignes : (lignes_fusionnees, []), ou (None, conflits)
+def fusionner_lignes(base, nos_lignes, leurs_lignes):
+    nos_blocs = _modifications(base, nos_lignes)
+    leurs_blocs = _modifications(base, leurs_lignes)
+
+    blocs = list(nos_blocs)
+    conflits = []
+    for leur_bloc in leurs_blocs:
+        chevauches = [bloc for bloc in nos_blocs if _se_chevauchent(bloc, leur_bloc)]
+        if not chevauches:
+            blocs.append(leur_bloc)
+        elif chevauches != [leur_bloc]:
+            # Les deux versions ont touché les mêmes lignes, et pas de la même façon : la fusion est abandonnée,
+            # avec les blocs concernés (debut et fin indexés sur la base)
+            debut = min([leur_bloc[0]] + [bloc[0] for bloc in chevauches])
+            fin = max([leur_bloc[1]] + [bloc[1] for bloc in chevauches])
+            nos_nouvelles = [ligne for bloc in chevauches for ligne in bloc[2]]
+            conflits.append((debut, fin, nos_nouvelles, leur_bloc[2]))
+    if conflits:
+        return None, conflits
+
+    # Appliquer les blocs dans l'ordre de la base (insertions avant remplacements)
+    fusion = []
+    position = 0
+    for debut, fin, nouvelles_lignes in sorted(blocs, key=lambda bloc: (bloc[0], bloc[1])):
+        fusion.extend(base[position:debut])
+        fusion.extend(nouvelles_lignes)
+        position = max(position, fin)
+    fusion.extend(base[position:])
+    return fusion, []
+
+# Fusion à trois voies champ par champ de deux versions d'un même enregistrement : (valeurs, index des champs en conflit)
+def fusionner_champs(base, nos_valeurs, leurs_valeurs):
+    fusion = []
+    conflits = []
+    for i, (b, nous, eux) in enumerate(zip(base, nos_valeurs, leurs_valeurs)):
+        if nous == b:
+            fusion.append(eux)
+        elif eux == b or eux == nous:
+            fusion.append(nous)
+        else:
+            fusion.append(eux)
+            conflits.append(i)
+    return fusion, conflits
+
+# Index (dans la nouvelle version) des lignes modifiées, insérées, ou suivant une suppression
+def lignes_modifiees(avant, apres):
+    sm = SequenceMatcher(None, avant, apres, autojunk=False)
+    index = []
+    for tag, i1, i2, j1, j2 in sm.get_opcodes():
+        if tag in ('replace', 'insert'):
+            index.extend(range(j1, j2))
+        elif tag == 'delete' and j1 < len(apres):
+            index.append(j1)
+    return sorted(set(index))
@@ -0,0 +1,272 @@
+import streamlit as st
+import difflib
+import io
+import os
+import re
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from connexion import get_connection, debuter_ecriture
+from paroles import nettoyer_nom_fichier, lire_tableur, normaliser_colonnes, ecrire_tableur
+from blobs import stocker_blob, liberer_blob_si_orphelin
+from memoire import normaliser_ligne
+from morceaux_back import ECART_ORDRE
+from surtitres import materialiser_titres
+from traces import etape
+
+# Import en lot des tableurs d'un concert : une archive ZIP ou plusieurs fichiers, et
+# éventuellement une liste des titres (titres.ods) donnant l'ordre et les informations des morceaux
+
+EXTENSIONS_TABLEUR = ('ods', 'xlsx', 'xls')
+# En dessous de ce nombre de fichiers, la lecture est faite dans le fil courant
+PARALLELE_A_PARTIR_DE = 8
+# Ressemblance minimale (0 à 1) entre le nom d'un fichier et un titre pour les associer sans correspondance exacte
+RESSEMBLANCE_MIN = 0.8
+# Longueur minimale d'une clé contenue dans une autre (aprite dans « Aprite, presto, aprite ») pour les associer
+LONGUEUR_MIN_INCLUSION = 4
+
+# Noms de colonnes reconnus dans la liste des titres (en minuscules)
+COLONNES_TITRES = {
+    'air': 'air', 'titre': 'air',
+    'compositeur': 'compositeur',
+    'annee': 'annee', 'année': 'annee',
+    'extrait de': 'extrait_de', 'extrait': 'extrait_de', 'opéra': 'extrait_de', 'opera': 'extrait_de',
+    'fichier': 'fichier', 'tableur': 'fichier',
+}
+
+def extension(nom):
+    return nom.rsplit('.', 1)[-1].lower() if '.' in nom else ''
+
+# Guillemets autour d'un titre (« Air ») : template_titre les ajoute déjà
+_guillemets = re.compile(r'«\s*|\s*»')
+
+def cle_titre(titre):
+    """Clé de correspondance d'un titre, sans LaTeX, accents, ponctuation, séparateurs ni majuscules
+
+    « Prenderò quel brunettino » et prenderoquelbrunettino.ods ont la même clé.
+    """
+    return re.sub(r'[\W_]+', '', normaliser_ligne(titre))
+
+def ressemblance(cle_fichier_, cle_air):
+    """Ressemblance (0 à 1) entre la clé d'un fichier et celle d'un titre
+
+    1 si l'une contient l'autre (nom de fichier abrégé) ; sinon, ressemblance avec le
+    début du titre de même longueur, pour les fautes de frappe (maquaimaisoffre).
+    """
+    courte, longue = sorted((cle_fichier_, cle_air), key=len)
+    if len(courte) >= LONGUEUR_MIN_INCLUSION and courte in longue:
+        return 1.0
+    return difflib.SequenceMatcher(None, cle_fichier_, cle_air[:len(cle_fichier_)]).ratio()
+
+def associer_tableur(cle_air, tableurs, associes):
+    """Clé du tableur d'un titre : correspondance exacte, puis le plus ressemblant des tableurs libres,
+    puis celui d'un titre identique déjà associé (un air chanté deux fois) ; None si aucun ne convient
+
+    tableurs : tableurs encore libres, par clé ; associes : clé du titre -> clé du tableur déjà associé.
+    """
+    if cle_air in tableurs:
+        return cle_air
+    if tableurs:
+        score, cle = max((ressemblance(cle, cle_air), cle) for cle in tableurs)
+        if score >= RESSEMBLANCE_MIN:
+            return cle
+    return associes.get(cle_air)
+
+def cle_fichier(nom):
+    """Clé de correspondance entre un fichier et un morceau : nom sans dossier ni extension"""
+    base = os.path.basename(nom)
+    if extension(base) in EXTENSIONS_TABLEUR:
+        base = base.rsplit('.', 1)[0]
+    return cle_titre(base)
+
+def est_liste_titres(nom):
+    return cle_fichier(nom) == 'titres'
+
+def fichiers_depuis_envoi(fichiers_uploades):
+    """Extraire les tableurs [(nom, donnees)] des fichiers envoyés (tableurs ou archives ZIP)"""
+    fichiers = []
+    for fichier in fichiers_uploades:
+        if extension(fichier.name) == 'zip':
+            with zipfile.ZipFile(io.BytesIO(fichier.getvalue())) as archive:
+                for info in archive.infolist():
+                    nom = info.filename
+                    if info.is_dir() or nom.startswith('__MACOSX/') or os.path.basename(nom).startswith('.'):
+                        continue
+                    if extension(nom) in EXTENSIONS_TABLEUR:
+                        fichiers.append((os.path.basename(nom), archive.read(info)))
+        elif extension(fichier.name) in EXTENSIONS_TABLEUR:
+            fichiers.append((fichier.name, fichier.getvalue()))
+    return fichiers
+
+def lire_fichier_importe(nom, donnees):
+    """Lire un tableur : (DataFrame, None) ou (None, message d'erreur)"""
+    try:
+        return lire_tableur(nom, donnees), None
+    except Exception as e:
+        return None, str(e)
+
+def lire_fichiers(fichiers):
+    """Lire tous les tableurs, dans un groupe de fils s'ils sont nombreux
+
+    Des fils plutôt que des processus : un processus neuf réimporterait Streamlit et toute
+    l'application pour lire quelques fichiers ; la décompression des fichiers (zlib) se fait
+    en dehors du verrou global de Python.
+    """
+    noms = [nom for nom, _ in fichiers]
+    contenus = [donnees for _, donnees in fichiers]
+    fils = min(len(fichiers), os.cpu_count() or 1)
+    if len(fichiers) < PARALLELE_A_PARTIR_DE or fils < 2:
+        return [lire_fichier_importe(nom, donnees) for nom, donnees in fichiers]
+    with ThreadPoolExecutor(fils, thread_name_prefix='import') as executeur:
+        return list(executeur.map(lire_fichier_importe, noms, contenus))
+
+def lire_liste_titres(df):
+    """Convertir la liste des titres en liste de dictionnaires (air, compositeur, annee, extrait_de, fichier)"""
+    colonnes = {col: COLONNES_TITRES.get(str(col).strip().lower()) for col in df.columns}
+    if 'air' not in colonnes.values():
+        # Pas d'en-tête reconnu : la première colonne donne les titres
+        colonnes = {df.columns[0]: 'air'}
+    titres = []
+    for _, ligne in df.iterrows():
+        morceau = {'air': '', 'compositeur': '', 'annee': '', 'extrait_de': '', 'fichier': ''}
+        for col, champ in colonnes.items():
+            if champ and isinstance(ligne[col], (str, int, float)) and str(ligne[col]) != 'nan':
+                valeur = ligne[col]
+                # Les années lues comme nombres (1787.0) sont remises en texte
+                morceau[champ] = str(int(valeur)) if isinstance(valeur, float) and valeur.is_integer() else str(valeur).strip()
+        morceau['air'] = _guillemets.sub('', morceau['air']).strip()
+        if morceau['air']:
+            titres.append(morceau)
+    return titres
+
+def preparer_import(fichiers, titres=None):
+    """Associer chaque tableur à un morceau
+
+    Retourne (morceaux, erreurs) : morceaux est la liste ordonnée de dictionnaires
+    (air, compositeur, annee, extrait_de, nom, donnees, paroles) ; sans liste des
+    titres, chaque fichier donne un morceau nommé d'après le fichier. Un titre sans
+    tableur correspondant ne donne pas de morceau (erreur).
+    """
+    erreurs = []
+    with etape('import.lecture', fichiers=len(fichiers)):
+        lus = lire_fichiers(fichiers)
+    tableurs = {}
+    for (nom, donnees), (df, erreur) in zip(fichiers, lus):
+        if erreur is not None:
+            erreurs.append(f"{nom} : {erreur}")
+        else:
+            tableurs[cle_fichier(nom)] = (nom, donnees, normaliser_colonnes(df))
+
+    if titres is None:
+        titres = [{'air': os.path.basename(nom).rsplit('.', 1)[0], 'compositeur': '', 'annee': '',
+                   'extrait_de': '', 'fichier': nom}
+                  for nom in sorted(nom for nom, _, _ in tableurs.values())]
+
+    morceaux = []
+    libres = dict(tableurs)
+    associes = {}
+    for titre in titres:
+        cle_air = cle_fichier(titre['fichier']) if titre['fichier'] else cle_titre(titre['air'])
+        cle = associer_tableur(cle_air, libres, associes)
+        if cle is None:
+            erreurs.append(f"{titre['air']} : aucun tableur correspondant, morceau non créé")
+            continue
+        libres.pop(cle, None)
+        associes.setdefault(cle_air, cle)
+        nom, donnees, paroles = tableurs[cle]
+        morceaux.append({**titre, 'nom': nom, 'donnees': donnees, 'paroles': paroles})
+    for nom, _, _ in libres.values():
+        erreurs.append(f"{nom} : absent de la liste des titres, ignoré")
+    return morceaux, erreurs
+
+def importer_morceaux(projet_id, morceaux):
+    """Créer les morceaux (ou compléter ceux du même titre) et enregistrer leurs tableurs en une transaction
+
+    Retourne (créés, mis à jour) ou None en cas d'erreur. Les morceaux sans tableur sont ignorés :
+    l'import ne crée jamais de morceau vide.
+    """
+    morceaux = [m for m in morceaux if m['donnees'] is not None]
+    # Les contenus sont écrits dans le stockage par empreinte avant la transaction
+    empreintes = [stocker_blob(m['donnees']) for m in morceaux]
+
+    conn = get_connection(projet_id=projet_id)
+    c = conn.cursor()
+    try:
+        debuter_ecriture(c)
+        c.execute('SELECT id, air FROM morceaux WHERE projet_id = ?', (projet_id,))
+        existants = {cle_titre(air or ''): morceau_id for morceau_id, air in c.fetchall()}
+        c.execute('SELECT COALESCE(MAX(ordre), 0) FROM morceaux WHERE projet_id = ?', (projet_id,))
+        ordre = c.fetchone()[0]
+
+        crees, mis_a_jour, remplacees = 0, 0, []
+        for morceau, empreinte in zip(morceaux, empreintes):
+            existant = existants.get(cle_titre(morceau['air']))
+            if existant is None:
+                ordre += ECART_ORDRE
+                c.execute('''
+                    INSERT INTO morceaux (projet_id, ordre, air, compositeur, annee, extrait_de, text_status)
+                    VALUES (?, ?, ?, ?, ?, ?, 'draft')
+                    RETURNING id
+                ''', (projet_id, ordre, morceau['air'], morceau['compositeur'], morceau['annee'],
+                      morceau['extrait_de']))
+                morceau_id = c.fetchone()[0]
+                materialiser_titres(c, morceau_id)
+                crees += 1
+            else:
+                morceau_id = existant
+                mis_a_jour += 1
+
+            nom_fichier = f"{nettoyer_nom_fichier(morceau['air'])}.{extension(morceau['nom'])}"
+            remplacees.append(ecrire_tableur(c, morceau_id, nom_fichier, empreinte,
+                                             len(morceau['donnees']), morceau['paroles']))
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        st.error(f"Erreur lors de l'import : {e}")
+        return None
+    finally:
+        conn.close()
+
+    for empreinte in set(remplacees) - set(empreintes):
+        liberer_blob_si_orphelin(empreinte)
+    return crees, mis_a_jour
+
+def import_en_lot(projet_id):
+    """Importer d'un coup les tableurs de tous les morceaux d'un concert"""
+    with st.expander("📦 Importer plusieurs tableurs"):
+        st.info("Déposez une archive ZIP ou plusieurs tableurs (.ods, .xlsx, .xls), avec éventuellement une liste "
+                "des titres nommée titres.ods (colonnes Air, Compositeur, Année, Opéra ou Extrait de, Fichier) qui donne "
+                "l'ordre des morceaux. Sans liste des titres, chaque fichier donne un morceau nommé d'après le fichier. "
+                "Un morceau du même titre déjà présent reçoit le nouveau tableur.")
+        envoi = st.file_uploader(
+            "Tableurs ou archive ZIP",
+            type=['zip', *EXTENSIONS_TABLEUR],
+            accept_multiple_files=True,
+            key=f"import_lot_{projet_id}"
+        )
+        if not envoi:
+            return
+
+        fichiers = fichiers_depuis_envoi(envoi)
+        liste_titres = [(nom, donnees) for nom, donnees in fichiers if est_liste_titres(nom)]
+        fichiers = [(nom, donnees) for nom, donnees in fichiers if not est_liste_titres(nom)]
+        st.write(f"{len(fichiers)} tableur(s)" + (", avec une liste des titres" if liste_titres else ""))
+
+        if st.button("📦 Importer", type="primary", key=f"importer_lot_{projet_id}"):
+            titres = None
+            if liste_titres:
+                nom, donnees = liste_titres[0]
+                try:
+                    titres = lire_liste_titres(lire_tableur(nom, donnees))
+                except Exception as e:
+                    st.error(f"Erreur lors de la lecture de la liste des titres : {e}")
+                    return
+            morceaux, erreurs = preparer_import(fichiers, titres)
+            for erreur in erreurs:
+                st.warning(f"⚠️ {erreur}")
+            resultat = importer_morceaux(projet_id, morceaux)
+            if resultat is not None:
+                crees, mis_a_jour = resultat
+                st.success(f"✅ {crees} morceau(x) créé(s), {mis_a_jour} tableur(s) remplacé(s)")
+                if not erreurs:
+                    # Un seul rafraîchissement (et une seule compilation de l'aperçu) pour tout l'import
+                    st.rerun()
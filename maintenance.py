@@ -0,0 +1,196 @@
+"""Maintenance de fond des bases, sans les mettre hors ligne.
+
+Un fil du processus rend régulièrement au système les pages libérées par les
+suppressions (morceaux, tableurs, projets archivés) : PRAGMA incremental_vacuum,
+par petites étapes, chacune dans sa propre transaction courte, avec une pause
+entre deux étapes pour laisser passer les écritures des pages. Une base occupée
+est simplement reprise à la tournée suivante. Les entrées du journal des
+modifications plus anciennes que DUREE_JOURNAL sont supprimées de la même façon,
+par lots. Les blobs orphelins sont collectés moins souvent.
+
+Avec un serveur PostgreSQL, le nettoyage des tables est fait par son autovacuum :
+seuls le journal et les blobs sont élagués. Avec la répartition, la date de modification des
+projets modifiés depuis la tournée précédente est aussi reportée au catalogue (tri
+de l'annuaire des projets).
+
+Une base créée avant le vide incrémental (auto_vacuum) doit être reconstruite une
+fois, application arrêtée : python maintenance.py convertir. Sans argument, la
+commande fait une tournée complète.
+"""
+import datetime
+import os
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+from connexion import connecter, chemins_bases, serveur, get_connection
+from blobs import collecter_blobs_orphelins
+from projets import rafraichir_dates_catalogue
+from traces import etape
+
+INTERVALLE = float(os.environ.get('SURTITRES_MAINTENANCE_INTERVALLE', 60))  # secondes entre deux tournées
+INTERVALLE_BLOBS = float(os.environ.get('SURTITRES_MAINTENANCE_BLOBS', 3600))  # secondes entre deux collectes
+# 1 Mio par étape avec des pages de 4 Kio : une étape bloque les écritures quelques millisecondes
+PAGES_PAR_ETAPE = 256
+ETAPES_MAX = 64
+PAUSE = 0.05
+# Attente maximale du verrou d'écriture : la maintenance cède toujours la place aux pages
+ATTENTE_VERROU_MS = 100
+# Durée (en secondes) pendant laquelle le journal des modifications est gardé : une session ouverte
+# qui ne l'a pas lu depuis plus longtemps perd ces modifications (flux.py)
+DUREE_JOURNAL = float(os.environ.get('SURTITRES_JOURNAL_DUREE', 7 * 24 * 3600))
+LIGNES_JOURNAL_PAR_ETAPE = 5000
+
+_fil = None
+_verrou = threading.Lock()
+
+
+def vider_par_etapes(chemin, etapes_max=ETAPES_MAX):
+    """Rendre au système les pages libres d'une base, PAGES_PAR_ETAPE à la fois ; retourne le nombre de pages rendues"""
+    conn = connecter(chemin)
+    conn.execute(f'PRAGMA busy_timeout = {ATTENTE_VERROU_MS}')
+    rendues = 0
+    try:
+        if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+            # Base pas encore convertie (convertir_bases) : incremental_vacuum n'y rend rien
+            return 0
+        for _ in range(etapes_max):
+            libres = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            if not libres:
+                break
+            try:
+                # executescript exécute le pragma jusqu'au bout (execute ne rend qu'une page)
+                conn.executescript(f'PRAGMA incremental_vacuum({PAGES_PAR_ETAPE})')
+            except sqlite3.OperationalError:
+                # Base occupée : reprise à la prochaine tournée
+                break
+            rendues += min(libres, PAGES_PAR_ETAPE)
+            time.sleep(PAUSE)
+    finally:
+        conn.close()
+    return rendues
+
+
+def elaguer_journal(conn, etapes_max=ETAPES_MAX):
+    """Supprimer les entrées du journal plus anciennes que DUREE_JOURNAL, LIGNES_JOURNAL_PAR_ETAPE à la fois
+
+    Le journal est écrit dans l'ordre des dates : la limite est la première entrée récente,
+    trouvée en ne lisant que les entrées à supprimer. Retourne le nombre d'entrées supprimées.
+    La connexion est fermée par l'appelant.
+    """
+    date_limite = (datetime.datetime.now() - datetime.timedelta(seconds=DUREE_JOURNAL)).isoformat()
+    c = conn.cursor()
+    ligne = c.execute('SELECT id FROM journal_modifications WHERE date >= ? ORDER BY id LIMIT 1',
+                      (date_limite,)).fetchone()
+    if ligne is None:
+        ligne = c.execute('SELECT COALESCE(MAX(id), 0) + 1 FROM journal_modifications').fetchone()
+    conn.commit()
+    supprimees = 0
+    for _ in range(etapes_max):
+        try:
+            c.execute('''
+                DELETE FROM journal_modifications
+                WHERE id IN (SELECT id FROM journal_modifications WHERE id < ? ORDER BY id LIMIT ?)
+            ''', (ligne[0], LIGNES_JOURNAL_PAR_ETAPE))
+            supprimees += c.rowcount
+            conn.commit()
+        except sqlite3.OperationalError:
+            # Base occupée : reprise à la prochaine tournée
+            conn.rollback()
+            break
+        if c.rowcount < LIGNES_JOURNAL_PAR_ETAPE:
+            break
+        time.sleep(PAUSE)
+    return supprimees
+
+
+def elaguer_journaux(etapes_max=ETAPES_MAX):
+    """Élaguer le journal de toutes les bases ; retourne le nombre d'entrées supprimées"""
+    if serveur():
+        conn = get_connection()
+        try:
+            return elaguer_journal(conn, etapes_max)
+        finally:
+            conn.close()
+    supprimees = 0
+    for chemin in chemins_bases():
+        conn = connecter(chemin)
+        conn.execute(f'PRAGMA busy_timeout = {ATTENTE_VERROU_MS}')
+        try:
+            supprimees += elaguer_journal(conn, etapes_max)
+        finally:
+            conn.close()
+    return supprimees
+
+
+def convertir_bases():
+    """Passer au vide incrémental les bases créées avant lui, par une reconstruction complète (VACUUM)
+
+    Bloque les écritures de chaque base pendant sa reconstruction : à lancer application
+    arrêtée. Retourne les fichiers convertis.
+    """
+    converties = []
+    for chemin in chemins_bases():
+        conn = connecter(chemin)
+        try:
+            if conn.execute('PRAGMA auto_vacuum').fetchone()[0] != 2:
+                conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                conn.execute('VACUUM')
+                converties.append(chemin)
+        finally:
+            conn.close()
+    return converties
+
+
+def tournee(collecter_blobs=False):
+    """Une tournée de maintenance sur toutes les bases ; retourne (pages rendues, blobs supprimés)"""
+    with etape('maintenance') as mesure:
+        # Le journal d'abord : les pages qu'il libère sont rendues dans la même tournée
+        journal = elaguer_journaux()
+        pages = 0
+        if not serveur():
+            for chemin in chemins_bases():
+                pages += vider_par_etapes(chemin)
+        dates = rafraichir_dates_catalogue()
+        blobs = collecter_blobs_orphelins() if collecter_blobs else 0
+        mesure.etiqueter(pages=pages, blobs=blobs, dates=dates, journal=journal)
+    return pages, blobs
+
+
+def _boucle():
+    derniere_collecte = time.monotonic()
+    while True:
+        time.sleep(INTERVALLE)
+        collecter = time.monotonic() - derniere_collecte >= INTERVALLE_BLOBS
+        try:
+            tournee(collecter)
+        except Exception:
+            traceback.print_exc(file=sys.stderr)
+        if collecter:
+            derniere_collecte = time.monotonic()
+
+
+def demarrer_maintenance():
+    """Démarrer le fil de maintenance du processus, une seule fois"""
+    global _fil
+    with _verrou:
+        if _fil is None:
+            _fil = threading.Thread(target=_boucle, name='maintenance', daemon=True)
+            _fil.start()
+    return _fil
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['convertir']:
+        converties = convertir_bases()
+        print(f"{len(converties)} base(s) convertie(s) au vide incrémental" + ''.join(f"\n  {chemin}" for chemin in converties))
+        sys.exit(0)
+    # Tournée complète à la demande : tout le journal ancien, toutes les pages libres, puis les blobs orphelins
+    journal = elaguer_journaux(etapes_max=sys.maxsize)
+    pages = 0
+    if not serveur():
+        for chemin in chemins_bases():
+            pages += vider_par_etapes(chemin, etapes_max=sys.maxsize)
+    print(f"{journal} entrée(s) du journal supprimée(s), {pages} page(s) rendue(s), "
+          f"{collecter_blobs_orphelins()} blob(s) orphelin(s) supprimé(s)")
@@ -0,0 +1,89 @@
+import difflib
+import hashlib
+import re
+import unicodedata
+from connexion import stockage
+from recherche import texte_indexable
+from traces import tracer
+
+# Mémoire de traduction : chaque couple (original, traduction) déjà saisi, retrouvé par l'empreinte
+# de l'original normalisé (correspondance exacte) ou par ses trigrammes (correspondance approchée)
+
+# Similarité minimale (0 à 1, entre originaux normalisés) pour proposer une traduction approchée
+SEUIL_SIMILARITE = 0.6
+# Nombre de candidats lus dans l'index de trigrammes avant le calcul de similarité
+CANDIDATS_MAX = 50
+# Seuls les trigrammes les plus rares du vers sont cherchés : ce sont les plus discriminants,
+# et le coût de la requête croît avec la longueur de leurs listes de vers
+TRIGRAMMES_RARES = 6
+
+_non_mot = re.compile(r'[^\w]+')
+
+def normaliser_ligne(texte):
+    """Ramener un vers à une forme comparable : sans LaTeX, accents, ponctuation ni majuscules"""
+    texte = unicodedata.normalize('NFKD', texte_indexable(texte))
+    texte = ''.join(car for car in texte if not unicodedata.combining(car))
+    return _non_mot.sub(' ', texte.lower()).strip()
+
+def empreinte_ligne(normalise):
+    """Empreinte entière (64 bits) d'un vers normalisé, pour une recherche exacte par index"""
+    return int.from_bytes(hashlib.blake2b(normalise.encode(), digest_size=8).digest(), 'big', signed=True)
+
+def oublier_traductions(c, morceau_id):
+    """Retirer de la mémoire les couples d'un morceau (dans la transaction du curseur c)
+
+    L'index de trigrammes est mis à jour par trigger.
+    """
+    c.execute('DELETE FROM memoire_traductions WHERE morceau_id = ?', (morceau_id,))
+
+def memoriser_traductions(c, morceau_id, lignes):
+    """Remplacer les couples (original, traduction) d'un morceau dans la mémoire (dans la transaction du curseur c)
+
+    Les couples de l'ancien texte du morceau sont retirés : une traduction corrigée
+    n'est plus proposée. L'index de trigrammes est alimenté par trigger.
+    """
+    oublier_traductions(c, morceau_id)
+    couples = []
+    for original, traduction in lignes:
+        if not isinstance(original, str) or not isinstance(traduction, str) or not traduction.strip():
+            continue
+        normalise = normaliser_ligne(original)
+        if normalise:
+            couples.append((empreinte_ligne(normalise), normalise, original, traduction, morceau_id))
+    c.executemany('''
+        INSERT INTO memoire_traductions (empreinte, normalise, original, traduction, morceau_id)
+        VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (morceau_id, empreinte, traduction) DO NOTHING
+    ''', couples)
+
+def trigrammes(normalise):
+    """Trigrammes des mots d'un vers normalisé (ceux qui chevauchent deux mots sont ignorés)"""
+    return sorted({mot[i:i + 3] for mot in normalise.split() for i in range(len(mot) - 2)})
+
+@tracer('sqlite.suggerer_traductions')
+def suggerer_traductions(original, exclure=None, limite=5):
+    """Proposer des traductions déjà saisies pour un vers original
+
+    Retourne une liste de dictionnaires (similarite, original, traduction), les
+    correspondances exactes (similarite 1.0) en premier. exclure : traduction à ne
+    pas proposer (celle déjà saisie pour la ligne).
+    """
+    if not isinstance(original, str):
+        return []
+    normalise = normaliser_ligne(original)
+    if not normalise:
+        return []
+
+    candidats = stockage().candidats_memoire(normalise)
+
+    suggestions = []
+    vues = {exclure}
+    for normalise_candidat, original_candidat, traduction in candidats:
+        if traduction in vues:
+            continue
+        similarite = difflib.SequenceMatcher(None, normalise, normalise_candidat).ratio()
+        if similarite >= SEUIL_SIMILARITE:
+            vues.add(traduction)
+            suggestions.append({'similarite': round(similarite, 2), 'original': original_candidat, 'traduction': traduction})
+    suggestions.sort(key=lambda s: -s['similarite'])
+    return suggestions[:limite]
@@ -0,0 +1,386 @@
+"""Migration des projets d'anciennes bases (par exemple old_db/projects.db) vers la base courante.
+
+Usage (depuis la racine du dépôt) :
+    python migration.py old_db/projects.db               # migre tous les projets de la source
+    python migration.py source.db --lot 100              # 100 morceaux par transaction
+    python migration.py source.db --verifier             # vérifie une migration déjà faite
+    python migration.py sauvegarde/projects.db           # base d'une archive téléchargée (décompressée)
+
+La base cible est celle de l'application (SURTITRES_BASE, répartie ou non, ou
+serveur PostgreSQL) ; son schéma est mis à jour avant la migration. La source est
+ouverte en lecture seule et lue par lots : les morceaux d'un lot et leurs
+tableurs sont écrits dans une transaction, les contenus lus un par un (blobopen)
+et rangés dans le stockage par empreinte. La mémoire utilisée ne dépend donc pas
+de la taille de la source.
+
+Les identifiants de morceaux sont réattribués par la cible. Un projet dont
+l'identifiant est déjà pris par un autre projet est renommé (<id>_migre,
+<id>_migre_2, ...). L'avancement de chaque projet est enregistré avec chaque lot
+(table reprises_migration de la base du projet) : une migration interrompue
+reprend là où elle s'était arrêtée en relançant la même commande. À la fin, le
+nombre de morceaux et de tableurs et une empreinte du contenu de chaque projet
+sont comparés entre la source et la cible ; le code de sortie vaut 1 en cas
+d'écart.
+
+Les tableurs d'une base récente ne sont pas dans la base mais dans le stockage par
+empreinte : ceux d'une archive téléchargée (sauvegardes.archive_instantane) sont lus
+dans son dossier blobs, à côté de la base.
+"""
+import argparse
+import hashlib
+import itertools
+import os
+import sqlite3
+import sys
+import time
+
+import streamlit.logger
+streamlit.logger.set_log_level('error')  # st.* hors de l'application : avertissements sans intérêt ici
+
+from connexion import get_connection, debuter_ecriture, reparti
+from blobs import stocker_blob, lire_blob
+from morceaux_back import ECART_ORDRE
+from paroles import ecrire_tableur, paroles_indexables
+from projets import project_exists, create_project
+from surtitres import materialiser_titres
+from utils import init_databases
+
+LOT_DEFAUT = 200
+# Lecture des contenus de la source par morceaux de cette taille pour les vérifier
+TAILLE_LECTURE = 1024 ** 2
+# Position de départ du parcours des morceaux d'un projet, par (ordre, id)
+DEBUT = (-2 ** 62, 0)
+
+# Ouvrir une base source en lecture seule
+def ouvrir_source(chemin):
+    if not os.path.exists(chemin):
+        raise FileNotFoundError(f"Base source introuvable : {chemin}")
+    return sqlite3.connect(f'file:{os.path.abspath(chemin)}?mode=ro', uri=True)
+
+def colonnes(source, table):
+    return {ligne[1] for ligne in source.execute(f'PRAGMA table_info({table})')}
+
+# Table d'avancement de la migration, dans la base du projet migré
+def creer_table_reprises(c):
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS reprises_migration (
+            source TEXT NOT NULL,
+            projet_source TEXT NOT NULL,
+            projet_id TEXT NOT NULL,
+            dernier_ordre BIGINT NOT NULL,
+            dernier_morceau BIGINT NOT NULL,
+            termine INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (source, projet_source)
+        )
+    ''')
+
+# Avancement enregistré pour ce projet source dans la base du projet cible (None s'il n'y en a pas)
+def lire_reprise(cible, chemin_source, projet_source):
+    conn = get_connection(projet_id=cible)
+    c = conn.cursor()
+    creer_table_reprises(c)
+    conn.commit()
+    c.execute('''
+        SELECT dernier_ordre, dernier_morceau, termine FROM reprises_migration
+        WHERE source = ? AND projet_source = ? AND projet_id = ?
+    ''', (chemin_source, projet_source, cible))
+    reprise = c.fetchone()
+    conn.close()
+    return reprise
+
+# Identifiants possibles du projet cible, dans l'ordre : le même, puis <id>_migre, <id>_migre_2, ...
+def identifiants_candidats(projet_source):
+    yield projet_source
+    yield f'{projet_source}_migre'
+    for n in itertools.count(2):
+        yield f'{projet_source}_migre_{n}'
+
+# Indiquer si le projet cible a été créé par une migration arrêtée avant d'inscrire son avancement
+def creation_interrompue(cible, creator, description):
+    conn = get_connection(projet_id=cible)
+    c = conn.cursor()
+    c.execute('''
+        SELECT creator IS NOT DISTINCT FROM ? AND description IS NOT DISTINCT FROM ?
+               AND NOT EXISTS (SELECT 1 FROM morceaux WHERE projet_id = p.id)
+               AND NOT EXISTS (SELECT 1 FROM reprises_migration WHERE projet_id = p.id)
+        FROM projects p
+        WHERE id = ?
+    ''', (creator, description, cible))
+    ligne = c.fetchone()
+    conn.close()
+    return ligne is not None and bool(ligne[0])
+
+# Projet cible de ce projet source : (identifiant, avancement) s'il est repris, sinon (identifiant libre ou à reprendre, None)
+def projet_migre(chemin_source, projet):
+    projet_source, _, _, creator, description, _ = projet
+    for candidat in identifiants_candidats(projet_source):
+        if not project_exists(candidat):
+            return candidat, None
+        reprise = lire_reprise(candidat, chemin_source, projet_source)
+        if reprise is not None:
+            return candidat, reprise
+        if creation_interrompue(candidat, creator, description):
+            return candidat, None
+
+# Identifiant du projet cible et avancement : projet repris, ou nouveau projet sous un identifiant libre
+def projet_cible(chemin_source, projet):
+    projet_source, _, _, creator, description, _ = projet
+    candidat, reprise = projet_migre(chemin_source, projet)
+    if reprise is not None:
+        return candidat, reprise
+
+    # create_project valide le projet seul (avec la répartition, dans une autre base que l'avancement) : un projet
+    # vide, sans avancement, au créateur et à la description de la source est repris (creation_interrompue)
+    if not project_exists(candidat):
+        create_project(candidat, creator, description)
+    conn = get_connection(projet_id=candidat)
+    c = conn.cursor()
+    creer_table_reprises(c)
+    c.execute('''
+        INSERT INTO reprises_migration (source, projet_source, projet_id, dernier_ordre, dernier_morceau)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (chemin_source, projet_source, candidat, *DEBUT))
+    conn.commit()
+    conn.close()
+    return candidat, (*DEBUT, 0)
+
+# Lire le contenu d'un tableur de la source sans passer par un résultat de requête
+def lire_contenu(source, tableur_id):
+    with source.blobopen('tableurs_paroles', 'donnees', tableur_id, readonly=True) as blob:
+        return blob.read()
+
+# Contenu d'un tableur hors de la source : blobs de l'archive (à côté de la base ou de son dossier projets), sinon de l'application
+def lire_blob_source(chemin_source, empreinte):
+    dossier = os.path.dirname(chemin_source)
+    for dossier_blobs in (os.path.join(dossier, 'blobs'), os.path.join(os.path.dirname(dossier), 'blobs')):
+        chemin = os.path.join(dossier_blobs, empreinte)
+        if os.path.exists(chemin):
+            with open(chemin, 'rb') as f:
+                return f.read()
+    return lire_blob(empreinte)
+
+# Dernier tableur de chaque morceau du lot : {morceau_id: (id, nom_fichier, date_import, taille, empreinte)}
+def tableurs_du_lot(source, morceau_ids, avec_empreinte):
+    marques = ', '.join('?' * len(morceau_ids))
+    empreinte = 'empreinte' if avec_empreinte else 'NULL'
+    tableurs = {}
+    for ligne in source.execute(f'''
+        SELECT morceau_id, id, nom_fichier, date_import, length(donnees), {empreinte}
+        FROM tableurs_paroles
+        WHERE morceau_id IN ({marques}) AND (donnees IS NOT NULL OR {empreinte} IS NOT NULL)
+        ORDER BY id
+    ''', morceau_ids):
+        tableurs[ligne[0]] = ligne[1:]
+    return tableurs
+
+# Morceaux d'un projet source après une position (ordre, id), par ordre croissant
+def requete_morceaux(source):
+    statut = 'text_status' if 'text_status' in colonnes(source, 'morceaux') else 'NULL'
+    return f'''
+        SELECT id, COALESCE(ordre, 0), air, extrait_de, compositeur, annee, {statut}
+        FROM morceaux
+        WHERE projet_id = ? AND (COALESCE(ordre, 0), id) > (?, ?)
+        ORDER BY COALESCE(ordre, 0), id
+        LIMIT ?
+    '''
+
+# Écrire un lot de morceaux et leurs tableurs dans une transaction, avec l'avancement ; retourne les octets lus
+def migrer_lot(source, chemin_source, cible, morceaux, tableurs):
+    octets = 0
+    conn = get_connection(projet_id=cible)
+    c = conn.cursor()
+    try:
+        debuter_ecriture(c)
+        c.execute('SELECT COALESCE(MAX(ordre), 0) FROM morceaux WHERE projet_id = ?', (cible,))
+        ordre = c.fetchone()[0]
+        for ancien_id, _, air, extrait_de, compositeur, annee, statut in morceaux:
+            ordre += ECART_ORDRE
+            c.execute('''
+                INSERT INTO morceaux (projet_id, ordre, air, compositeur, annee, extrait_de, text_status)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                RETURNING id
+            ''', (cible, ordre, air, compositeur, annee, extrait_de, statut or 'not_started'))
+            morceau_id = c.fetchone()[0]
+            materialiser_titres(c, morceau_id)
+
+            tableur = tableurs.get(ancien_id)
+            if tableur is None:
+                continue
+            tableur_id, nom_fichier, date_import, taille, empreinte = tableur
+            # Un seul contenu en mémoire à la fois
+            donnees = lire_contenu(source, tableur_id) if taille is not None else lire_blob_source(chemin_source, empreinte)
+            octets += len(donnees)
+            ecrire_tableur(c, morceau_id, nom_fichier, stocker_blob(donnees), len(donnees),
+                           paroles_indexables(nom_fichier, donnees))
+            if date_import is not None:
+                c.execute('UPDATE tableurs_paroles SET date_import = ? WHERE morceau_id = ?', (date_import, morceau_id))
+
+        dernier_ordre, dernier_morceau = morceaux[-1][1], morceaux[-1][0]
+        c.execute('''
+            UPDATE reprises_migration SET dernier_ordre = ?, dernier_morceau = ?
+            WHERE projet_id = ?
+        ''', (dernier_ordre, dernier_morceau, cible))
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    finally:
+        conn.close()
+    return octets
+
+# Reprendre la diapositive de titre et les dates du projet source, et marquer le projet comme migré
+def terminer_projet(cible, projet):
+    _, created_date, modified_date, _, _, concert_frame = projet
+    conn = get_connection(projet_id=cible)
+    c = conn.cursor()
+    debuter_ecriture(c)
+    if concert_frame is not None:
+        c.execute('UPDATE projects SET concert_frame = ? WHERE id = ?', (concert_frame, cible))
+    # Après la diapositive : sa modification date le projet d'aujourd'hui
+    c.execute('UPDATE projects SET created_date = ?, modified_date = ? WHERE id = ?', (created_date, modified_date, cible))
+    c.execute('UPDATE reprises_migration SET termine = 1 WHERE projet_id = ?', (cible,))
+    conn.commit()
+    conn.close()
+    if reparti():
+        # Mêmes dates dans la liste des projets du catalogue
+        conn = get_connection()
+        conn.execute('UPDATE projects SET created_date = ?, modified_date = ? WHERE id = ?', (created_date, modified_date, cible))
+        conn.commit()
+        conn.close()
+
+# Migrer un projet par lots ; retourne (identifiant cible, morceaux, tableurs, octets) migrés par cet appel
+def migrer_projet(source, chemin_source, projet, lot):
+    cible, (dernier_ordre, dernier_morceau, termine) = projet_cible(chemin_source, projet)
+    if termine:
+        print(f"{projet[0]} : déjà migré ({cible})")
+        return cible, 0, 0, 0
+    if (dernier_ordre, dernier_morceau) != DEBUT:
+        print(f"{projet[0]} : reprise de la migration ({cible})")
+
+    requete = requete_morceaux(source)
+    avec_empreinte = 'empreinte' in colonnes(source, 'tableurs_paroles')
+    total_morceaux, total_tableurs, total_octets = 0, 0, 0
+    debut = time.perf_counter()
+    while True:
+        morceaux = source.execute(requete, (projet[0], dernier_ordre, dernier_morceau, lot)).fetchall()
+        if not morceaux:
+            break
+        tableurs = tableurs_du_lot(source, [m[0] for m in morceaux], avec_empreinte)
+        total_octets += migrer_lot(source, chemin_source, cible, morceaux, tableurs)
+        total_morceaux += len(morceaux)
+        total_tableurs += len(tableurs)
+        dernier_morceau, dernier_ordre = morceaux[-1][0], morceaux[-1][1]
+        duree = time.perf_counter() - debut
+        print(f"{projet[0]} -> {cible} : {total_morceaux} morceaux, {total_tableurs} tableurs, "
+              f"{total_octets / 1024 ** 2:.1f} Mio ({total_morceaux / duree:.0f} morceaux/s, "
+              f"{total_octets / 1024 ** 2 / duree:.2f} Mio/s)")
+    terminer_projet(cible, projet)
+    return cible, total_morceaux, total_tableurs, total_octets
+
+# Nombre de morceaux, nombre de tableurs et empreinte du contenu d'un projet de la source
+def empreinte_source(source, projet_id):
+    avec_empreinte = 'empreinte' in colonnes(source, 'tableurs_paroles')
+    empreinte = 'empreinte' if avec_empreinte else 'NULL'
+    resume = hashlib.sha256()
+    nb_morceaux, nb_tableurs = 0, 0
+    for morceau_id, air, extrait_de, compositeur, annee in source.execute('''
+        SELECT id, air, extrait_de, compositeur, annee FROM morceaux
+        WHERE projet_id = ? ORDER BY COALESCE(ordre, 0), id
+    ''', (projet_id,)):
+        tableur = source.execute(f'''
+            SELECT id, length(donnees), {empreinte} FROM tableurs_paroles
+            WHERE morceau_id = ? AND (donnees IS NOT NULL OR {empreinte} IS NOT NULL)
+            ORDER BY id DESC LIMIT 1
+        ''', (morceau_id,)).fetchone()
+        contenu = ''
+        if tableur is not None:
+            tableur_id, taille, empreinte_tableur = tableur
+            if taille is None:
+                contenu = empreinte_tableur
+            else:
+                # Empreinte calculée par morceaux du contenu, sans le charger entier
+                calcul = hashlib.sha256()
+                with source.blobopen('tableurs_paroles', 'donnees', tableur_id, readonly=True) as blob:
+                    while bloc := blob.read(TAILLE_LECTURE):
+                        calcul.update(bloc)
+                contenu = calcul.hexdigest()
+            nb_tableurs += 1
+        nb_morceaux += 1
+        resume.update(repr((air, extrait_de, compositeur, annee, contenu)).encode())
+    return nb_morceaux, nb_tableurs, resume.hexdigest()
+
+# Mêmes informations que empreinte_source pour un projet de la base courante
+def empreinte_cible(cible):
+    conn = get_connection(projet_id=cible)
+    c = conn.cursor()
+    c.execute('''
+        SELECT m.air, m.extrait_de, m.compositeur, m.annee, t.empreinte
+        FROM morceaux m
+        LEFT JOIN tableurs_paroles t ON t.morceau_id = m.id
+        WHERE m.projet_id = ?
+        ORDER BY m.ordre, m.id
+    ''', (cible,))
+    resume = hashlib.sha256()
+    nb_morceaux, nb_tableurs = 0, 0
+    for air, extrait_de, compositeur, annee, empreinte in c:
+        nb_morceaux += 1
+        nb_tableurs += empreinte is not None
+        resume.update(repr((air, extrait_de, compositeur, annee, empreinte or '')).encode())
+    conn.close()
+    return nb_morceaux, nb_tableurs, resume.hexdigest()
+
+# Comparer chaque projet migré à la source ; retourne le nombre de projets en écart
+def verifier(source, chemin_source, projets):
+    ecarts = 0
+    for projet in projets:
+        cible, reprise = projet_migre(chemin_source, projet)
+        if reprise is None:
+            print(f"ÉCART {projet[0]} : projet non migré")
+            ecarts += 1
+            continue
+        attendu, obtenu = empreinte_source(source, projet[0]), empreinte_cible(cible)
+        if attendu == obtenu:
+            print(f"OK {projet[0]} -> {cible} : {obtenu[0]} morceaux, {obtenu[1]} tableurs")
+        else:
+            print(f"ÉCART {projet[0]} -> {cible} : source {attendu[0]} morceaux, {attendu[1]} tableurs, "
+                  f"cible {obtenu[0]} morceaux, {obtenu[1]} tableurs"
+                  + ("" if attendu[:2] != obtenu[:2] else ", contenus différents"))
+            ecarts += 1
+    return ecarts
+
+def main():
+    parser = argparse.ArgumentParser(description="Migrer les projets d'anciennes bases vers la base courante")
+    parser.add_argument('sources', nargs='+', help="bases SQLite à migrer")
+    parser.add_argument('--lot', type=int, default=LOT_DEFAUT, help="morceaux écrits par transaction")
+    parser.add_argument('--verifier', action='store_true', help="vérifier une migration déjà faite, sans migrer")
+    args = parser.parse_args()
+
+    if not args.verifier:
+        init_databases()
+    ecarts = 0
+    for chemin in args.sources:
+        source = ouvrir_source(chemin)
+        chemin_source = os.path.abspath(chemin)
+        cols = colonnes(source, 'projects')
+        frame = 'concert_frame' if 'concert_frame' in cols else 'NULL'
+        projets = source.execute(f'''
+            SELECT id, created_date, modified_date, creator, description, {frame} FROM projects ORDER BY id
+        ''').fetchall()
+        print(f"{chemin} : {len(projets)} projet(s)")
+
+        if not args.verifier:
+            debut = time.perf_counter()
+            totaux = [0, 0, 0]
+            for projet in projets:
+                _, *migres = migrer_projet(source, chemin_source, projet, args.lot)
+                totaux = [total + n for total, n in zip(totaux, migres)]
+            duree = time.perf_counter() - debut
+            print(f"{chemin} : {totaux[0]} morceaux, {totaux[1]} tableurs, {totaux[2] / 1024 ** 2:.1f} Mio "
+                  f"en {duree:.1f} s ({totaux[0] / duree:.0f} morceaux/s, {totaux[2] / 1024 ** 2 / duree:.2f} Mio/s)")
+
+        ecarts += verifier(source, chemin_source, projets)
+        source.close()
+    return 1 if ecarts else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
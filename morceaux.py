@@ -1,7 +1,49 @@
 import streamlit as st
-from paroles import tableur_existe, charger_paroles_depuis_tableur
-from surtitres import generate_frame_title, generate_text, make_latex
-from morceaux_back import charger_morceaux, ajouter_morceau, mettre_a_jour_morceau, supprimer_morceau, ordre_existe, decaler_ordres, get_max_ordre, nettoyer_ordre_morceaux, get_concert_frame, update_concert_frame, get_project
+import pandas as pd
+from paroles import completer_index_paroles
+from recherche import rechercher_paroles
+from importation import import_en_lot
+from relecture import relecture_textes
+from surtitres import assembler_concert, diapositives_concert, make_latex
+from morceaux_back import charger_morceaux, ajouter_morceau, mettre_a_jour_morceau, supprimer_morceau, reordonner_morceaux, get_max_ordre, get_concert_frame, update_concert_frame, get_project
+
+def recherche_textes(projet_id):
+    """Rechercher un mot ou une expression dans les textes et traductions"""
+    with st.expander("🔎 Rechercher dans les textes"):
+        col_texte, col_portee = st.columns([3, 1])
+        with col_texte:
+            texte = st.text_input("Mot ou expression", placeholder="ex: amour, cancion (les accents sont ignorés)", key="recherche_paroles")
+        with col_portee:
+            tous_projets = st.checkbox("Tous les projets", value=False, key="recherche_tous_projets")
+        if not texte.strip():
+            return
+
+        completer_index_paroles()
+
+        resultats = rechercher_paroles(texte, projet_id=None if tous_projets else projet_id)
+        if not resultats:
+            st.info("ℹ️ Aucun résultat")
+            return
+        st.caption(f"{len(resultats)} résultat(s), du plus pertinent au moins pertinent")
+        for r in resultats:
+            projet = f"`{r['projet_id']}` · " if tous_projets else ""
+            st.markdown(f"{projet}**{r['air']}**, ligne {r['ligne']} : {r['original']} — *{r['traduction']}*")
+
+def reordonner_liste(projet_id, morceaux):
+    """Réorganiser toute la liste d'un coup en saisissant les nouvelles positions"""
+    with st.expander("↕️ Réordonner la liste"):
+        tableau = pd.DataFrame({
+            'Position': range(1, len(morceaux) + 1),
+            'Air': [m[2] for m in morceaux],
+        })
+        edite = st.data_editor(tableau, disabled=['Air'], hide_index=True, key=f"reordonner_{projet_id}")
+        if st.button("↕️ Appliquer l'ordre", key=f"appliquer_ordre_{projet_id}"):
+            # À position égale (ou vide), l'ordre actuel départage
+            positions = edite['Position'].fillna(len(morceaux) + 1)
+            nouvel_ordre = sorted(range(len(morceaux)), key=lambda i: (positions.iloc[i], i))
+            if reordonner_morceaux(projet_id, [morceaux[i][0] for i in nouvel_ordre]):
+                st.success("✅ Ordre appliqué")
+                st.rerun()
 
 def gestion_morceaux(projet_id):
     edit_conflict = False
@@ -20,24 +62,17 @@ def gestion_morceaux(projet_id):
     if morceaux:
 
         st.subheader("📋 Liste des morceaux (dans l'ordre)")
-        col1, col2 = st.columns([0.8, 0.2])
+        col1, col2 = st.columns(2)
         with col1:
             with st.expander("ℹ️ Aide concernant l'ordre"):
-                st.info("Pour déplacer un morceau, modifiez son numéro (bouton ✏️). Les morceaux suivants seront décalés automatiquement. Attention, pour placer un morceau à la fin, saisissez un numéro supérieur au maximum visible. Si les numéros ne se suivent plus naturellement à partir de 1, cliquez sur le bouton 🧹 juste à droite.")       
+                st.info("Pour déplacer un morceau, modifiez son numéro (bouton ✏️) : il prend cette place et les morceaux suivants sont décalés automatiquement. Pour réorganiser plusieurs morceaux d'un coup, utilisez « Réordonner la liste » juste à droite.")       
         with col2:
-            if st.button("🧹 Nettoyer l'ordre", help="Corrige la numérotation pour avoir 1, 2, 3... sans trous"):
-                if nettoyer_ordre_morceaux(projet_id):
-                    st.success("✅ Ordre nettoyé avec succès")
-                    st.rerun()
-        for morceau in morceaux:
-            morceau_id, ordre, air, compositeur, annee, extrait_de, text_status = morceau
-            
-            # Vérifier si un tableur existe pour ce morceau
-            tableur_existant = tableur_existe(morceau_id)
-            if tableur_existant and text_status == 'not_started':
-                # Mettre à jour le statut du texte si un tableur existe
-                mettre_a_jour_morceau(morceau_id, ordre, air, compositeur, annee, extrait_de, 'draft')
-                text_status = 'draft'
+            reordonner_liste(projet_id, morceaux)
+        for position, morceau in enumerate(morceaux, 1):
+            morceau_id, ordre, air, compositeur, annee, extrait_de, text_status, revision = morceau
+            valeurs_affichees = (ordre, air, compositeur, annee, extrait_de, text_status)
+
+            # Le statut est tenu à jour à l'enregistrement des tableurs : l'affichage n'écrit rien
             statut_paroles_emoji = "🟢" if text_status == 'validated' else ("🟠" if text_status == 'draft' else "🔴")
                         
             if st.session_state.edition_morceau_id == morceau_id:
@@ -49,9 +84,9 @@ def gestion_morceaux(projet_id):
                     col1, col2, col3, col4, col5, col6, col7 = st.columns([0.1, 0.25, 0.2, 0.15, 0.15, 0.2, 0.15])
                     
                     with col1:
-                        nouvel_ordre = st.number_input(
+                        nouvelle_position = st.number_input(
                             "Ordre",
-                            value=ordre,
+                            value=position,
                             min_value=1,
                             max_value=max_ordre + 10,
                             key=f"edit_ordre_{morceau_id}"
@@ -91,20 +126,11 @@ def gestion_morceaux(projet_id):
                             if not nouveau_air.strip():
                                 st.error("L'air est obligatoire")
                             else:
-                                # Gestion des conflits d'ordre
-                                ordre_final = nouvel_ordre
-                                if ordre_existe(projet_id, nouvel_ordre, morceau_id):
-                                    # Décaler les ordres
-                                    decaler_ordres(projet_id, nouvel_ordre)
-                                    st.info(f"⚠️ Ordre décalé à partir de {nouvel_ordre}")
-                                
-                                # Limiter l'ordre maximum
-                                if ordre_final > max_ordre + 1:
-                                    ordre_final = max_ordre + 1
-                                    st.info(f"⚠️ Ordre limité à {ordre_final}")
-                                
-                                # Sauvegarder
-                                if mettre_a_jour_morceau(morceau_id, ordre_final, nouveau_air.strip(), nouveau_compositeur.strip(), nouvelle_annee.strip(), nouvel_extrait_de.strip(), text_status):
+                                # Sauvegarder (seuls les champs modifiés depuis le début de l'édition sont écrits ;
+                                # le déplacement, qui n'écrit que la clé d'ordre, est fait dans la même transaction)
+                                base = st.session_state.get('edition_morceau_base', (revision, valeurs_affichees))
+                                if mettre_a_jour_morceau(morceau_id, base[1][0], nouveau_air.strip(), nouveau_compositeur.strip(), nouvelle_annee.strip(), nouvel_extrait_de.strip(), text_status, base=base,
+                                                         position=nouvelle_position if nouvelle_position != position else None):
                                     st.session_state.edition_morceau_id = None
                                     st.success("✅ Morceau mis à jour")
                                     st.rerun()
@@ -120,7 +146,7 @@ def gestion_morceaux(projet_id):
                     col1, col2, col3, col4, col5, col6, col7 = st.columns([0.05, 0.3, 0.2, 0.15, 0.10, 0.15, 0.15])
                     
                     with col1:
-                        st.write(f"**{ordre}**")
+                        st.write(f"**{position}**")
                     
                     with col2:
                         st.write(f"**{air}**")
@@ -141,6 +167,7 @@ def gestion_morceaux(projet_id):
                             if st.button("✏️", key=f"edit_btn_{morceau_id}", use_container_width=True):
                                 if st.session_state.edition_morceau_id is None:
                                     st.session_state.edition_morceau_id = morceau_id
+                                    st.session_state.edition_morceau_base = (revision, valeurs_affichees)
                                     st.rerun()
                                 else:
                                     edit_conflict = True
@@ -171,6 +198,9 @@ def gestion_morceaux(projet_id):
     # Légende
     st.caption("📝 **Légende :** 🔴 = Aucun texte saisi, 🟠 = Texte saisi, à vérifier, 🟢 = Texte validé")
 
+    recherche_textes(projet_id)
+    relecture_textes(projet_id, morceaux)
+
     # Ajout d'un nouveau morceau
     st.markdown("---")
     st.subheader("➕ Ajouter un nouveau morceau")
@@ -179,7 +209,7 @@ def gestion_morceaux(projet_id):
         col1, col2, col3 = st.columns(3)
         
         with col1:
-            nouvel_ordre = st.number_input(
+            nouvelle_position = st.number_input(
                 "Ordre*",
                 min_value=1,
                 max_value=max_ordre + 10,
@@ -204,24 +234,19 @@ def gestion_morceaux(projet_id):
             if not nouveau_air.strip():
                 st.error("❌ L'air est obligatoire")
             else:
-                # Gestion des conflits d'ordre
-                ordre_final = nouvel_ordre
-                if ordre_existe(projet_id, nouvel_ordre):
-                    # Décaler les ordres
-                    decaler_ordres(projet_id, nouvel_ordre)
-                    st.info(f"⚠️ Ordres décalés à partir de {nouvel_ordre}")
-                
                 # Limiter l'ordre maximum
-                if ordre_final > max_ordre + 1:
-                    ordre_final = max_ordre + 1
-                    st.info(f"⚠️ Ordre limité à {ordre_final}")
+                position_finale = min(nouvelle_position, max_ordre + 1)
+                if position_finale < nouvelle_position:
+                    st.info(f"⚠️ Ordre limité à {position_finale}")
                 
-                # Ajouter le morceau
-                nouveau_id = ajouter_morceau(projet_id, ordre_final, nouveau_air.strip(), nouveau_compositeur.strip(), nouvelle_annee.strip(), nouvel_extrait_de.strip())
+                # Ajouter le morceau (les morceaux suivants sont décalés sans être réécrits)
+                nouveau_id = ajouter_morceau(projet_id, position_finale, nouveau_air.strip(), nouveau_compositeur.strip(), nouvelle_annee.strip(), nouvel_extrait_de.strip())
                 if nouveau_id:
-                    st.success(f"✅ Morceau ajouté (ordre {ordre_final})")
+                    st.success(f"✅ Morceau ajouté (ordre {position_finale})")
                     st.rerun()
 
+    import_en_lot(projet_id)
+
     # Afficher pdf
     st.markdown("---")
     st.subheader("📄 Aperçu PDF des surtitres")
@@ -273,13 +298,7 @@ def gestion_morceaux(projet_id):
         add_blank = st.checkbox("Ajouter une diapositive blanche entre chaque morceau", value=False)
         mode = st.selectbox("Mode",['poème','opéra'])
 
-    latex_content = ""
-    frame_blank = "\\begin{frame}{} \end{frame}\n" if add_blank else ""
-    for morceau_id in [m[0] for m in morceaux]:
-        frame_title = generate_frame_title(morceau_id, mode=mode)
-        texte = generate_text(charger_paroles_depuis_tableur(morceau_id), mode=mode, title=frame_title) if use_text else ""
-        if mode == 'opéra':
-            latex_content += frame_title + "\n" + texte + "\n" + frame_blank + "\n"
-        elif mode == 'poème':
-            latex_content += texte + "\n" + frame_blank + "\n"
-    make_latex(concert_frame_edit + latex_content, mode=mode)
\ No newline at end of file
+    # Fragments TeX calculés à l'enregistrement des morceaux, assemblés en une requête
+    latex_content = assembler_concert(projet_id, mode=mode, use_text=use_text, add_blank=add_blank)
+    diapositives = diapositives_concert(projet_id, mode=mode, use_text=use_text, add_blank=add_blank)
+    make_latex(concert_frame_edit + latex_content, mode=mode, morceaux=diapositives)
\ No newline at end of file
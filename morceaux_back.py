@@ -1,9 +1,16 @@
-import sqlite3
+from connexion import get_connection, debuter_ecriture
 import streamlit as st
+from fusion import fusionner_champs
+from blobs import liberer_blob_si_orphelin
+from recherche import desindexer_morceau
+from memoire import oublier_traductions
+from surtitres import materialiser_titres
+from traces import tracer
 
+@tracer('sqlite.get_concert_frame')
 def get_concert_frame(project_id):
     """Récupérer le concert_frame d'un projet"""
-    conn = sqlite3.connect('projects.db')
+    conn = get_connection(projet_id=project_id)
     c = conn.cursor()
     c.execute('SELECT concert_frame FROM projects WHERE id = ?', (project_id,))
     result = c.fetchone()
@@ -12,7 +19,7 @@ def get_concert_frame(project_id):
 
 def update_concert_frame(project_id, new_concert_frame):
     """Mettre à jour le concert_frame d'un projet"""
-    conn = sqlite3.connect('projects.db')
+    conn = get_connection(projet_id=project_id)
     c = conn.cursor()
     c.execute('UPDATE projects SET concert_frame = ? WHERE id = ?', (new_concert_frame, project_id))
     conn.commit()
@@ -20,18 +27,19 @@ def update_concert_frame(project_id, new_concert_frame):
     return True
 
 def get_project(project_id):
-    conn = sqlite3.connect('projects.db')
+    conn = get_connection(projet_id=project_id)
     c = conn.cursor()
     c.execute('SELECT * FROM projects WHERE id = ?', (project_id,))
     result = c.fetchone()
     conn.close()
     return result  # Doit retourner (id, created_date, modified_date, creator, description, concert_frame)
 
+@tracer('sqlite.charger_morceaux')
 def charger_morceaux(projet_id):
-    conn = sqlite3.connect('projects.db')
+    conn = get_connection(projet_id=projet_id)
     c = conn.cursor()
     c.execute('''
-        SELECT id, ordre, air, compositeur, annee, extrait_de, text_status 
+        SELECT id, ordre, air, compositeur, annee, extrait_de, text_status, revision 
         FROM morceaux 
         WHERE projet_id = ? 
         ORDER BY ordre
@@ -40,54 +48,144 @@ def charger_morceaux(projet_id):
     conn.close()
     return result
 
+# L'ordre des morceaux est une clé à écarts : le morceau en position n reçoit n * ECART_ORDRE lors
+# d'une renumérotation, et un déplacement prend une clé entre ses deux nouveaux voisins. Déplacer
+# un morceau n'écrit donc qu'une ligne ; la liste n'est renumérotée que quand deux voisins ont
+# des clés consécutives. Les numéros affichés (1, 2, 3...) sont les positions, pas les clés.
+ECART_ORDRE = 1024
+
+@tracer('sqlite.get_max_ordre')
 def get_max_ordre(projet_id):
-    """Récupérer le numéro d'ordre maximum"""
-    conn = sqlite3.connect('projects.db')
+    """Récupérer la dernière position (nombre de morceaux du projet)"""
+    conn = get_connection(projet_id=projet_id)
     c = conn.cursor()
-    c.execute('SELECT MAX(ordre) FROM morceaux WHERE projet_id = ?', (projet_id,))
-    result = c.fetchone()[0] or 0
+    c.execute('SELECT COUNT(*) FROM morceaux WHERE projet_id = ?', (projet_id,))
+    result = c.fetchone()[0]
     conn.close()
     return result
 
-def ordre_existe(projet_id, ordre, morceau_id_actuel=None):
-    """Vérifier si un numéro d'ordre existe déjà"""
-    conn = sqlite3.connect('projects.db')
+def renumeroter_ordres(c, projet_id):
+    """Redonner des clés régulièrement espacées à tous les morceaux d'un projet, en une requête
+
+    Seuls les morceaux dont la clé change sont écrits (dans la transaction du curseur c).
+    """
+    c.execute('''
+        WITH rangs AS (
+            SELECT id, ROW_NUMBER() OVER (ORDER BY ordre, id) * ? AS nouvel_ordre
+            FROM morceaux
+            WHERE projet_id = ?
+        )
+        UPDATE morceaux SET ordre = rangs.nouvel_ordre
+        FROM rangs
+        WHERE morceaux.id = rangs.id AND morceaux.ordre IS DISTINCT FROM rangs.nouvel_ordre
+    ''', (ECART_ORDRE, projet_id))
+
+def cle_ordre(c, projet_id, position=None, morceau_exclu=None):
+    """Calculer la clé d'ordre d'un morceau placé à une position (1 = premier, None = à la fin)
+
+    Les clés des autres morceaux sont renumérotées si aucune clé n'est libre entre les deux voisins.
+    """
+    for _ in range(2):
+        # Voisins à la position demandée : celui qui précède et celui qui suit
+        if position is None:
+            c.execute('SELECT MAX(ordre), NULL FROM morceaux WHERE projet_id = ? AND id IS DISTINCT FROM ?',
+                      (projet_id, morceau_exclu))
+            precedent, suivant = c.fetchone()
+        else:
+            position = max(position, 1)
+            c.execute('''
+                SELECT ordre FROM morceaux
+                WHERE projet_id = ? AND id IS DISTINCT FROM ?
+                ORDER BY ordre, id
+                LIMIT 2 OFFSET ?
+            ''', (projet_id, morceau_exclu, max(position - 2, 0)))
+            voisins = [ligne[0] for ligne in c.fetchall()]
+            if position == 1:
+                precedent, suivant = None, (voisins[0] if voisins else None)
+            elif not voisins:
+                # Position au-delà de la fin de la liste
+                return cle_ordre(c, projet_id, None, morceau_exclu)
+            else:
+                precedent, suivant = voisins[0], (voisins[1] if len(voisins) > 1 else None)
+
+        if precedent is None and suivant is None:
+            return ECART_ORDRE
+        if suivant is None:
+            return precedent + ECART_ORDRE
+        if precedent is None:
+            return suivant - ECART_ORDRE
+        if suivant - precedent > 1:
+            return (precedent + suivant) // 2
+        # Plus de clé libre entre les voisins : renumérotation puis nouvel essai
+        renumeroter_ordres(c, projet_id)
+    raise RuntimeError("Impossible de calculer une clé d'ordre")
+
+def cle_deplacement(c, morceau_id, position):
+    """Clé d'ordre d'un morceau existant déplacé à une position (dans la transaction du curseur c)"""
+    c.execute('SELECT projet_id FROM morceaux WHERE id = ?', (morceau_id,))
+    return cle_ordre(c, c.fetchone()[0], position, morceau_exclu=morceau_id)
+
+def deplacer_morceau(morceau_id, position):
+    """Déplacer un morceau à une position (1 = premier) en n'écrivant que sa clé d'ordre"""
+    conn = get_connection(morceau_id=morceau_id)
     c = conn.cursor()
-    if morceau_id_actuel:
-        c.execute('SELECT id FROM morceaux WHERE projet_id = ? AND ordre = ? AND id != ?', 
-                 (projet_id, ordre, morceau_id_actuel))
-    else:
-        c.execute('SELECT id FROM morceaux WHERE projet_id = ? AND ordre = ?', 
-                 (projet_id, ordre))
-    result = c.fetchone() is not None
-    conn.close()
-    return result
+    
+    try:
+        # Lecture des voisins et écriture dans la même transaction : deux déplacements simultanés
+        # ne peuvent pas calculer leur clé sur le même état
+        debuter_ecriture(c)
+        c.execute('UPDATE morceaux SET ordre = ? WHERE id = ?',
+                  (cle_deplacement(c, morceau_id, position), morceau_id))
+        conn.commit()
+        return True
+    except Exception as e:
+        conn.rollback()
+        st.error(f"Erreur lors du déplacement : {e}")
+        return False
+    finally:
+        conn.close()
+
+def reordonner_morceaux(projet_id, morceau_ids):
+    """Appliquer un nouvel ordre complet (liste des identifiants dans l'ordre voulu) en une transaction
+
+    Seuls les morceaux dont la clé change sont écrits ; la liste doit contenir
+    exactement les morceaux du projet.
+    """
+    conn = get_connection(projet_id=projet_id)
+    c = conn.cursor()
+    
+    try:
+        debuter_ecriture(c)
+        c.execute('SELECT id, ordre FROM morceaux WHERE projet_id = ?', (projet_id,))
+        ordres = dict(c.fetchall())
+        if sorted(ordres) != sorted(morceau_ids):
+            conn.rollback()
+            st.warning("⚠️ La liste des morceaux a changé entre-temps, rechargez avant de réordonner.")
+            return False
+        c.executemany('UPDATE morceaux SET ordre = ? WHERE id = ?', [
+            (position * ECART_ORDRE, morceau_id)
+            for position, morceau_id in enumerate(morceau_ids, 1)
+            if ordres[morceau_id] != position * ECART_ORDRE
+        ])
+        conn.commit()
+        return True
+    except Exception as e:
+        conn.rollback()
+        st.error(f"Erreur lors du réordonnancement : {e}")
+        return False
+    finally:
+        conn.close()
 
 def nettoyer_ordre_morceaux(projet_id):
-    """Réorganise l'ordre des morceaux pour avoir une suite incrémentée de 1"""
-    conn = sqlite3.connect('projects.db')
+    """Redonner des clés d'ordre régulièrement espacées aux morceaux d'un projet"""
+    conn = get_connection(projet_id=projet_id)
     c = conn.cursor()
     
     try:
-        # Récupérer tous les morceaux triés par ordre actuel
-        c.execute('''
-            SELECT id, ordre, air 
-            FROM morceaux 
-            WHERE projet_id = ? 
-            ORDER BY ordre, id
-        ''', (projet_id,))
-        morceaux = c.fetchall()
-        
-        if not morceaux:
-            return True
-            
-        # Mettre à jour l'ordre de façon séquentielle
-        for nouvel_ordre, (morceau_id, ancien_ordre, air) in enumerate(morceaux, 1):
-            c.execute('UPDATE morceaux SET ordre = ? WHERE id = ?', (nouvel_ordre, morceau_id))
-        
+        debuter_ecriture(c)
+        renumeroter_ordres(c, projet_id)
         conn.commit()
         return True
-        
     except Exception as e:
         conn.rollback()
         st.error(f"Erreur lors du nettoyage de l'ordre : {e}")
@@ -95,29 +193,70 @@ def nettoyer_ordre_morceaux(projet_id):
     finally:
         conn.close()
 
-def decaler_ordres(projet_id, ordre_depuis):
-    """Décaler tous les ordres à partir d'un certain numéro"""
-    conn = sqlite3.connect('projects.db')
-    c = conn.cursor()
-    c.execute('''
-        UPDATE morceaux 
-        SET ordre = ordre + 1 
-        WHERE projet_id = ? AND ordre >= ?
-    ''', (projet_id, ordre_depuis))
-    conn.commit()
-    conn.close()
+colonnes_morceau = ['ordre', 'air', 'compositeur', 'annee', 'extrait_de', 'text_status']
+# Colonnes qui apparaissent dans les titres matérialisés (surtitres.materialiser_titres)
+colonnes_titre = {'air', 'compositeur', 'annee', 'extrait_de'}
+
+def mettre_a_jour_morceau(morceau_id, ordre, air, compositeur, annee, extrait_de, text_status, base=None, position=None):
+    """Mettre à jour un morceau individuel
 
-def mettre_a_jour_morceau(morceau_id, ordre, air, compositeur, annee, extrait_de, text_status):
-    """Mettre à jour un morceau individuel"""
-    conn = sqlite3.connect('projects.db')
+    base : couple (revision, valeurs) du morceau tel qu'il a été affiché, les valeurs
+    étant dans l'ordre des paramètres. S'il est fourni, seuls les champs modifiés
+    sont écrits, et les modifications faites entre-temps par un autre éditeur sur
+    d'autres champs sont conservées. Si le même champ a été modifié des deux côtés,
+    rien n'est écrit et la fonction renvoie False.
+    position : si elle est fournie, le morceau y est aussi déplacé (1 = premier), dans
+    la même transaction : la clé d'ordre calculée remplace ordre, et rien n'est
+    déplacé si la mise à jour échoue.
+    """
+    conn = get_connection(morceau_id=morceau_id)
     c = conn.cursor()
+    valeurs = [ordre, air, compositeur, annee, extrait_de, text_status]
     
     try:
-        c.execute('''
-            UPDATE morceaux 
-            SET ordre = ?, air = ?, compositeur = ?, annee = ?, extrait_de = ?, text_status = ?
-            WHERE id = ?
-        ''', (ordre, air, compositeur, annee, extrait_de, text_status, morceau_id))
+        if base is None:
+            if position is not None:
+                debuter_ecriture(c)
+                valeurs[0] = cle_deplacement(c, morceau_id, position)
+            c.execute('''
+                UPDATE morceaux 
+                SET ordre = ?, air = ?, compositeur = ?, annee = ?, extrait_de = ?, text_status = ?
+                WHERE id = ?
+            ''', (*valeurs, morceau_id))
+            materialiser_titres(c, morceau_id)
+            conn.commit()
+            return True
+
+        revision_base, valeurs_base = base
+        debuter_ecriture(c)
+        c.execute(f'SELECT revision, {", ".join(colonnes_morceau)} FROM morceaux WHERE id = ?', (morceau_id,))
+        actuel = c.fetchone()
+        if actuel is None:
+            conn.rollback()
+            st.warning("⚠️ Ce morceau a été supprimé entre-temps par un autre éditeur")
+            return False
+        revision_actuelle, valeurs_actuelles = actuel[0], list(actuel[1:])
+
+        if revision_actuelle != revision_base:
+            # Le morceau a changé depuis l'affichage : fusion champ par champ
+            valeurs, conflits = fusionner_champs(list(valeurs_base), valeurs, valeurs_actuelles)
+            if conflits:
+                conn.rollback()
+                champs = ", ".join(colonnes_morceau[i] for i in conflits)
+                st.warning(f"⚠️ Modification concurrente : {champs} a été modifié entre-temps par un autre éditeur. Rechargez avant de réessayer.")
+                return False
+
+        if position is not None:
+            # La clé est calculée après la vérification, sur l'état verrouillé par la transaction
+            valeurs[0] = cle_deplacement(c, morceau_id, position)
+        # La clé d'ordre lue peut avoir été renumérotée par cle_ordre : elle est toujours écrite après un déplacement
+        modifies = [i for i in range(len(valeurs)) if valeurs[i] != valeurs_actuelles[i] or (i == 0 and position is not None)]
+        if modifies:
+            affectations = ", ".join(f"{colonnes_morceau[i]} = ?" for i in modifies)
+            c.execute(f'UPDATE morceaux SET {affectations} WHERE id = ?',
+                      (*[valeurs[i] for i in modifies], morceau_id))
+            if any(colonnes_morceau[i] in colonnes_titre for i in modifies):
+                materialiser_titres(c, morceau_id)
         conn.commit()
         return True
     except Exception as e:
@@ -127,18 +266,22 @@ def mettre_a_jour_morceau(morceau_id, ordre, air, compositeur, annee, extrait_de
     finally:
         conn.close()
 
-def ajouter_morceau(projet_id, ordre, air, compositeur, annee, extrait_de, text_status='not_started'):
-    """Ajouter un nouveau morceau"""
-    conn = sqlite3.connect('projects.db')
+def ajouter_morceau(projet_id, position, air, compositeur, annee, extrait_de, text_status='not_started'):
+    """Ajouter un nouveau morceau à une position (1 = premier, None = à la fin)"""
+    conn = get_connection(projet_id=projet_id)
     c = conn.cursor()
     
     try:
+        debuter_ecriture(c)
         c.execute('''
             INSERT INTO morceaux (projet_id, ordre, air, compositeur, annee, extrait_de, text_status)
             VALUES (?, ?, ?, ?, ?, ?, ?)
-        ''', (projet_id, ordre, air, compositeur, annee, extrait_de, text_status))
+            RETURNING id
+        ''', (projet_id, cle_ordre(c, projet_id, position), air, compositeur, annee, extrait_de, text_status))
+        morceau_id = c.fetchone()[0]
+        materialiser_titres(c, morceau_id)
         conn.commit()
-        return c.lastrowid
+        return morceau_id
     except Exception as e:
         conn.rollback()
         st.error(f"Erreur lors de l'ajout : {e}")
@@ -148,15 +291,22 @@ def ajouter_morceau(projet_id, ordre, air, compositeur, annee, extrait_de, text_
 
 def supprimer_morceau(morceau_id):
     """Supprimer un morceau"""
-    conn = sqlite3.connect('projects.db')
+    conn = get_connection(morceau_id=morceau_id)
     c = conn.cursor()
     
     try:
+        c.execute('SELECT empreinte FROM tableurs_paroles WHERE morceau_id = ?', (morceau_id,))
+        empreintes = [ligne[0] for ligne in c.fetchall()]
         # Supprimer d'abord les tableurs associés
         c.execute('DELETE FROM tableurs_paroles WHERE morceau_id = ?', (morceau_id,))
+        desindexer_morceau(c, morceau_id)
+        oublier_traductions(c, morceau_id)
+        c.execute('DELETE FROM fragments_tex WHERE morceau_id = ?', (morceau_id,))
         # Puis supprimer le morceau
         c.execute('DELETE FROM morceaux WHERE id = ?', (morceau_id,))
         conn.commit()
+        for empreinte in empreintes:
+            liberer_blob_si_orphelin(empreinte)
         return True
     except Exception as e:
         conn.rollback()
@@ -165,8 +315,9 @@ def supprimer_morceau(morceau_id):
     finally:
         conn.close()
 
+@tracer('sqlite.get_morceau')
 def get_morceau(morceau_id):
-    conn = sqlite3.connect('projects.db')
+    conn = get_connection(morceau_id=morceau_id)
     c = conn.cursor()
     c.execute('''
         SELECT id, ordre, air, compositeur, annee, extrait_de, text_status 
@@ -176,4 +327,23 @@ def get_morceau(morceau_id):
     ''', (morceau_id,))
     result = c.fetchall()
     conn.close()
-    return result[0]
\ No newline at end of file
+    return result[0]
+
+@tracer('sqlite.get_revision_morceau')
+def get_revision_morceau(morceau_id):
+    """Récupérer la révision d'un morceau (révision du projet lors de sa dernière modification)"""
+    conn = get_connection(morceau_id=morceau_id)
+    c = conn.cursor()
+    c.execute('SELECT revision FROM morceaux WHERE id = ?', (morceau_id,))
+    result = c.fetchone()
+    conn.close()
+    return result[0] if result else None
+
+def morceaux_modifies_depuis(projet_id, revision):
+    """Lister les morceaux d'un projet modifiés après une révision donnée"""
+    conn = get_connection(projet_id=projet_id)
+    c = conn.cursor()
+    c.execute('SELECT id FROM morceaux WHERE projet_id = ? AND revision > ?', (projet_id, revision))
+    result = [ligne[0] for ligne in c.fetchall()]
+    conn.close()
+    return result
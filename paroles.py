@@ -1,15 +1,29 @@
 import streamlit as st
-import sqlite3
+from connexion import get_connection, connexions_bases, debuter_ecriture
 import datetime
 import re
 import pandas as pd
 import io
-from surtitres import generate_frame_title, generate_text, make_latex
-from morceaux_back import get_morceau, mettre_a_jour_morceau
+from surtitres import generate_frame_title, rendre_diapos, make_latex, materialiser_titres, materialiser_textes
+from diapositives import morceau_a_la_revision
+from morceaux_back import get_morceau, mettre_a_jour_morceau, get_revision_morceau
+from fusion import ConflitEdition, fusionner_lignes, lignes_modifiees
+from blobs import stocker_blob, lire_blob, liberer_blob_si_orphelin
+from recherche import indexer_paroles
+from memoire import memoriser_traductions, suggerer_traductions
+from traces import tracer
+import json
+import collections
+import threading
 
 # Constante pour la limite de caractères
 NB_CAR_MAX = 70
 
+# Textes lus par le préchauffage (prechauffage.py), partagés par les sessions, par (morceau, révision)
+PAROLES_EN_MEMOIRE_MAX = 2000
+_paroles_en_memoire = collections.OrderedDict()
+_verrou_paroles = threading.Lock()
+
 # Fonctions pour les tableurs
 def nettoyer_nom_fichier(air):
     """Nettoyer le nom de l'air pour créer un nom de fichier valide"""
@@ -17,18 +31,59 @@ def nettoyer_nom_fichier(air):
     nom_clean = re.sub(r'[-\s]+', '_', nom_clean)
     return nom_clean.strip('_').lower()
 
+@tracer('sqlite.tableur_existe')
 def tableur_existe(morceau_id):
     """Vérifier si un tableur existe pour ce morceau"""
-    conn = sqlite3.connect('projects.db')
+    conn = get_connection(morceau_id=morceau_id)
     c = conn.cursor()
     c.execute('SELECT id, nom_fichier, date_import FROM tableurs_paroles WHERE morceau_id = ?', (morceau_id,))
     result = c.fetchone()
     conn.close()
     return result
 
-def sauvegarder_tableur(morceau_id, fichier_uploaded, titre_air):
-    """Sauvegarder le tableur uploadé"""
-    conn = sqlite3.connect('projects.db')
+def ecrire_tableur(c, morceau_id, nom_fichier, empreinte, taille, paroles):
+    """Enregistrer le tableur d'un morceau et indexer son texte (dans la transaction du curseur c)
+
+    Retourne l'empreinte du contenu remplacé (None s'il n'y en avait pas), à libérer après validation.
+    """
+    c.execute('SELECT empreinte FROM tableurs_paroles WHERE morceau_id = ?', (morceau_id,))
+    ancien = c.fetchone()
+
+    date_import = datetime.datetime.now().isoformat()
+    c.execute('''
+        UPDATE tableurs_paroles
+        SET nom_fichier = ?, date_import = ?, donnees = NULL, empreinte = ?, taille = ?
+        WHERE morceau_id = ?
+    ''', (nom_fichier, date_import, empreinte, taille, morceau_id))
+    if c.rowcount == 0:
+        c.execute('''
+            INSERT INTO tableurs_paroles (morceau_id, nom_fichier, date_import, empreinte, taille)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (morceau_id, nom_fichier, date_import, empreinte, taille))
+
+    # Un morceau qui a un tableur a du texte : le statut est dérivé ici plutôt qu'à l'affichage
+    c.execute("UPDATE morceaux SET text_status = 'draft' WHERE id = ? AND text_status = 'not_started'", (morceau_id,))
+
+    # L'index de recherche et la mémoire de traduction sont mis à jour avec le texte, jamais l'un sans l'autre
+    c.execute('SELECT projet_id FROM morceaux WHERE id = ?', (morceau_id,))
+    indexer_paroles(c, morceau_id, c.fetchone()[0], lignes_paroles(paroles))
+    memoriser_traductions(c, morceau_id, lignes_paroles(paroles))
+    c.execute('UPDATE tableurs_paroles SET indexe = 1 WHERE morceau_id = ?', (morceau_id,))
+    materialiser_textes(c, morceau_id, paroles)
+    return ancien[0] if ancien else None
+
+@tracer('sqlite.sauvegarder_tableur')
+def sauvegarder_tableur(morceau_id, fichier_uploaded, titre_air, revision_attendue=None, lignes=None, paroles=None):
+    """Sauvegarder le tableur uploadé
+
+    Si revision_attendue est fournie, l'écriture n'a lieu que si le morceau est
+    toujours à cette révision ; sinon ConflitEdition est levée.
+    lignes : index des lignes modifiées, publiés dans le journal des modifications
+    (None si tout le texte est à considérer comme modifié).
+    paroles : DataFrame du texte déjà lu, indexé pour la recherche dans la même
+    transaction (sinon le fichier est lu ici).
+    """
+    conn = get_connection(morceau_id=morceau_id)
     c = conn.cursor()
     
     try:
@@ -44,16 +99,36 @@ def sauvegarder_tableur(morceau_id, fichier_uploaded, titre_air):
             extension = fichier_uploaded.name.split('.')[-1] if '.' in fichier_uploaded.name else "xlsx"
         
         nom_fichier_clean = f"{nettoyer_nom_fichier(titre_air)}.{extension}"
+
+        if paroles is None:
+            paroles = paroles_indexables(nom_fichier_clean, donnees)
+
+        # Le contenu est écrit dans le stockage par empreinte avant la transaction
+        empreinte = stocker_blob(donnees)
         
-        c.execute('DELETE FROM tableurs_paroles WHERE morceau_id = ?', (morceau_id,))
-        
-        c.execute('''
-            INSERT INTO tableurs_paroles (morceau_id, nom_fichier, date_import, donnees)
-            VALUES (?, ?, ?, ?)
-        ''', (morceau_id, nom_fichier_clean, datetime.datetime.now().isoformat(), donnees))
+        debuter_ecriture(c)
+        if revision_attendue is not None:
+            c.execute('SELECT revision FROM morceaux WHERE id = ?', (morceau_id,))
+            revision = c.fetchone()
+            if revision is None or revision[0] != revision_attendue:
+                raise ConflitEdition(morceau_id)
+
+        empreinte_remplacee = ecrire_tableur(c, morceau_id, nom_fichier_clean, empreinte, len(donnees), paroles)
+
+        if lignes is not None:
+            # Préciser les lignes touchées dans l'entrée du journal créée par le trigger
+            c.execute('''
+                UPDATE journal_modifications SET lignes = ?
+                WHERE id = (SELECT MAX(id) FROM journal_modifications WHERE morceau_id = ? AND objet = 'paroles')
+            ''', (json.dumps(lignes), morceau_id))
         
         conn.commit()
+        if empreinte_remplacee != empreinte:
+            liberer_blob_si_orphelin(empreinte_remplacee)
         return True
+    except ConflitEdition:
+        conn.rollback()
+        raise
     except Exception as e:
         conn.rollback()
         st.error(f"Erreur lors de la sauvegarde : {e}")
@@ -61,69 +136,248 @@ def sauvegarder_tableur(morceau_id, fichier_uploaded, titre_air):
     finally:
         conn.close()
 
+@tracer('sqlite.charger_tableur')
 def charger_tableur(morceau_id):
-    """Charger le tableur depuis la base de données"""
-    conn = sqlite3.connect('projects.db')
+    """Charger le tableur depuis la base de données
+
+    Retourne (nom_fichier, donnees) ; donnees (bytes) est lu dans le stockage par empreinte.
+    """
+    conn = get_connection(morceau_id=morceau_id)
     c = conn.cursor()
-    c.execute('SELECT nom_fichier, donnees FROM tableurs_paroles WHERE morceau_id = ?', (morceau_id,))
+    c.execute('SELECT nom_fichier, donnees, empreinte FROM tableurs_paroles WHERE morceau_id = ?', (morceau_id,))
     result = c.fetchone()
     conn.close()
-    return result
+    if result is None:
+        return None
+    nom_fichier, donnees, empreinte = result
+    return nom_fichier, (lire_blob(empreinte) if empreinte else donnees)
+
+@tracer('read_excel')
+def lire_tableur(nom_fichier, donnees):
+    """Lire le contenu brut d'un tableur (.ods, .xlsx, .xls) sous forme de DataFrame"""
+    if nom_fichier.endswith('.ods'):
+        return pd.read_excel(io.BytesIO(donnees), engine='odf')
+    return pd.read_excel(io.BytesIO(donnees))
+
+def normaliser_colonnes(df):
+    """Ramener un DataFrame lu depuis un tableur aux colonnes Original et Traduction"""
+    if len(df.columns) < 2:
+        return pd.DataFrame(columns=['Original', 'Traduction'])
+    df = df.iloc[:, :2]  # Prendre seulement les 2 premières colonnes
+    df.columns = ['Original', 'Traduction']
+    return df
+
+@tracer('to_excel')
+def tableur_depuis_paroles(df):
+    """Écrire le DataFrame des paroles dans un fichier Excel en mémoire"""
+    output = io.BytesIO()
+    with pd.ExcelWriter(output, engine='openpyxl') as writer:
+        df.to_excel(writer, index=False, sheet_name='Texte')
+    return output.getvalue()
+
+def paroles_indexables(nom_fichier, donnees):
+    """Lire un tableur pour l'indexer ; un fichier illisible donne un texte vide plutôt qu'une erreur"""
+    try:
+        return normaliser_colonnes(lire_tableur(nom_fichier, donnees))
+    except Exception:
+        return pd.DataFrame(columns=['Original', 'Traduction'])
+
+def indexer_tableurs_manquants():
+    """Indexer (recherche et mémoire de traduction) les tableurs enregistrés avant ces index ; retourne le nombre indexé"""
+    return sum(indexer_tableurs_manquants_base(conn) for conn in connexions_bases())
+
+def indexer_tableurs_manquants_base(conn):
+    """Indexer les tableurs manquants d'une base (la connexion est fermée)"""
+    c = conn.cursor()
+    c.execute('''
+        SELECT t.morceau_id, m.projet_id, t.nom_fichier, t.donnees, t.empreinte
+        FROM tableurs_paroles t
+        JOIN morceaux m ON m.id = t.morceau_id
+        WHERE t.indexe = 0
+    ''')
+    a_indexer = c.fetchall()
+    try:
+        debuter_ecriture(c)
+        for morceau_id, projet_id, nom_fichier, donnees, empreinte in a_indexer:
+            paroles = paroles_indexables(nom_fichier, lire_blob(empreinte) if empreinte else donnees)
+            indexer_paroles(c, morceau_id, projet_id, lignes_paroles(paroles))
+            memoriser_traductions(c, morceau_id, lignes_paroles(paroles))
+            c.execute('UPDATE tableurs_paroles SET indexe = 1 WHERE morceau_id = ? AND empreinte IS NOT DISTINCT FROM ?',
+                      (morceau_id, empreinte))
+        conn.commit()
+        return len(a_indexer)
+    except Exception as e:
+        conn.rollback()
+        st.error(f"Erreur lors de l'indexation des textes : {e}")
+        return 0
+    finally:
+        conn.close()
+
+def materialiser_fragments_manquants(c):
+    """Calculer les fragments TeX des morceaux qui n'en ont pas encore (dans la transaction du curseur c)"""
+    c.execute('SELECT id FROM morceaux WHERE id NOT IN (SELECT morceau_id FROM fragments_tex)')
+    morceau_ids = [ligne[0] for ligne in c.fetchall()]
+    for morceau_id in morceau_ids:
+        materialiser_titres(c, morceau_id)
+        c.execute('SELECT nom_fichier, donnees, empreinte FROM tableurs_paroles WHERE morceau_id = ?', (morceau_id,))
+        tableur = c.fetchone()
+        if tableur is not None:
+            nom_fichier, donnees, empreinte = tableur
+            materialiser_textes(c, morceau_id, paroles_indexables(nom_fichier, lire_blob(empreinte) if empreinte else donnees))
+    return len(morceau_ids)
+
+def completer_index_paroles():
+    """Indexer les tableurs manquants une fois par session, avant la première recherche ou suggestion"""
+    if not st.session_state.get('index_paroles_complet'):
+        indexer_tableurs_manquants()
+        st.session_state.index_paroles_complet = True
 
 def charger_paroles_depuis_tableur(morceau_id):
     """Charger le texte depuis le tableur sous forme de DataFrame"""
     tableur_data = charger_tableur(morceau_id)
     
     if tableur_data:
-        nom_fichier, donnees = tableur_data
-        
-        try:
-            if nom_fichier.endswith('.ods'):
-                df = pd.read_excel(io.BytesIO(donnees), engine='odf')
-            else:
-                df = pd.read_excel(io.BytesIO(donnees))
-            
-            # Assurer que nous avons les bonnes colonnes
-            if len(df.columns) < 2:
-                df = pd.DataFrame(columns=['Original', 'Traduction'])
-            elif len(df.columns) > 2:
-                df = df.iloc[:, :2]  # Prendre seulement les 2 premières colonnes
-                df.columns = ['Original', 'Traduction']
-            else:
-                df.columns = ['Original', 'Traduction']
-                
-            return df
-        except Exception as e:
-            st.error(f"Erreur lors de la lecture du tableur : {e}")
-            return pd.DataFrame(columns=['Original', 'Traduction'])
+        return paroles_depuis_donnees(*tableur_data)
     
     return pd.DataFrame(columns=['Original', 'Traduction'])
 
-def sauvegarder_paroles_vers_tableur(morceau_id, df, titre_air):
-    """Sauvegarder le DataFrame vers le tableur"""
+def paroles_depuis_donnees(nom_fichier, donnees):
+    """Lire le texte d'un tableur déjà chargé (nom_fichier, donnees)"""
     try:
-        # Créer un fichier Excel en mémoire
-        output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, index=False, sheet_name='Texte')
-        
-        # Créer un fichier uploadé simulé
-        class FakeUploadedFile:
-            def __init__(self, data, filename):
-                self.data = data
-                self.name = filename
-                self.type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        return normaliser_colonnes(lire_tableur(nom_fichier, donnees))
+    except Exception as e:
+        st.error(f"Erreur lors de la lecture du tableur : {e}")
+        return pd.DataFrame(columns=['Original', 'Traduction'])
+
+def paroles_en_memoire(morceau_id, revision):
+    """Texte d'un morceau à une révision donnée s'il a déjà été lu par le processus (sinon None)"""
+    with _verrou_paroles:
+        df = _paroles_en_memoire.get((morceau_id, revision))
+        if df is not None:
+            _paroles_en_memoire.move_to_end((morceau_id, revision))
+        return df
+
+def memoriser_paroles(morceau_id, revision, df):
+    """Garder en mémoire le texte d'un morceau à une révision (les plus anciens sont oubliés)"""
+    with _verrou_paroles:
+        _paroles_en_memoire[(morceau_id, revision)] = df
+        while len(_paroles_en_memoire) > PAROLES_EN_MEMOIRE_MAX:
+            _paroles_en_memoire.popitem(last=False)
+
+@tracer('paroles_du_projet')
+def paroles_du_projet(projet_id, annule=None):
+    """Textes de tous les morceaux d'un projet, dans l'ordre : liste de (morceau_id, DataFrame)
+
+    Les morceaux et leurs tableurs sont lus en une requête ; les textes déjà en
+    mémoire à la même révision sont repris, les autres lus et mémorisés.
+    annule : threading.Event qui interrompt la lecture (liste incomplète).
+    """
+    conn = get_connection(projet_id=projet_id)
+    c = conn.cursor()
+    # Révision et tableur lus par la même requête : le texte correspond à la révision
+    c.execute('''
+        SELECT m.id, m.revision, t.nom_fichier, t.donnees, t.empreinte
+        FROM morceaux m
+        LEFT JOIN tableurs_paroles t ON t.morceau_id = m.id
+        WHERE m.projet_id = ?
+        ORDER BY m.ordre
+    ''', (projet_id,))
+    morceaux = c.fetchall()
+    conn.close()
+    textes = []
+    for morceau_id, revision, nom_fichier, donnees, empreinte in morceaux:
+        if annule is not None and annule.is_set():
+            break
+        df = paroles_en_memoire(morceau_id, revision)
+        if df is None:
+            if nom_fichier is None:
+                df = pd.DataFrame(columns=['Original', 'Traduction'])
+            else:
+                df = paroles_indexables(nom_fichier, lire_blob(empreinte) if empreinte else donnees)
+            memoriser_paroles(morceau_id, revision, df)
+        textes.append((morceau_id, df))
+    return textes
+
+def charger_paroles_en_cache(morceau_id):
+    """Charger (revision, DataFrame) des paroles en passant par le cache de la session
+
+    Le cache est vidé morceau par morceau par flux.synchroniser_session quand un
+    texte est modifié ; la révision est lue avant le texte pour ne jamais être plus
+    récente que lui. Un texte déjà lu à cette révision par le préchauffage est repris.
+    """
+    cache = st.session_state.setdefault('cache_paroles', {})
+    if morceau_id not in cache:
+        revision = get_revision_morceau(morceau_id)
+        df = paroles_en_memoire(morceau_id, revision)
+        cache[morceau_id] = (revision, df if df is not None else charger_paroles_depuis_tableur(morceau_id))
+    return cache[morceau_id]
+
+def lignes_paroles(df):
+    """Convertir le DataFrame des paroles en liste de couples (original, traduction) comparables"""
+    return [
+        tuple(None if pd.isna(valeur) else valeur for valeur in ligne)
+        for ligne in df[['Original', 'Traduction']].itertuples(index=False, name=None)
+    ]
+
+def sauvegarder_paroles_vers_tableur(morceau_id, df, titre_air, base=None):
+    """Sauvegarder le DataFrame vers le tableur
+
+    base : couple (revision, DataFrame) des paroles telles qu'elles ont été affichées
+    avant modification. S'il est fourni, les modifications faites entre-temps par un
+    autre éditeur sur d'autres lignes sont fusionnées, et la sauvegarde est refusée
+    si les mêmes lignes ont été modifiées des deux côtés.
+    """
+    for _ in range(3):
+        revision_attendue = None
+        lignes = None
+        if base is not None:
+            revision_base, df_base = base
+            revision_attendue = get_revision_morceau(morceau_id)
+            df_precedent = df_base
+            if revision_attendue != revision_base:
+                # Le texte a changé depuis l'affichage : fusion ligne par ligne
+                df_actuel = charger_paroles_depuis_tableur(morceau_id)
+                fusion, conflits = fusionner_lignes(lignes_paroles(df_base), lignes_paroles(df), lignes_paroles(df_actuel))
+                if conflits:
+                    lignes = ", ".join(
+                        str(debut + 1) if fin - debut <= 1 else f"{debut + 1}-{fin}"
+                        for debut, fin, _, _ in conflits
+                    )
+                    st.warning(f"⚠️ Modification concurrente : ligne(s) {lignes} modifiée(s) entre-temps par un autre éditeur. Vos changements n'ont pas été enregistrés.")
+                    return False
+                df = pd.DataFrame(fusion, columns=['Original', 'Traduction'])
+                base = (revision_attendue, df_actuel)
+                df_precedent = df_actuel
+            lignes = lignes_modifiees(lignes_paroles(df_precedent), lignes_paroles(df))
+
+        try:
+            # Créer un fichier Excel en mémoire
+            donnees = tableur_depuis_paroles(df)
             
-            def getvalue(self):
-                return self.data
-        
-        fake_file = FakeUploadedFile(output.getvalue(), f"{nettoyer_nom_fichier(titre_air)}.xlsx")
-        
-        return sauvegarder_tableur(morceau_id, fake_file, titre_air)
+            # Créer un fichier uploadé simulé
+            class FakeUploadedFile:
+                def __init__(self, data, filename):
+                    self.data = data
+                    self.name = filename
+                    self.type = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+                
+                def getvalue(self):
+                    return self.data
+            
+            fake_file = FakeUploadedFile(donnees, f"{nettoyer_nom_fichier(titre_air)}.xlsx")
+            
+            return sauvegarder_tableur(morceau_id, fake_file, titre_air, revision_attendue=revision_attendue,
+                                       lignes=lignes, paroles=df)
         
-    except Exception as e:
-        st.error(f"Erreur lors de la sauvegarde du texte : {e}")
-        return False
+        except ConflitEdition:
+            # Une autre écriture est passée entre la lecture et l'écriture : on refusionne
+            continue
+        except Exception as e:
+            st.error(f"Erreur lors de la sauvegarde du texte : {e}")
+            return False
+
+    st.warning("⚠️ Le texte est modifié en continu par d'autres éditeurs, réessayez dans un instant.")
+    return False
 
 def afficher_contenu_tableur(morceau_id):
     """Afficher le contenu du tableur sous forme de tableau"""
@@ -133,10 +387,7 @@ def afficher_contenu_tableur(morceau_id):
         nom_fichier, donnees = tableur_data
         
         try:
-            if nom_fichier.endswith('.ods'):
-                df = pd.read_excel(io.BytesIO(donnees), engine='odf')
-            else:
-                df = pd.read_excel(io.BytesIO(donnees))
+            df = lire_tableur(nom_fichier, donnees)
             
             st.dataframe(
                 df,
@@ -167,6 +418,8 @@ def edition_paroles_tableur(morceau_id, morceau_titre=""):
             del st.session_state.current_morceau_titre
         if 'edition_ligne_index' in st.session_state:
             del st.session_state.edition_ligne_index
+        st.session_state.pop('edition_base', None)
+        st.session_state.pop(f"paroles_affichees_{morceau_id}", None)
         st.rerun()
     
     _, ordre, morceau_titre, compositeur, annee, extrait_de, text_status = get_morceau(morceau_id)
@@ -178,7 +431,17 @@ def edition_paroles_tableur(morceau_id, morceau_titre=""):
         st.session_state.edition_ligne_index = None
     
     # Charger les paroles
-    df_paroles = charger_paroles_depuis_tableur(morceau_id)
+    revision, df_paroles = charger_paroles_en_cache(morceau_id)
+
+    # Lignes modifiées par d'autres éditeurs depuis l'exécution précédente
+    lignes_changees = st.session_state.get('lignes_modifiees', {}).pop(morceau_id, set())
+
+    # Les boutons cliqués portent sur le texte affiché lors de l'exécution précédente :
+    # c'est la base des modifications, fusionnées avec celles des autres éditeurs
+    cle_affichage = f"paroles_affichees_{morceau_id}"
+    base_affichee = st.session_state.get(cle_affichage, (revision, df_paroles))
+    st.session_state[cle_affichage] = (revision, df_paroles)
+    valeurs_affichees = (ordre, morceau_titre, compositeur, annee, extrait_de, text_status)
     
     # Vérifier si un tableur existe déjà
     tableur_existant = tableur_existe(morceau_id)
@@ -199,7 +462,7 @@ def edition_paroles_tableur(morceau_id, morceau_titre=""):
                 def status_change():
                     nonlocal nouveau_status
                     nouveau_status = helper_status[st.session_state[f"select_status_{morceau_id}"]]
-                    mettre_a_jour_morceau(morceau_id, ordre, morceau_titre, compositeur, annee, extrait_de, nouveau_status)
+                    mettre_a_jour_morceau(morceau_id, ordre, morceau_titre, compositeur, annee, extrait_de, nouveau_status, base=(revision, valeurs_affichees))
 
                 nouveau_status = st.selectbox(
                     "Avancement",
@@ -229,7 +492,7 @@ def edition_paroles_tableur(morceau_id, morceau_titre=""):
                 
                 st.download_button(
                     label="📥 Télécharger le tableur",
-                    data=donnees,
+                    data=bytes(donnees),
                     file_name=nom_fichier,
                     mime=type_mime
                 )
@@ -266,6 +529,8 @@ def edition_paroles_tableur(morceau_id, morceau_titre=""):
                 if st.session_state.edition_ligne_index == index:
                     # Mode édition de la ligne
                     st.write(f"**Édition de la ligne {index + 1}**")
+                    if index in lignes_changees or None in lignes_changees:
+                        st.warning("⚠️ Le texte vient d'être modifié par un autre éditeur, vérifiez cette ligne avant de sauvegarder.")
                     
                     col1, col2, col3 = st.columns([0.45, 0.45, 0.1])
                     
@@ -290,25 +555,41 @@ def edition_paroles_tableur(morceau_id, morceau_titre=""):
                         )
                         if len(nouvelle_traduction) > NB_CAR_MAX:
                             st.warning(f"⚠️ {len(nouvelle_traduction)}/{NB_CAR_MAX} caractères")
-                    
+
+                        # Traductions déjà saisies pour ce vers (ou un vers proche) dans d'autres morceaux
+                        completer_index_paroles()
+                        for i, suggestion in enumerate(suggerer_traductions(nouveau_original, exclure=nouvelle_traduction)):
+                            def utiliser_suggestion(traduction=suggestion['traduction']):
+                                st.session_state[f"edit_trad_{index}"] = traduction
+                            col_suggestion, col_utiliser = st.columns([0.85, 0.15])
+                            with col_suggestion:
+                                exacte = "" if suggestion['similarite'] == 1 else f" ({suggestion['similarite']:.0%}, pour « {suggestion['original']} »)"
+                                st.caption(f"💡 {suggestion['traduction']}{exacte}")
+                            with col_utiliser:
+                                st.button("↩️", key=f"suggestion_{index}_{i}", help="Utiliser cette traduction", on_click=utiliser_suggestion)
+
                     with col3:
                         st.write("")  # Espacement
                         st.write("")
                         
                         # Boutons d'action pour l'édition
                         if st.button("💾", key=f"save_line_{index}", help="Sauvegarder cette ligne"):
-                            # Mettre à jour la ligne
-                            df_paroles.at[index, 'Original'] = nouveau_original
-                            df_paroles.at[index, 'Traduction'] = nouvelle_traduction
+                            # Mettre à jour la ligne dans le texte tel qu'il était au début de l'édition
+                            base_edition = st.session_state.get('edition_base', base_affichee)
+                            df_modifie = base_edition[1].copy()
+                            df_modifie.at[index, 'Original'] = nouveau_original
+                            df_modifie.at[index, 'Traduction'] = nouvelle_traduction
                             
                             # Sauvegarder tout le tableur
-                            if sauvegarder_paroles_vers_tableur(morceau_id, df_paroles, morceau_titre):
+                            if sauvegarder_paroles_vers_tableur(morceau_id, df_modifie, morceau_titre, base=base_edition):
                                 st.session_state.edition_ligne_index = None
+                                st.session_state.pop('edition_base', None)
                                 st.success("✅ Ligne sauvegardée")
                                 st.rerun()
                         
                         if st.button("❌", key=f"cancel_line_{index}", help="Annuler"):
                             st.session_state.edition_ligne_index = None
+                            st.session_state.pop('edition_base', None)
                             st.rerun()
                 else:
                     # Mode affichage de la ligne
@@ -338,6 +619,7 @@ def edition_paroles_tableur(morceau_id, morceau_titre=""):
                         # Bouton pour éditer cette ligne
                         if st.button("✏️", key=f"edit_{index}", help="Éditer cette ligne"):
                             st.session_state.edition_ligne_index = index
+                            st.session_state.edition_base = base_affichee
                             st.rerun()
 
                     with col4:
@@ -349,22 +631,24 @@ def edition_paroles_tableur(morceau_id, morceau_titre=""):
                             })
                             
                             # Insérer après l'index actuel
-                            df_part1 = df_paroles.iloc[:index+1]
-                            df_part2 = df_paroles.iloc[index+1:]
+                            df_base = base_affichee[1]
+                            df_part1 = df_base.iloc[:index+1]
+                            df_part2 = df_base.iloc[index+1:]
                             df_paroles = pd.concat([df_part1, nouvelle_ligne, df_part2], ignore_index=True)
                             
                             # Sauvegarder
-                            if sauvegarder_paroles_vers_tableur(morceau_id, df_paroles, morceau_titre):
+                            if sauvegarder_paroles_vers_tableur(morceau_id, df_paroles, morceau_titre, base=base_affichee):
                                 st.session_state.edition_ligne_index = index + 1  # Éditer la nouvelle ligne
+                                st.session_state.edition_base = (get_revision_morceau(morceau_id), charger_paroles_depuis_tableur(morceau_id))
                                 st.success("✅ Ligne vide insérée")
                                 st.rerun()
                     with col5:
                         if st.button("🗑️", key=f"delete_line_{index}", help="Supprimer cette ligne"):
                             # Supprimer la ligne
-                            df_paroles = df_paroles.drop(index).reset_index(drop=True)
+                            df_paroles = base_affichee[1].drop(index).reset_index(drop=True)
                             
                             # Sauvegarder
-                            if sauvegarder_paroles_vers_tableur(morceau_id, df_paroles, morceau_titre):
+                            if sauvegarder_paroles_vers_tableur(morceau_id, df_paroles, morceau_titre, base=base_affichee):
                                 st.session_state.edition_ligne_index = None
                                 st.success("✅ Ligne supprimée")
                                 st.rerun()
@@ -377,18 +661,23 @@ def edition_paroles_tableur(morceau_id, morceau_titre=""):
                 'Original': [''],
                 'Traduction': ['']
             })
-            df_paroles = pd.concat([df_paroles, nouvelle_ligne], ignore_index=True)
+            df_paroles = pd.concat([base_affichee[1], nouvelle_ligne], ignore_index=True)
             
-            if sauvegarder_paroles_vers_tableur(morceau_id, df_paroles, morceau_titre):
-                st.session_state.edition_ligne_index = len(df_paroles) - 1
+            if sauvegarder_paroles_vers_tableur(morceau_id, df_paroles, morceau_titre, base=base_affichee):
+                df_sauve = charger_paroles_depuis_tableur(morceau_id)
+                st.session_state.edition_ligne_index = len(df_sauve) - 1
+                st.session_state.edition_base = (get_revision_morceau(morceau_id), df_sauve)
                 st.success("✅ Nouvelle ligne ajoutée")
                 st.rerun()
         
         st.markdown("---")
         st.subheader("Tester le rendu final")
-        titre = generate_frame_title(morceau_id, mode='poème')
-        content = generate_text(df_paroles, mode='poème', title=titre)
-        make_latex(content)
+        # Diapositives construites une fois par révision du morceau, partagées par les sessions
+        # (à partir du texte en cache : df_paroles a pu être modifié par une sauvegarde refusée)
+        morceau = morceau_a_la_revision(morceau_id, *charger_paroles_en_cache(morceau_id),
+                                        (morceau_id, ordre, morceau_titre, compositeur, annee, extrait_de))
+        titre = generate_frame_title(morceau_id, mode='poème', morceau=morceau.ligne_morceau())
+        make_latex(rendre_diapos(morceau.diapos('poème'), mode='poème', title=titre))
 
     else:
         st.info("ℹ️ Aucun tableur n'a été importé pour ce morceau.")
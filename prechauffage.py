@@ -0,0 +1,104 @@
+"""Préchauffage d'un projet à son ouverture.
+
+Dès qu'un projet est ouvert, des tâches de fond lisent les tableurs de tous ses
+morceaux et compilent l'aperçu du concert tel que la page le demandera : quand
+l'utilisateur arrive sur l'aperçu ou ouvre l'édition d'un texte, tout est déjà
+en mémoire. Les résultats sont partagés par toutes les sessions du processus et
+indexés par révision, ils ne sont donc jamais servis périmés.
+
+Le préchauffage d'une session est annulé quand elle quitte le projet.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import streamlit as st
+from connexion import get_connection
+from paroles import paroles_du_projet
+from surtitres import assembler_concert, compile_latex
+from bac_a_sable import tuer_groupe
+from traces import etape
+
+# Deux tâches de fond au plus pour tout le processus : le préchauffage ne doit pas ralentir les pages
+TACHES_MAX = 2
+
+_executeur = ThreadPoolExecutor(max_workers=TACHES_MAX, thread_name_prefix='prechauffage')
+
+
+class Prechauffage:
+    """Préchauffage en cours d'un projet pour une session"""
+
+    def __init__(self, projet_id):
+        self.projet_id = projet_id
+        self.annule = threading.Event()
+        self.taches = []
+        # pdflatex en cours de la compilation de l'aperçu, tué par annuler
+        self.processus = None
+        self._verrou = threading.Lock()
+
+    def demarrer(self):
+        self.taches.append(_executeur.submit(self._lire_paroles))
+        # Soumise après la lecture : la compilation passe après les textes dans la file
+        self.taches.append(_executeur.submit(self._compiler_apercu))
+        return self
+
+    def annuler(self):
+        """Arrêter le préchauffage : les tâches en attente ne démarrent pas, celles en cours s'arrêtent au plus tôt
+
+        Un pdflatex déjà lancé est tué avec tout son groupe de processus.
+        """
+        self.annule.set()
+        for tache in self.taches:
+            tache.cancel()
+        with self._verrou:
+            if self.processus is not None:
+                tuer_groupe(self.processus.pid)
+
+    def _lance(self, processus):
+        """Garder le pdflatex lancé par la compilation, et le tuer si l'annulation l'a précédé"""
+        with self._verrou:
+            self.processus = processus
+            if self.annule.is_set():
+                tuer_groupe(processus.pid)
+
+    def termine(self):
+        return all(tache.done() for tache in self.taches)
+
+    def _lire_paroles(self):
+        with etape('prechauffage.paroles', projet=self.projet_id):
+            paroles_du_projet(self.projet_id, annule=self.annule)
+
+    def _compiler_apercu(self):
+        if self.annule.is_set():
+            return
+        with etape('prechauffage.apercu', projet=self.projet_id):
+            conn = get_connection(projet_id=self.projet_id)
+            c = conn.cursor()
+            c.execute('SELECT concert_frame FROM projects WHERE id = ?', (self.projet_id,))
+            ligne = c.fetchone()
+            conn.close()
+            if ligne is None:
+                return
+            # Mêmes options que l'aperçu affiché par défaut (morceaux.gestion_morceaux)
+            frames = ligne[0] + assembler_concert(self.projet_id, mode='poème')
+            if not self.annule.is_set():
+                try:
+                    compile_latex(frames, mode='poème', basse_priorite=True, annule=self.annule, lance=self._lance)
+                finally:
+                    with self._verrou:
+                        self.processus = None
+
+
+def prechauffer_projet(projet_id):
+    """Démarrer le préchauffage du projet ouvert par la session, une seule fois par ouverture"""
+    en_cours = st.session_state.get('prechauffage')
+    if en_cours is not None and en_cours.projet_id == projet_id:
+        return en_cours
+    arreter_prechauffage()
+    st.session_state.prechauffage = Prechauffage(projet_id).demarrer()
+    return st.session_state.prechauffage
+
+
+def arreter_prechauffage():
+    """Annuler le préchauffage de la session (quand elle quitte son projet)"""
+    en_cours = st.session_state.pop('prechauffage', None)
+    if en_cours is not None:
+        en_cours.annuler()
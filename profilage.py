@@ -0,0 +1,185 @@
+"""Profilage des requêtes SQLite d'une exécution de page.
+
+Pendant un bloc `with profiler_requetes('page') as profil:`, chaque connexion
+ouverte par connexion.get_connection est instrumentée (rappel de trace et
+gestionnaire de progression de SQLite) : le profil compte les connexions, les
+requêtes (y compris celles des triggers), les lignes lues et les instructions
+exécutées par SQLite, et signale les requêtes lentes et les motifs N+1.
+
+Les compteurs sont faits pour être vérifiés dans un test (tests/test_profilage.py) :
+
+    with profiler_requetes('gestion_morceaux') as profil:
+        charger_morceaux(projet_id)
+    assert profil.requetes_n_plus_un() == []
+"""
+import contextlib
+import contextvars
+import re
+import sqlite3
+import threading
+import time
+
+# Une requête identique (aux valeurs près) exécutée au moins ce nombre de fois est un motif N+1
+SEUIL_N_PLUS_UN = 5
+# Durée au-delà de laquelle une requête est signalée comme lente (en secondes)
+SEUIL_LENTE = 0.05
+# Le gestionnaire de progression est appelé toutes les N instructions de la machine virtuelle SQLite
+PAS_PROGRESSION = 1000
+
+_profil_courant = contextvars.ContextVar('profil_requetes', default=None)
+
+# Totaux cumulés par page depuis le démarrage du processus
+totaux_par_page = {}
+_verrou_totaux = threading.Lock()
+
+_litteraux = re.compile(r"'(?:[^']|'')*'|\bX'[0-9A-Fa-f]*'|\b\d+(?:\.\d+)?\b")
+_espaces = re.compile(r'\s+')
+_controle_transaction = re.compile(r'\s*(BEGIN|COMMIT|ROLLBACK|END)\b', re.IGNORECASE)
+
+# Remplacer les valeurs d'une requête par ? pour regrouper les requêtes identiques
+def normaliser_requete(sql):
+    return _espaces.sub(' ', _litteraux.sub('?', sql)).strip()
+
+# Curseur qui mesure la durée des requêtes et compte les lignes lues
+class CurseurProfile(sqlite3.Cursor):
+    def execute(self, sql, parametres=()):
+        debut = time.perf_counter()
+        try:
+            return super().execute(sql, parametres)
+        finally:
+            self.connection.profil.enregistrer_requete(sql, time.perf_counter() - debut)
+
+    def executemany(self, sql, parametres):
+        debut = time.perf_counter()
+        try:
+            return super().executemany(sql, parametres)
+        finally:
+            self.connection.profil.enregistrer_requete(sql, time.perf_counter() - debut)
+
+    def fetchone(self):
+        ligne = super().fetchone()
+        if ligne is not None:
+            self.connection.profil.lignes += 1
+        return ligne
+
+    def fetchmany(self, size=None):
+        lignes = super().fetchmany(self.arraysize if size is None else size)
+        self.connection.profil.lignes += len(lignes)
+        return lignes
+
+    def fetchall(self):
+        lignes = super().fetchall()
+        self.connection.profil.lignes += len(lignes)
+        return lignes
+
+    def __next__(self):
+        ligne = super().__next__()
+        self.connection.profil.lignes += 1
+        return ligne
+
+# Connexion dont les curseurs sont profilés
+class ConnexionProfilee(sqlite3.Connection):
+    profil = None
+
+    def cursor(self, factory=CurseurProfile):
+        return super().cursor(factory)
+
+    def execute(self, sql, parametres=()):
+        return self.cursor().execute(sql, parametres)
+
+    def executemany(self, sql, parametres):
+        return self.cursor().executemany(sql, parametres)
+
+# Compteurs de requêtes d'une exécution
+class ProfilRequetes:
+    def __init__(self, page=''):
+        self.page = page
+        self.connexions = 0
+        self.requetes = 0
+        self.transactions = 0
+        self.instructions_sql = 0
+        self.lignes = 0
+        self.instructions = 0
+        self.duree = 0.0
+        self.par_requete = {}
+        self.lentes = []
+
+    # Ouvrir une connexion instrumentée
+    def connecter(self, chemin, **options):
+        conn = sqlite3.connect(chemin, factory=ConnexionProfilee, **options)
+        conn.profil = self
+        conn.set_trace_callback(self._tracer)
+        conn.set_progress_handler(self._progresser, PAS_PROGRESSION)
+        self.connexions += 1
+        return conn
+
+    def _tracer(self, sql):
+        # SQLite signale aussi chaque instruction exécutée par un trigger (sous le texte de la
+        # requête qui l'a déclenchée) : la différence avec les requêtes de l'application
+        # donne le travail fait par les triggers
+        controle = _controle_transaction.match(sql)
+        if controle:
+            # Une transaction par BEGIN (explicite, ou implicite avant une écriture)
+            if controle.group(1).upper() == 'BEGIN':
+                self.transactions += 1
+        else:
+            self.instructions_sql += 1
+
+    @property
+    def requetes_triggers(self):
+        return max(0, self.instructions_sql - self.requetes)
+
+    def _progresser(self):
+        self.instructions += PAS_PROGRESSION
+        return 0
+
+    def enregistrer_requete(self, sql, duree):
+        if not _controle_transaction.match(sql):
+            self.requetes += 1
+            cle = normaliser_requete(sql)
+            self.par_requete[cle] = self.par_requete.get(cle, 0) + 1
+        self.duree += duree
+        if duree > SEUIL_LENTE:
+            self.lentes.append((normaliser_requete(sql), round(duree * 1000, 1)))
+
+    # Requêtes de lecture répétées au moins SEUIL_N_PLUS_UN fois : [(requête, nombre)]
+    def requetes_n_plus_un(self):
+        return sorted(
+            ((requete, nombre) for requete, nombre in self.par_requete.items()
+             if nombre >= SEUIL_N_PLUS_UN and requete.upper().startswith('SELECT')),
+            key=lambda item: -item[1]
+        )
+
+    def resume(self):
+        return {
+            'page': self.page,
+            'connexions': self.connexions,
+            'requetes': self.requetes,
+            'requetes_triggers': self.requetes_triggers,
+            'transactions': self.transactions,
+            'lignes': self.lignes,
+            'instructions': self.instructions,
+            'duree_ms': round(self.duree * 1000, 2),
+            'n_plus_un': self.requetes_n_plus_un(),
+            'lentes': self.lentes,
+        }
+
+# Profil actif dans le contexte courant (None si le profilage est désactivé)
+def profil_courant():
+    return _profil_courant.get()
+
+# Profiler les requêtes du bloc ; les totaux sont ajoutés à totaux_par_page
+@contextlib.contextmanager
+def profiler_requetes(page=''):
+    profil = ProfilRequetes(page)
+    jeton = _profil_courant.set(profil)
+    try:
+        yield profil
+    finally:
+        _profil_courant.reset(jeton)
+        with _verrou_totaux:
+            total = totaux_par_page.setdefault(page, {'executions': 0, 'connexions': 0, 'requetes': 0, 'lignes': 0})
+            total['executions'] += 1
+            total['connexions'] += profil.connexions
+            total['requetes'] += profil.requetes
+            total['lignes'] += profil.lignes
@@ -1,10 +1,19 @@
-import sqlite3
+from connexion import get_connection, reparti, stockage, connecter, chemin_base_projet, CHEMIN_BASE
 import datetime
+import os
 import re
+import sqlite3
+
+# Annuaire des projets : colonne de date de chaque tri, et nombre de projets par page
+TRIS_ANNUAIRE = {'modification': 'modified_date', 'creation': 'created_date'}
+PROJETS_PAR_PAGE = 25
+
+# Date du fichier (mtime) de chaque base de projet répartie, à la dernière lecture par rafraichir_dates_catalogue
+_dates_bases = {}
 
 # Vérifier si un projet existe
 def project_exists(project_id):
-    conn = sqlite3.connect('projects.db')
+    conn = get_connection()
     c = conn.cursor()
     c.execute('SELECT id FROM projects WHERE id = ?', (project_id,))
     result = c.fetchone()
@@ -13,19 +22,27 @@ def project_exists(project_id):
 
 # Créer un nouveau projet
 def create_project(project_id, creator, description):
-    conn = sqlite3.connect('projects.db')
+    conn = get_connection()
     c = conn.cursor()
     current_time = datetime.datetime.now().isoformat()
+    projet = (project_id, current_time, current_time, creator, description)
+    if reparti():
+        # Import différé : stockage_sqlite importe les modules qui importent celui-ci
+        from stockage_sqlite import creer_base_projet
+        c.execute('BEGIN IMMEDIATE')
+        c.execute('INSERT INTO bases_projets (projet_id) VALUES (?)', (project_id,))
+        # La base du projet existe avant son inscription au catalogue
+        creer_base_projet(c.lastrowid, projet)
     c.execute('''
         INSERT INTO projects (id, created_date, modified_date, creator, description)
         VALUES (?, ?, ?, ?, ?)
-    ''', (project_id, current_time, current_time, creator, description))
+    ''', projet)
     conn.commit()
     conn.close()
 
 # Récupérer les informations d'un projet
 def get_project(project_id):
-    conn = sqlite3.connect('projects.db')
+    conn = get_connection(projet_id=project_id)
     c = conn.cursor()
     c.execute('SELECT * FROM projects WHERE id = ?', (project_id,))
     result = c.fetchone()
@@ -41,4 +58,99 @@ def is_valid_project_id(project_id):
     if not re.match(r'^[a-zA-Z0-9_]+$', project_id):
         return False, "L'identifiant ne peut contenir que des lettres (sans accents), chiffres et underscores (_)"
     
-    return True, ""
\ No newline at end of file
+    return True, ""
+
+# Récupérer la révision courante d'un projet (incrémentée par les triggers à chaque modification)
+def get_project_revision(project_id):
+    conn = get_connection(projet_id=project_id)
+    c = conn.cursor()
+    c.execute('SELECT revision FROM projects WHERE id = ?', (project_id,))
+    result = c.fetchone()
+    conn.close()
+    return result[0] if result else None
+
+# Vérifier si un projet a été modifié depuis une révision donnée
+def project_changed_since(project_id, revision):
+    return get_project_revision(project_id) != revision
+
+# Une page de l'annuaire des projets, du plus récent au plus ancien
+def lister_projets(tri='modification', apres=None, limite=PROJETS_PAR_PAGE, recherche='', createur='', prefixe=''):
+    """Pagination par clé : apres est le curseur (date, id) du dernier projet de la page précédente, et
+    chaque page est lue dans l'index de la date à partir de ce curseur, sans OFFSET ni tri de la table.
+
+    recherche : mots cherchés dans le créateur ou la description ; createur : mots cherchés dans le
+    créateur seul ; prefixe : début de l'identifiant. Retourne (projets, curseur de la page suivante
+    ou None) ; projets : lignes (id, created_date, modified_date, creator, description).
+    """
+    colonne = TRIS_ANNUAIRE[tri]
+    conn = get_connection()
+    c = conn.cursor()
+    # Recherche par mots (index FTS5, ou tsvector avec un serveur) et par début d'identifiant
+    filtres, parametres = stockage().filtres_annuaire(c, recherche, createur, prefixe)
+    if apres is not None:
+        filtres.append(f'({colonne}, id) < (?, ?)')
+        parametres += list(apres)
+    where = f"WHERE {' AND '.join(filtres)}" if filtres else ''
+
+    # Une ligne de plus que la page : elle indique s'il y a une page suivante
+    c.execute(f'''
+        SELECT id, created_date, modified_date, creator, description
+        FROM projects {where}
+        ORDER BY {colonne} DESC, id DESC
+        LIMIT ?
+    ''', (*parametres, limite + 1))
+    projets = c.fetchall()
+    conn.close()
+    if len(projets) <= limite:
+        return projets, None
+    projets = projets[:limite]
+    dernier = projets[-1]
+    return projets, (dernier[2] if colonne == 'modified_date' else dernier[1], dernier[0])
+
+# Reporter au catalogue la date de modification des projets répartis (tri de l'annuaire par modification)
+def rafraichir_dates_catalogue():
+    """Les triggers de révision n'écrivent que dans la base du projet : seules les bases dont le fichier
+    a changé depuis la lecture précédente sont relues (maintenance.tournee). Retourne le nombre de
+    projets mis à jour au catalogue.
+    """
+    if not reparti():
+        return 0
+    conn = connecter(CHEMIN_BASE)
+    bases = conn.execute('SELECT numero, projet_id FROM bases_projets').fetchall()
+    conn.close()
+    dates, lues = [], {}
+    for numero, projet_id in bases:
+        chemin = chemin_base_projet(numero)
+        try:
+            date_fichier = os.stat(chemin).st_mtime_ns
+        except FileNotFoundError:
+            continue
+        if _dates_bases.get(chemin) == date_fichier:
+            continue
+        base = connecter(chemin)
+        try:
+            ligne = base.execute('SELECT modified_date FROM projects WHERE id = ?', (projet_id,)).fetchone()
+        except sqlite3.OperationalError:
+            # Base en cours d'écriture : relue à la prochaine tournée
+            continue
+        finally:
+            base.close()
+        lues[chemin] = date_fichier
+        if ligne is not None:
+            dates.append((ligne[0], projet_id, ligne[0]))
+    mis_a_jour = 0
+    if dates:
+        conn = connecter(CHEMIN_BASE)
+        conn.execute('PRAGMA busy_timeout = 100')
+        try:
+            c = conn.cursor()
+            c.executemany('UPDATE projects SET modified_date = ? WHERE id = ? AND modified_date IS NOT ?', dates)
+            mis_a_jour = c.rowcount
+            conn.commit()
+        except sqlite3.OperationalError:
+            # Catalogue occupé : les mêmes bases sont relues à la prochaine tournée
+            return 0
+        finally:
+            conn.close()
+    _dates_bases.update(lues)
+    return mis_a_jour
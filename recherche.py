@@ -0,0 +1,57 @@
+import re
+from connexion import stockage
+
+# Chaque ligne indexée a pour rowid morceau_id * LIGNES_MAX_PAR_MORCEAU + numéro de ligne :
+# les lignes d'un morceau forment un intervalle de rowid, remplacé d'un coup à chaque sauvegarde
+LIGNES_MAX_PAR_MORCEAU = 100000
+
+# Accents écrits en LaTeX dans les tableurs : {\'e}, \'e, \~n, \c{c}...
+_accent_latex = re.compile(r"\{?\\[`'^\"~=.uvHc]\s*\{?([A-Za-z])\}?\}?")
+# Ligatures : C{\oe}ur -> Coeur
+_ligature_latex = re.compile(r"\{?\\(oe|OE|ae|AE|ss)\b\s*\}?")
+# Commandes LaTeX restantes (\textit, \\) et accolades / crochets
+_reste_latex = re.compile(r"[{}\[\]]|\\[a-zA-Z]+\s*|\\\\")
+
+def texte_indexable(texte):
+    """Ramener une cellule de tableur à du texte brut (les accents sont ignorés par l'index)"""
+    if not isinstance(texte, str):
+        return ""
+    texte = _ligature_latex.sub(r'\1', _accent_latex.sub(r'\1', texte))
+    return _reste_latex.sub('', texte)
+
+def desindexer_morceau(c, morceau_id):
+    """Retirer de l'index les lignes d'un morceau (dans la transaction du curseur c)"""
+    debut = morceau_id * LIGNES_MAX_PAR_MORCEAU
+    c.execute('DELETE FROM recherche_paroles WHERE rowid BETWEEN ? AND ?',
+              (debut, debut + LIGNES_MAX_PAR_MORCEAU - 1))
+
+def indexer_paroles(c, morceau_id, projet_id, lignes):
+    """Remplacer les lignes indexées d'un morceau (dans la transaction du curseur c)
+
+    lignes : liste de couples (original, traduction).
+    """
+    desindexer_morceau(c, morceau_id)
+    debut = morceau_id * LIGNES_MAX_PAR_MORCEAU
+    c.executemany('''
+        INSERT INTO recherche_paroles (rowid, original, traduction, morceau_id, projet_id, ligne)
+        VALUES (?, ?, ?, ?, ?, ?)
+    ''', [
+        (debut + i, texte_indexable(original), texte_indexable(traduction), morceau_id, projet_id, i)
+        for i, (original, traduction) in enumerate(lignes[:LIGNES_MAX_PAR_MORCEAU])
+        if texte_indexable(original).strip() or texte_indexable(traduction).strip()
+    ])
+
+def rechercher_paroles(texte, projet_id=None, limite=50):
+    """Rechercher une expression dans les originaux et les traductions, classés par pertinence
+
+    Retourne une liste de dictionnaires (projet_id, morceau_id, air, ligne, original, traduction),
+    le texte trouvé étant entouré de ** dans original et traduction.
+    """
+    return resultats_recherche(stockage().rechercher_paroles(texte, projet_id, limite))
+
+def resultats_recherche(result):
+    return [
+        {'projet_id': projet, 'morceau_id': morceau_id, 'air': air, 'ligne': ligne + 1,
+         'original': original, 'traduction': traduction}
+        for projet, morceau_id, air, ligne, original, traduction in result
+    ]
@@ -0,0 +1,159 @@
+"""Relecture de tous les textes d'un projet.
+
+Les textes de tous les morceaux sont chargés une fois (paroles.paroles_du_projet)
+et réunis dans un seul DataFrame ; chaque règle est une opération vectorisée sur
+ses colonnes, sans boucle sur les lignes. Le rapport liste un problème par ligne
+(morceau, ligne du tableur, colonne, problème, détail) et s'affiche dans un
+tableau triable.
+"""
+import numpy as np
+import pandas as pd
+import streamlit as st
+from paroles import NB_CAR_MAX, paroles_du_projet
+from projets import get_project_revision
+from traces import tracer
+
+# Écart de longueur entre original et traduction au-delà duquel la paire est signalée,
+# pour des lignes d'au moins LONGUEUR_MIN_DESEQUILIBRE caractères
+RAPPORT_DESEQUILIBRE = 2.5
+LONGUEUR_MIN_DESEQUILIBRE = 20
+
+PROBLEMES = {
+    'trop_longue': "Ligne trop longue",
+    'espaces': "Espaces seuls",
+    'ligne_vide': "Ligne vide",
+    'traduction_manquante': "Traduction manquante",
+    'original_manquant': "Original manquant",
+    'desequilibre': "Longueurs déséquilibrées",
+    'coupure': "COUPURE mal placée",
+    'impair': "Nombre de lignes impair",
+}
+
+COLONNES_RAPPORT = ['morceau_id', 'Ligne', 'Colonne', 'Problème', 'Détail', 'Texte']
+
+
+def _signaler(lignes, masque, probleme, colonne, detail, texte):
+    """Lignes du rapport pour un masque booléen ; detail et texte : Series alignées sur lignes, ou chaînes"""
+    selection = lignes.loc[masque]
+    return pd.DataFrame({
+        'morceau_id': selection['morceau_id'],
+        'Ligne': selection['ligne'],
+        'Colonne': colonne,
+        'Problème': PROBLEMES[probleme],
+        'Détail': detail[masque] if isinstance(detail, pd.Series) else detail,
+        'Texte': texte[masque] if isinstance(texte, pd.Series) else texte,
+    })
+
+
+@tracer('relire_textes')
+def relire_textes(textes):
+    """Relire des textes : liste de (morceau_id, DataFrame Original/Traduction) ; retourne le rapport (DataFrame)"""
+    textes = [(morceau_id, df) for morceau_id, df in textes if len(df)]
+    if not textes:
+        return pd.DataFrame(columns=COLONNES_RAPPORT)
+    lignes = pd.concat([
+        pd.DataFrame({
+            'morceau_id': morceau_id,
+            'ligne': np.arange(1, len(df) + 1),
+            'Original': df['Original'].to_numpy(dtype=object),
+            'Traduction': df['Traduction'].to_numpy(dtype=object),
+        })
+        for morceau_id, df in textes
+    ], ignore_index=True)
+
+    # Cellules vides (NaN : rendues par artificial_space) ramenées à '' ; les nombres deviennent du texte
+    original = lignes['Original'].where(lignes['Original'].notna(), '').astype(str)
+    traduction = lignes['Traduction'].where(lignes['Traduction'].notna(), '').astype(str)
+    original_nu, traduction_nu = original.str.strip(), traduction.str.strip()
+    original_vide, traduction_vide = original_nu == '', traduction_nu == ''
+    longueur_o, longueur_t = original.str.len(), traduction.str.len()
+
+    # generate_text ne reconnaît que la valeur exacte COUPURE dans la colonne Original
+    coupure = original == 'COUPURE'
+    coupure_approchee = original_nu.str.upper() == 'COUPURE'
+    coupure_traduction = traduction_nu.str.upper() == 'COUPURE'
+    texte_ligne = original_nu + ' / ' + traduction_nu
+
+    par_morceau = lignes.groupby('morceau_id', sort=False)
+    nb_lignes = par_morceau['ligne'].transform('size')
+    coupure_precedente = coupure.groupby(lignes['morceau_id'], sort=False).shift(fill_value=False)
+
+    rapport = [
+        _signaler(lignes, (longueur_o > NB_CAR_MAX) & ~coupure, 'trop_longue', 'Original',
+                  longueur_o.astype(str) + f'/{NB_CAR_MAX} caractères', original),
+        _signaler(lignes, (longueur_t > NB_CAR_MAX) & ~coupure, 'trop_longue', 'Traduction',
+                  longueur_t.astype(str) + f'/{NB_CAR_MAX} caractères', traduction),
+        # Espaces seuls : ni texte ni artificial_space, la diapositive est vide à cet endroit
+        _signaler(lignes, original_vide & (original != ''), 'espaces', 'Original',
+                  "cellule qui ne contient que des espaces", ''),
+        _signaler(lignes, traduction_vide & (traduction != ''), 'espaces', 'Traduction',
+                  "cellule qui ne contient que des espaces", ''),
+        _signaler(lignes, original_vide & traduction_vide, 'ligne_vide', '',
+                  "rendue par un point invisible (artificial_space)", ''),
+        _signaler(lignes, ~original_vide & traduction_vide & ~coupure_approchee, 'traduction_manquante', 'Traduction',
+                  "l'original n'a pas de traduction", original),
+        _signaler(lignes, original_vide & ~traduction_vide & ~coupure_traduction, 'original_manquant', 'Original',
+                  "la traduction n'a pas d'original", traduction),
+        _signaler(lignes, ~original_vide & ~traduction_vide & ~coupure_approchee
+                  & (np.maximum(longueur_o, longueur_t) >= LONGUEUR_MIN_DESEQUILIBRE)
+                  & (np.maximum(longueur_o, longueur_t) > RAPPORT_DESEQUILIBRE * np.minimum(longueur_o, longueur_t)),
+                  'desequilibre', '', longueur_o.astype(str) + ' / ' + longueur_t.astype(str) + ' caractères',
+                  texte_ligne),
+        _signaler(lignes, coupure_approchee & ~coupure, 'coupure', 'Original',
+                  "mal orthographiée : affichée comme du texte au lieu de couper", original),
+        _signaler(lignes, coupure_traduction & ~coupure, 'coupure', 'Traduction',
+                  "dans la colonne Traduction : sans effet", traduction),
+        _signaler(lignes, coupure & ~traduction_vide & ~coupure_traduction, 'coupure', 'Traduction',
+                  "texte à côté d'une COUPURE : jamais affiché", traduction),
+        _signaler(lignes, coupure & (lignes['ligne'] == 1), 'coupure', 'Original',
+                  "en tête du texte : diapositive vide en mode poème", ''),
+        _signaler(lignes, coupure & (lignes['ligne'] == nb_lignes), 'coupure', 'Original',
+                  "en fin de texte : inutile", ''),
+        _signaler(lignes, coupure & coupure_precedente, 'coupure', 'Original',
+                  "deux COUPURE de suite : diapositive vide en mode poème", ''),
+        # Une ligne par morceau, sur sa dernière ligne
+        _signaler(lignes, (lignes['ligne'] == nb_lignes) & (nb_lignes % 2 == 1), 'impair', '',
+                  nb_lignes.astype(str) + " lignes : dernière diapositive opéra à moitié vide", texte_ligne),
+    ]
+    return pd.concat(rapport, ignore_index=True).sort_values(['morceau_id', 'Ligne'], kind='stable')
+
+
+def relire_projet(projet_id):
+    """Relire tous les textes d'un projet (rapport de relire_textes)"""
+    return relire_textes(paroles_du_projet(projet_id))
+
+
+def relecture_textes(projet_id, morceaux):
+    """Rapport de relecture de tous les textes du projet, dans un tableau triable
+
+    morceaux : lignes de charger_morceaux, pour la position et le titre des morceaux.
+    """
+    with st.expander("🩺 Relecture des textes"):
+        st.caption(f"Lignes de plus de {NB_CAR_MAX} caractères, cellules vides, COUPURE mal placées, "
+                   "nombres de lignes impairs (mode opéra) et paires original / traduction incohérentes, "
+                   "pour tous les morceaux.")
+        if st.button("🩺 Relire tous les textes", key=f"relire_{projet_id}"):
+            st.session_state.relecture = (projet_id, get_project_revision(projet_id), relire_projet(projet_id))
+        relecture = st.session_state.get('relecture')
+        if relecture is None or relecture[0] != projet_id:
+            return
+        # Le rapport est gardé, et signalé comme ancien si le projet a changé depuis
+        if get_project_revision(projet_id) != relecture[1]:
+            st.info("ℹ️ Le projet a été modifié depuis la dernière relecture : relancez-la pour un rapport à jour.")
+        rapport = relecture[2]
+        if rapport.empty:
+            st.success("✅ Aucun problème détecté")
+            return
+
+        morceaux_affiches = pd.DataFrame({
+            'morceau_id': [m[0] for m in morceaux],
+            'N°': range(1, len(morceaux) + 1),
+            'Morceau': [m[2] for m in morceaux],
+        })
+        rapport = morceaux_affiches.merge(rapport, on='morceau_id').drop(columns='morceau_id')
+        problemes = st.multiselect("Problèmes", list(rapport['Problème'].unique()), key=f"relecture_filtre_{projet_id}",
+                                   placeholder="Tous")
+        if problemes:
+            rapport = rapport[rapport['Problème'].isin(problemes)]
+        st.caption(" · ".join(f"{nom} : {nombre}" for nom, nombre in rapport['Problème'].value_counts().items()))
+        st.dataframe(rapport, hide_index=True, use_container_width=True)
@@ -0,0 +1,431 @@
+"""Sauvegardes à chaud des bases SQLite.
+
+Un fil du processus prend régulièrement un instantané de toutes les bases (le
+catalogue et, avec la répartition, chaque base de projet) par l'API de sauvegarde
+de SQLite, PAGES_PAR_ETAPE pages à la fois : le verrou de lecture est rendu entre
+deux étapes et les écritures des pages ne sont jamais bloquées longtemps. Si
+la base est modifiée pendant la copie, SQLite recommence ; après REPRISES_MAX
+reprises, la copie est faite en une seule étape.
+
+Chaque instantané est un dossier de DOSSIER_SAUVEGARDES, nommé par sa date : les
+bases copiées, les blobs qu'elles référencent (liens physiques : les contenus ne
+changent jamais) et un manifeste écrit en dernier. Chaque copie est vérifiée
+(PRAGMA integrity_check) avant que l'instantané ne soit publié. Seuls les derniers
+instantanés de chaque heure, jour et semaine sont gardés (GARDER_*). Le
+téléchargement de la base dans l'application prend un instantané au moment de la
+demande et le sert en archive ZIP (archive_instantane).
+
+Usage : python sauvegardes.py sauvegarder | liste | verifier [nom] | restaurer <nom|dernier>
+
+La restauration remet les bases et les blobs de l'instantané, après une sauvegarde
+de l'état actuel ; elle se fait application arrêtée (les textes gardés en mémoire
+par les processus correspondent aux révisions d'avant la restauration).
+
+Avec un serveur PostgreSQL, les sauvegardes relèvent de ses propres outils (pg_dump).
+"""
+import contextlib
+import datetime
+import fcntl
+import io
+import json
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+import traceback
+import zipfile
+import streamlit as st
+from connexion import CHEMIN_BASE, connecter, chemin_base_projet, numeros_bases, reparti, serveur
+from blobs import chemin_blob
+from traces import etape
+
+# À côté du fichier de la base, comme blobs.DOSSIER_BLOBS : le même dossier quel que soit le dossier de
+# lancement (fil de maintenance, application, ligne de commande)
+DOSSIER_SAUVEGARDES = os.environ.get('SURTITRES_SAUVEGARDES') or os.path.join(os.path.dirname(os.path.abspath(CHEMIN_BASE)), 'sauvegardes')
+INTERVALLE = float(os.environ.get('SURTITRES_SAUVEGARDE_INTERVALLE', 3600))  # secondes entre deux instantanés, 0 : jamais
+GARDER_HORAIRES = int(os.environ.get('SURTITRES_SAUVEGARDES_HORAIRES', 24))
+GARDER_QUOTIDIENNES = int(os.environ.get('SURTITRES_SAUVEGARDES_QUOTIDIENNES', 7))
+GARDER_HEBDOMADAIRES = int(os.environ.get('SURTITRES_SAUVEGARDES_HEBDOMADAIRES', 8))
+# 1 Mio par étape avec des pages de 4 Kio, puis une pause pour laisser passer les écritures
+PAGES_PAR_ETAPE = 256
+PAUSE = 0.02
+REPRISES_MAX = 3
+ATTENTE_VERROU_MS = 5000
+# Vérification de l'échéance par le fil de sauvegarde
+VERIFICATION = 60
+
+FORMAT_NOM = '%Y%m%d-%H%M%S'
+MANIFESTE = 'manifeste.json'
+
+_fil = None
+_verrou = threading.Lock()
+
+
+class _Reprise(Exception):
+    """La base a été modifiée pendant la copie : SQLite l'a recommencée"""
+
+
+def copier_base(chemin, destination):
+    """Copier une base en cours d'utilisation par l'API de sauvegarde ; retourne (pages, reprises)"""
+    source = connecter(chemin)
+    source.execute(f'PRAGMA busy_timeout = {ATTENTE_VERROU_MS}')
+    try:
+        for reprises in range(REPRISES_MAX + 1):
+            restantes = []
+
+            def progression(statut, reste, total):
+                if restantes and reste > restantes[-1]:
+                    raise _Reprise()
+                restantes.append(reste)
+                # Verrou de lecture rendu : les écritures passent pendant la pause
+                time.sleep(PAUSE)
+
+            cible = sqlite3.connect(destination)
+            try:
+                # Dernière tentative en une seule étape : elle ne peut plus être recommencée
+                source.backup(cible, pages=PAGES_PAR_ETAPE if reprises < REPRISES_MAX else -1,
+                              progress=progression)
+                return cible.execute('PRAGMA page_count').fetchone()[0], reprises
+            except _Reprise:
+                continue
+            finally:
+                cible.close()
+    finally:
+        source.close()
+
+
+def verifier_base(chemin):
+    """Vérifier l'intégrité d'une base copiée ; retourne 'ok' ou les erreurs trouvées"""
+    conn = sqlite3.connect(f'file:{chemin}?mode=ro', uri=True)
+    try:
+        erreurs = [ligne[0] for ligne in conn.execute('PRAGMA integrity_check')]
+    except sqlite3.DatabaseError as e:
+        # Fichier illisible : la vérification elle-même échoue
+        erreurs = [str(e)]
+    finally:
+        conn.close()
+    return '; '.join(erreurs)
+
+
+def empreintes_base(chemin):
+    conn = sqlite3.connect(f'file:{chemin}?mode=ro', uri=True)
+    try:
+        return {ligne[0] for ligne in conn.execute(
+            'SELECT DISTINCT empreinte FROM tableurs_paroles WHERE empreinte IS NOT NULL')}
+    finally:
+        conn.close()
+
+
+def lier_ou_copier(source, destination):
+    """Lien physique vers un fichier (copie s'il est sur un autre système de fichiers)"""
+    os.makedirs(os.path.dirname(destination), exist_ok=True)
+    try:
+        os.link(source, destination)
+    except OSError:
+        shutil.copy2(source, destination)
+
+
+def bases_a_sauvegarder():
+    """(numéro, fichier) de chaque base : 0 pour le catalogue, puis les bases de projets"""
+    bases = [(0, CHEMIN_BASE)]
+    if reparti():
+        bases += [(numero, chemin_base_projet(numero)) for numero in numeros_bases()]
+    return bases
+
+
+@contextlib.contextmanager
+def verrou_sauvegardes(attendre=True):
+    """Une seule sauvegarde ou restauration à la fois, tous processus confondus ; produit False si occupé sans attendre"""
+    os.makedirs(DOSSIER_SAUVEGARDES, exist_ok=True)
+    with open(os.path.join(DOSSIER_SAUVEGARDES, '.verrou'), 'w') as verrou:
+        try:
+            fcntl.flock(verrou, fcntl.LOCK_EX | (0 if attendre else fcntl.LOCK_NB))
+        except BlockingIOError:
+            yield False
+            return
+        yield True
+
+
+def sauvegarder(motif='manuelle'):
+    """Prendre un instantané vérifié de toutes les bases et de leurs blobs ; retourne son nom
+
+    Lève une ValueError si une copie ne passe pas la vérification d'intégrité (rien
+    n'est publié).
+    """
+    with verrou_sauvegardes():
+        return _sauvegarder(motif)
+
+
+def _sauvegarder(motif):
+    if serveur():
+        raise ValueError("sauvegarde d'un serveur PostgreSQL : utiliser pg_dump")
+    debut = time.perf_counter()
+    nom = datetime.datetime.now().strftime(FORMAT_NOM)
+    while os.path.exists(os.path.join(DOSSIER_SAUVEGARDES, nom)):
+        # Un instantané par seconde au plus : son nom est sa date
+        time.sleep(1)
+        nom = datetime.datetime.now().strftime(FORMAT_NOM)
+    dossier_temp = os.path.join(DOSSIER_SAUVEGARDES, f'.tmp_{nom}')
+    os.makedirs(dossier_temp)
+    try:
+        with etape('sauvegarde', motif=motif) as mesure:
+            bases = []
+            absentes = []
+            empreintes = set()
+            for numero, chemin in bases_a_sauvegarder():
+                if not os.path.exists(chemin):
+                    # Base de projet inscrite au catalogue mais disparue : signalée, jamais recréée vide
+                    absentes.append(chemin)
+                    continue
+                fichier = os.path.basename(chemin) if not numero else os.path.join('projets', os.path.basename(chemin))
+                destination = os.path.join(dossier_temp, fichier)
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                pages, reprises = copier_base(chemin, destination)
+                integrite = verifier_base(destination)
+                if integrite != 'ok':
+                    raise ValueError(f"copie de {chemin} invalide : {integrite}")
+                empreintes |= empreintes_base(destination)
+                bases.append({'numero': numero, 'fichier': fichier, 'taille': os.path.getsize(destination),
+                              'pages': pages, 'reprises': reprises, 'integrite': integrite})
+
+            manquants = []
+            for empreinte in sorted(empreintes):
+                if os.path.exists(chemin_blob(empreinte)):
+                    lier_ou_copier(chemin_blob(empreinte), os.path.join(dossier_temp, 'blobs', empreinte))
+                else:
+                    manquants.append(empreinte)
+            mesure.etiqueter(bases=len(bases), blobs=len(empreintes))
+
+        manifeste = {
+            'date': datetime.datetime.now().isoformat(),
+            'motif': motif,
+            'duree': round(time.perf_counter() - debut, 3),
+            'bases': bases,
+            'blobs': len(empreintes) - len(manquants),
+            # Déjà absents des blobs de l'application : l'instantané reflète fidèlement son état
+            'blobs_manquants': manquants,
+            'bases_absentes': absentes,
+        }
+        with open(os.path.join(dossier_temp, MANIFESTE), 'w') as f:
+            json.dump(manifeste, f, indent=2)
+        os.replace(dossier_temp, os.path.join(DOSSIER_SAUVEGARDES, nom))
+    except Exception:
+        shutil.rmtree(dossier_temp, ignore_errors=True)
+        raise
+    return nom
+
+
+def lister_instantanes():
+    """Instantanés publiés, du plus ancien au plus récent : liste de (nom, manifeste)"""
+    if not os.path.isdir(DOSSIER_SAUVEGARDES):
+        return []
+    instantanes = []
+    for nom in sorted(os.listdir(DOSSIER_SAUVEGARDES)):
+        chemin = os.path.join(DOSSIER_SAUVEGARDES, nom, MANIFESTE)
+        if not nom.startswith('.') and os.path.exists(chemin):
+            with open(chemin) as f:
+                instantanes.append((nom, json.load(f)))
+    return instantanes
+
+
+def a_garder(noms):
+    """Instantanés gardés : le plus récent de chacune des dernières heures, des derniers jours et des dernières semaines"""
+    dates = sorted(((datetime.datetime.strptime(nom, FORMAT_NOM), nom) for nom in noms), reverse=True)
+    gardes = set(nom for _, nom in dates[:1])
+    for periode, nombre in (('%Y%m%d%H', GARDER_HORAIRES), ('%Y%m%d', GARDER_QUOTIDIENNES), ('%G%V', GARDER_HEBDOMADAIRES)):
+        periodes = set()
+        for date, nom in dates:
+            cle = date.strftime(periode)
+            if cle in periodes:
+                continue
+            if len(periodes) == nombre:
+                break
+            periodes.add(cle)
+            gardes.add(nom)
+    return gardes
+
+
+def appliquer_retention():
+    """Supprimer les instantanés qui ne sont plus gardés et les copies interrompues ; retourne les noms supprimés"""
+    noms = [nom for nom, _ in lister_instantanes()]
+    gardes = a_garder(noms)
+    supprimes = [nom for nom in noms if nom not in gardes]
+    for nom in supprimes:
+        shutil.rmtree(os.path.join(DOSSIER_SAUVEGARDES, nom))
+    # Copie interrompue (processus arrêté) : dossier temporaire de plus d'une heure
+    for nom in os.listdir(DOSSIER_SAUVEGARDES):
+        chemin = os.path.join(DOSSIER_SAUVEGARDES, nom)
+        if nom.startswith('.tmp_') and time.time() - os.path.getmtime(chemin) > 3600:
+            shutil.rmtree(chemin, ignore_errors=True)
+    return supprimes
+
+
+def verifier_instantane(nom):
+    """Vérifier un instantané publié : intégrité de chaque base et présence des blobs ; retourne la liste des erreurs"""
+    dossier = os.path.join(DOSSIER_SAUVEGARDES, nom)
+    with open(os.path.join(dossier, MANIFESTE)) as f:
+        manifeste = json.load(f)
+    erreurs = []
+    empreintes = set()
+    for base in manifeste['bases']:
+        chemin = os.path.join(dossier, base['fichier'])
+        if not os.path.exists(chemin):
+            erreurs.append(f"{base['fichier']} : fichier absent")
+            continue
+        integrite = verifier_base(chemin)
+        if integrite != 'ok':
+            erreurs.append(f"{base['fichier']} : {integrite}")
+        else:
+            empreintes |= empreintes_base(chemin)
+    for empreinte in sorted(empreintes - set(manifeste['blobs_manquants'])):
+        if not os.path.exists(os.path.join(dossier, 'blobs', empreinte)):
+            erreurs.append(f"blob absent : {empreinte}")
+    return erreurs
+
+
+def restaurer(nom):
+    """Remettre les bases et les blobs d'un instantané, après un instantané de l'état actuel
+
+    Retourne le nom de l'instantané de l'état actuel. Lève une ValueError si
+    l'instantané à restaurer ne passe pas la vérification.
+    """
+    with verrou_sauvegardes():
+        return _restaurer(nom)
+
+
+def _restaurer(nom):
+    erreurs = verifier_instantane(nom)
+    if erreurs:
+        raise ValueError(f"instantané {nom} invalide : " + '; '.join(erreurs))
+    dossier = os.path.join(DOSSIER_SAUVEGARDES, nom)
+    with open(os.path.join(dossier, MANIFESTE)) as f:
+        manifeste = json.load(f)
+    avant = _sauvegarder(f'avant restauration de {nom}')
+
+    # Blobs d'abord : les bases restaurées ne référencent jamais un contenu absent
+    dossier_blobs = os.path.join(dossier, 'blobs')
+    if os.path.isdir(dossier_blobs):
+        for empreinte in os.listdir(dossier_blobs):
+            if not os.path.exists(chemin_blob(empreinte)):
+                lier_ou_copier(os.path.join(dossier_blobs, empreinte), chemin_blob(empreinte))
+    # Le catalogue en dernier : il désigne les bases de projets
+    for base in sorted(manifeste['bases'], key=lambda base: base['numero'] == 0):
+        destination = chemin_base_projet(base['numero'])
+        if os.path.dirname(destination):
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+        source = sqlite3.connect(f"file:{os.path.join(dossier, base['fichier'])}?mode=ro", uri=True)
+        cible = sqlite3.connect(destination)
+        cible.execute(f'PRAGMA busy_timeout = {ATTENTE_VERROU_MS}')
+        try:
+            source.backup(cible)
+        finally:
+            source.close()
+            cible.close()
+    return avant
+
+
+def tournee():
+    """Prendre un instantané si le dernier est plus ancien que INTERVALLE, puis appliquer la rétention
+
+    Un seul processus à la fois (verrou sur un fichier du dossier des sauvegardes) ;
+    retourne le nom de l'instantané pris, ou None.
+    """
+    with verrou_sauvegardes(attendre=False) as libre:
+        if not libre:
+            # Sauvegarde en cours dans un autre processus
+            return None
+        instantanes = lister_instantanes()
+        if instantanes:
+            dernier = datetime.datetime.strptime(instantanes[-1][0], FORMAT_NOM)
+            if (datetime.datetime.now() - dernier).total_seconds() < INTERVALLE:
+                return None
+        nom = _sauvegarder('planifiee')
+        appliquer_retention()
+        return nom
+
+
+def _boucle():
+    while True:
+        time.sleep(min(VERIFICATION, INTERVALLE))
+        try:
+            tournee()
+        except Exception:
+            traceback.print_exc(file=sys.stderr)
+
+
+def demarrer_sauvegardes():
+    """Démarrer le fil de sauvegarde du processus, une seule fois (rien avec un serveur ou INTERVALLE nul)"""
+    global _fil
+    if serveur() or INTERVALLE <= 0:
+        return None
+    with _verrou:
+        if _fil is None:
+            _fil = threading.Thread(target=_boucle, name='sauvegardes', daemon=True)
+            _fil.start()
+    return _fil
+
+
+def archive_instantane(nom):
+    """Archive ZIP d'un instantané (bytes) : manifeste, bases et blobs qu'elles référencent
+
+    Décompressée dans DOSSIER_SAUVEGARDES, elle se restaure comme un instantané ; ses bases
+    se fusionnent dans une autre installation avec migration.py (contenus lus dans blobs/).
+    """
+    dossier = os.path.join(DOSSIER_SAUVEGARDES, nom)
+    tampon = io.BytesIO()
+    # Les tableurs (.ods, .xlsx) sont déjà compressés : seules les bases le sont ici
+    with zipfile.ZipFile(tampon, 'w') as archive:
+        for racine, _, fichiers in os.walk(dossier):
+            for fichier in sorted(fichiers):
+                chemin = os.path.join(racine, fichier)
+                relatif = os.path.join(nom, os.path.relpath(chemin, dossier))
+                compression = zipfile.ZIP_STORED if os.path.basename(racine) == 'blobs' else zipfile.ZIP_DEFLATED
+                archive.write(chemin, relatif, compress_type=compression)
+    return tampon.getvalue()
+
+
+def telechargement_base():
+    """Téléchargement de la base : un instantané pris au moment de la demande, archivé avec toutes les
+    bases (catalogue et bases de projets) et les blobs qu'elles référencent"""
+    if st.button("📦 Préparer le téléchargement de la base de données", key="preparer_archive_base"):
+        try:
+            nom = sauvegarder(motif='telechargement')
+        except Exception as e:
+            st.error(f"Erreur lors de la sauvegarde : {e}")
+            return
+        # Archive gardée pour la session : elle n'est pas reconstruite à chaque affichage de la page
+        st.session_state.archive_base = (nom, archive_instantane(nom))
+    archive = st.session_state.get('archive_base')
+    if archive is None:
+        return
+    nom, donnees = archive
+    date = datetime.datetime.strptime(nom, FORMAT_NOM).strftime('%d/%m/%Y %H:%M:%S')
+    st.download_button(f"Télécharger la base de données (état du {date})", data=donnees,
+                       file_name=f'surtitres_{nom}.zip', mime='application/zip')
+
+
+if __name__ == '__main__':
+    action = sys.argv[1] if len(sys.argv) > 1 else 'liste'
+    if action == 'sauvegarder':
+        nom = sauvegarder()
+        print(f"Instantané {nom} ; supprimés par la rétention : {', '.join(appliquer_retention()) or 'aucun'}")
+    elif action == 'verifier':
+        noms = sys.argv[2:] or [nom for nom, _ in lister_instantanes()]
+        invalides = 0
+        for nom in noms:
+            erreurs = verifier_instantane(nom)
+            invalides += bool(erreurs)
+            print(f"{nom}\t{'ok' if not erreurs else '; '.join(erreurs)}")
+        sys.exit(1 if invalides else 0)
+    elif action == 'restaurer':
+        instantanes = [nom for nom, _ in lister_instantanes()]
+        nom = instantanes[-1] if sys.argv[2] == 'dernier' and instantanes else sys.argv[2]
+        avant = restaurer(nom)
+        print(f"{nom} restauré (état précédent sauvegardé dans {avant}) : redémarrer l'application")
+    else:
+        for nom, manifeste in lister_instantanes():
+            taille = sum(base['taille'] for base in manifeste['bases'])
+            print(f"{nom}\t{manifeste['motif']}\t{len(manifeste['bases'])} base(s)\t{taille / 1024:.0f} Kio\t"
+                  f"{manifeste['blobs']} blob(s)\t{manifeste['duree']:g} s")
@@ -0,0 +1,132 @@
+"""Tables communes aux deux stockages de la base (stockage_sqlite, stockage_serveur)
+
+Chaque table est décrite une seule fois, avec les types propres au moteur entre
+accolades ({identifiant}, {entier}, {octets}) ; chaque stockage y ajoute ses propres
+objets : index plein texte, triggers de révision, migrations.
+"""
+import re
+
+# Version du schéma : à incrémenter à chaque modification des tables ou des triggers
+version_schema = 13
+
+default_concert_frame = """\\begin{frame}{}
+    \\centering
+    \\vspace{-2.5cm}
+    Classe de chant lyrique \\\\
+    \\textbf{Nom du concert}\\\\\\
+    \\vskip0.2cm
+    Date
+    \\vskip0.2cm
+\\end{frame}"""
+
+# Colonnes de chaque table, dans l'ordre de la base SQLite d'origine (les colonnes ajoutées depuis sont
+# à la fin : une base ancienne et une base neuve donnent les mêmes lignes à SELECT *)
+TABLES = {
+    'projects': '''
+        id TEXT PRIMARY KEY,
+        created_date TEXT,
+        modified_date TEXT,
+        creator TEXT,
+        description TEXT,
+        concert_frame TEXT DEFAULT {cadre_concert},
+        revision INTEGER NOT NULL DEFAULT 0
+    ''',
+    'morceaux': '''
+        id {identifiant},
+        projet_id TEXT REFERENCES projects (id),
+        ordre {entier},
+        air TEXT,
+        extrait_de TEXT,
+        compositeur TEXT,
+        annee TEXT,
+        text_status TEXT CHECK (text_status IN ('not_started', 'draft', 'validated')) DEFAULT 'not_started',
+        revision INTEGER NOT NULL DEFAULT 0
+    ''',
+    # Le contenu des tableurs est dans le stockage par empreinte (blobs.py) : donnees ne sert qu'aux bases anciennes
+    'tableurs_paroles': '''
+        id {identifiant},
+        morceau_id {entier} REFERENCES morceaux (id),
+        nom_fichier TEXT,
+        date_import TEXT,
+        donnees {octets},
+        empreinte TEXT,
+        taille INTEGER,
+        indexe INTEGER NOT NULL DEFAULT 0
+    ''',
+    # Journal des modifications, lu par les sessions ouvertes pour ne rafraîchir que ce qui a changé
+    'journal_modifications': '''
+        id {identifiant},
+        projet_id TEXT,
+        morceau_id {entier},
+        revision INTEGER,
+        objet TEXT CHECK (objet IN ('projet', 'morceau', 'paroles')),
+        operation TEXT CHECK (operation IN ('insert', 'update', 'delete')),
+        lignes TEXT,
+        date TEXT
+    ''',
+    # Mémoire de traduction (memoire.py) : couples déjà saisis, par empreinte de l'original normalisé
+    'memoire_traductions': '''
+        id {identifiant},
+        empreinte {entier} NOT NULL,
+        normalise TEXT NOT NULL,
+        original TEXT NOT NULL,
+        traduction TEXT NOT NULL,
+        morceau_id {entier}
+    ''',
+    # Fragments TeX de chaque morceau (surtitres.materialiser_titres / materialiser_textes),
+    # assemblés en une requête pour produire le document d'un concert
+    'fragments_tex': '''
+        morceau_id {entier} PRIMARY KEY REFERENCES morceaux (id),
+        titre_opera TEXT,
+        titre_poeme TEXT,
+        texte_opera TEXT,
+        texte_poeme TEXT,
+        lignes_opera TEXT,
+        lignes_poeme TEXT
+    ''',
+    # Projets archivés (archives.py) : retirés de la base, leur contenu est dans une archive compressée
+    # (fichier : nom de l'archive dans archives.DOSSIER_ARCHIVES)
+    'projets_archives': '''
+        projet_id TEXT PRIMARY KEY,
+        fichier TEXT NOT NULL,
+        taille INTEGER,
+        creator TEXT,
+        description TEXT,
+        date_archivage TEXT
+    ''',
+}
+
+INDEX = [
+    'idx_morceaux_projet ON morceaux (projet_id, ordre)',
+    'idx_tableurs_morceau ON tableurs_paroles (morceau_id)',
+    'idx_tableurs_empreinte ON tableurs_paroles (empreinte)',
+    'idx_journal_projet ON journal_modifications (projet_id, id)',
+    # Annuaire des projets (projets.lister_projets) : pages par date sans parcourir ni trier la table
+    'idx_projects_creation ON projects (created_date, id)',
+    'idx_projects_modification ON projects (modified_date, id)',
+]
+# Couples uniques par morceau, pour que ceux d'un morceau puissent être remplacés (memoire.oublier_traductions)
+INDEX_UNIQUES = [
+    'idx_memoire_morceau ON memoire_traductions (morceau_id, empreinte, traduction)',
+]
+
+_type = re.compile(r'\{(\w+)\}')
+
+def creer_table(c, table, types, nom=None):
+    """Créer une table commune (sous le nom nom s'il est donné) avec les types du moteur
+
+    types : dictionnaire identifiant, entier, octets -> type SQL.
+    """
+    valeurs = {**types, 'cadre_concert': f"'{default_concert_frame}'"}
+    colonnes = _type.sub(lambda m: valeurs.get(m.group(1), m.group(0)), TABLES[table])
+    c.execute(f'CREATE TABLE IF NOT EXISTS {nom or table} ({colonnes})')
+
+def creer_tables(c, types):
+    for table in TABLES:
+        creer_table(c, table, types)
+
+def creer_index(c):
+    for index in INDEX:
+        c.execute(f'CREATE INDEX IF NOT EXISTS {index}')
+    for index in INDEX_UNIQUES:
+        c.execute(f'CREATE UNIQUE INDEX IF NOT EXISTS {index}')
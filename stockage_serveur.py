@@ -0,0 +1,327 @@
+"""Stockage PostgreSQL de la base, partagé par plusieurs instances (SURTITRES_BASE=postgresql://...)
+
+Mêmes fonctions que stockage_sqlite, écrites pour PostgreSQL : la recherche utilise un
+tsvector à la place de FTS5 (index d'expression pour l'annuaire des projets), la mémoire
+de traduction une table de trigrammes, les triggers de révision sont en PL/pgSQL et les
+tableurs sont stockés dans la table blobs pour être partagés par toutes les instances.
+"""
+import re
+import time
+import unicodedata
+import blobs
+import schema
+from connexion import get_connection
+from recherche import texte_indexable
+from memoire import trigrammes, empreinte_ligne, CANDIDATS_MAX, TRIGRAMMES_RARES
+from paroles import materialiser_fragments_manquants
+
+TYPES = {'identifiant': 'BIGINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY', 'entier': 'BIGINT', 'octets': 'BYTEA'}
+
+# Les écritures sont sérialisées entre toutes les instances, comme avec le verrou d'écriture de SQLite,
+# par un verrou consultatif pris jusqu'à la fin de la transaction
+CLE_VERROU_ECRITURE = 0x5375727469747265
+
+def debuter_ecriture(c):
+    """Prendre le verrou d'écriture de la base (la transaction est ouverte par la première requête)"""
+    c.execute('SELECT pg_advisory_xact_lock(?)', (CLE_VERROU_ECRITURE,))
+
+# Schéma
+
+# Lettres accentuées et leur lettre de base, pour les index de recherche (sans extension unaccent)
+accents_sql = 'àâäáãåéèêëíìîïóòôöõúùûüýÿçñ'
+sans_accents_sql = 'aaaaaaeeeeiiiiooooouuuuyycn'
+
+def texte_sans_accents_sql(colonne):
+    """Expression d'une colonne en minuscules et sans accents, comme le texte des index de recherche"""
+    return f"translate(lower(COALESCE({colonne}, '')), '{accents_sql}', '{sans_accents_sql}')"
+
+# Document de recherche d'un projet pour l'annuaire (projets.lister_projets) : le créateur a le poids A,
+# ce qui permet de chercher dans le créateur seul
+document_projet_sql = (f"(setweight(to_tsvector('simple', {texte_sans_accents_sql('creator')}), 'A') || "
+                       f"to_tsvector('simple', {texte_sans_accents_sql('description')}))")
+
+def creer_schema(c):
+    """Créer les tables, les index et les triggers"""
+    schema.creer_tables(c, TYPES)
+    # Couples de la mémoire uniques par morceau (schéma 12) : l'ancienne contrainte sur toute la mémoire est retirée
+    c.execute('ALTER TABLE memoire_traductions DROP CONSTRAINT IF EXISTS memoire_traductions_empreinte_traduction_key')
+    schema.creer_index(c)
+    c.execute(f'''
+        CREATE TABLE IF NOT EXISTS recherche_paroles (
+            rowid BIGINT PRIMARY KEY,
+            original TEXT,
+            traduction TEXT,
+            morceau_id BIGINT,
+            projet_id TEXT,
+            ligne INTEGER,
+            document TSVECTOR GENERATED ALWAYS AS (to_tsvector('simple', translate(
+                lower(COALESCE(original, '') || ' ' || COALESCE(traduction, '')),
+                '{accents_sql}', '{sans_accents_sql}'))) STORED
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_recherche_document ON recherche_paroles USING GIN (document)')
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS memoire_trigrammes (
+            trigramme TEXT,
+            memoire_id BIGINT,
+            PRIMARY KEY (trigramme, memoire_id)
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_memoire_trigrammes_memoire ON memoire_trigrammes (memoire_id)')
+    c.execute('''
+        CREATE OR REPLACE FUNCTION memoire_traductions_insert() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            INSERT INTO memoire_trigrammes (trigramme, memoire_id)
+            SELECT DISTINCT substr(mot, i, 3), NEW.id
+            FROM regexp_split_to_table(NEW.normalise, ' ') AS mot, generate_series(1, length(mot) - 2) AS i
+            ON CONFLICT DO NOTHING;
+            RETURN NULL;
+        END $$
+    ''')
+    c.execute('DROP TRIGGER IF EXISTS memoire_traductions_insert ON memoire_traductions')
+    c.execute('''
+        CREATE TRIGGER memoire_traductions_insert AFTER INSERT ON memoire_traductions
+        FOR EACH ROW EXECUTE FUNCTION memoire_traductions_insert()
+    ''')
+    c.execute('''
+        CREATE OR REPLACE FUNCTION memoire_traductions_delete() RETURNS trigger LANGUAGE plpgsql AS $$
+        BEGIN
+            DELETE FROM memoire_trigrammes WHERE memoire_id = OLD.id;
+            RETURN NULL;
+        END $$
+    ''')
+    c.execute('DROP TRIGGER IF EXISTS memoire_traductions_delete ON memoire_traductions')
+    c.execute('''
+        CREATE TRIGGER memoire_traductions_delete AFTER DELETE ON memoire_traductions
+        FOR EACH ROW EXECUTE FUNCTION memoire_traductions_delete()
+    ''')
+    # Contenus des tableurs (blobs.py) ; utilise : dernière écriture, pour le délai de grâce du ramasse-miettes
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS blobs (
+            empreinte TEXT PRIMARY KEY,
+            donnees BYTEA NOT NULL,
+            utilise DOUBLE PRECISION NOT NULL
+        )
+    ''')
+    # Annuaire des projets : recherche par début d'identifiant et par mots
+    c.execute('CREATE INDEX IF NOT EXISTS idx_projects_prefixe ON projects (id text_pattern_ops)')
+    c.execute(f'CREATE INDEX IF NOT EXISTS idx_projects_document ON projects USING GIN ({document_projet_sql})')
+    creer_triggers_revision(c)
+    c.execute('CREATE TABLE IF NOT EXISTS version_schema (version INTEGER NOT NULL)')
+    c.execute('DELETE FROM version_schema')
+    c.execute('INSERT INTO version_schema (version) VALUES (?)', (schema.version_schema,))
+
+def creer_triggers_revision(c):
+    """Triggers de révision et de journal (voir stockage_sqlite.creer_triggers_revision) en PL/pgSQL"""
+    horodatage = "to_char(localtimestamp, 'YYYY-MM-DD\"T\"HH24:MI:SS.MS')"
+    c.execute(f'''
+        CREATE OR REPLACE FUNCTION journaliser_modification() RETURNS trigger LANGUAGE plpgsql AS $$
+        DECLARE
+            ligne RECORD;
+            objet TEXT := TG_ARGV[0];
+            projet TEXT;
+            morceau BIGINT;
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                ligne := OLD;
+            ELSE
+                ligne := NEW;
+            END IF;
+            IF objet = 'projet' THEN
+                projet := ligne.id;
+            ELSIF objet = 'morceau' THEN
+                projet := ligne.projet_id;
+                morceau := ligne.id;
+            ELSE
+                morceau := ligne.morceau_id;
+                SELECT projet_id INTO projet FROM morceaux WHERE id = morceau;
+            END IF;
+            UPDATE projects SET revision = revision + 1, modified_date = {horodatage} WHERE id = projet;
+            IF (objet = 'morceau' AND TG_OP <> 'DELETE') OR objet = 'paroles' THEN
+                UPDATE morceaux
+                SET revision = COALESCE((SELECT revision FROM projects WHERE id = projet), revision + 1)
+                WHERE id = morceau;
+            END IF;
+            INSERT INTO journal_modifications (projet_id, morceau_id, revision, objet, operation, date)
+            VALUES (projet, morceau, (SELECT revision FROM projects WHERE id = projet),
+                    objet, lower(TG_OP), {horodatage});
+            RETURN NULL;
+        END $$
+    ''')
+    colonnes_morceau = ['projet_id', 'ordre', 'air', 'extrait_de', 'compositeur', 'annee', 'text_status']
+    colonnes_projet = ['creator', 'description', 'concert_frame']
+    colonnes_tableur = ['morceau_id', 'nom_fichier', 'donnees', 'empreinte']
+    def modifie(colonnes):
+        return ' OR '.join(f'NEW.{col} IS DISTINCT FROM OLD.{col}' for col in colonnes)
+    triggers = {
+        'morceaux_revision_insert': "AFTER INSERT ON morceaux FOR EACH ROW EXECUTE FUNCTION journaliser_modification('morceau')",
+        'morceaux_revision_update': f"AFTER UPDATE OF {', '.join(colonnes_morceau)} ON morceaux FOR EACH ROW "
+                                    f"WHEN ({modifie(colonnes_morceau)}) EXECUTE FUNCTION journaliser_modification('morceau')",
+        'morceaux_revision_delete': "AFTER DELETE ON morceaux FOR EACH ROW EXECUTE FUNCTION journaliser_modification('morceau')",
+        'projects_revision_update': f"AFTER UPDATE OF {', '.join(colonnes_projet)} ON projects FOR EACH ROW "
+                                    f"WHEN ({modifie(colonnes_projet)}) EXECUTE FUNCTION journaliser_modification('projet')",
+        'tableurs_paroles_revision_insert': "AFTER INSERT ON tableurs_paroles FOR EACH ROW EXECUTE FUNCTION journaliser_modification('paroles')",
+        'tableurs_paroles_revision_update': f"AFTER UPDATE OF {', '.join(colonnes_tableur)} ON tableurs_paroles FOR EACH ROW "
+                                            f"EXECUTE FUNCTION journaliser_modification('paroles')",
+        'tableurs_paroles_revision_delete': "AFTER DELETE ON tableurs_paroles FOR EACH ROW EXECUTE FUNCTION journaliser_modification('paroles')",
+    }
+    for nom, corps in triggers.items():
+        table = corps.split(' ON ')[1].split()[0]
+        c.execute(f'DROP TRIGGER IF EXISTS {nom} ON {table}')
+        c.execute(f'CREATE TRIGGER {nom} {corps}')
+
+def initialiser():
+    """Créer ou mettre à jour le schéma : une seule instance le fait, sous le verrou d'écriture"""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute("SELECT to_regclass('version_schema') IS NOT NULL")
+    if c.fetchone()[0] and c.execute('SELECT MAX(version) FROM version_schema').fetchone()[0] == schema.version_schema:
+        conn.close()
+        return
+    conn.rollback()
+    debuter_ecriture(c)
+    creer_schema(c)
+    materialiser_fragments_manquants(c)
+    conn.commit()
+    conn.close()
+
+# Recherche dans les paroles (recherche.py)
+
+def requete_tsquery(texte):
+    """Transformer la saisie de l'utilisateur en requête to_tsquery : mots sans accents, comme le document
+    indexé, le dernier en préfixe"""
+    texte = unicodedata.normalize('NFKD', texte_indexable(texte).lower())
+    mots = re.findall(r'\w+', ''.join(car for car in texte if not unicodedata.combining(car)))
+    if not mots:
+        return None
+    return ' & '.join(mots[:-1] + [f'{mots[-1]}:*'])
+
+def rechercher_paroles(texte, projet_id=None, limite=50):
+    """Lignes (projet_id, morceau_id, air, ligne, original, traduction) trouvées par l'index tsvector
+
+    Classées par pertinence, le texte trouvé entouré de **.
+    """
+    requete = requete_tsquery(texte)
+    if requete is None:
+        return []
+    filtre_projet = 'AND r.projet_id = ?' if projet_id else ''
+    parametres = (requete, projet_id, limite) if projet_id else (requete, limite)
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute(f'''
+        SELECT r.projet_id, r.morceau_id, m.air, r.ligne,
+               ts_headline('simple', r.original, q, 'StartSel=**, StopSel=**, HighlightAll=true'),
+               ts_headline('simple', r.traduction, q, 'StartSel=**, StopSel=**, HighlightAll=true')
+        FROM recherche_paroles r
+        JOIN morceaux m ON m.id = r.morceau_id
+        CROSS JOIN to_tsquery('simple', ?) q
+        WHERE r.document @@ q {filtre_projet}
+        ORDER BY ts_rank(r.document, q) DESC
+        LIMIT ?
+    ''', parametres)
+    result = c.fetchall()
+    conn.close()
+    return result
+
+# Mémoire de traduction (memoire.py)
+
+def candidats_memoire(normalise):
+    """Couples (normalise, original, traduction) candidats pour un vers normalisé, les exacts en premier"""
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('''
+        SELECT normalise, original, traduction FROM memoire_traductions
+        WHERE empreinte = ?
+        ORDER BY id DESC
+    ''', (empreinte_ligne(normalise),))
+    candidats = [ligne for ligne in c.fetchall() if ligne[0] == normalise]
+    # Vers partageant le plus des trigrammes les plus rares
+    c.execute('''
+        WITH rares AS (
+            SELECT trigramme FROM memoire_trigrammes
+            WHERE trigramme = ANY(?)
+            GROUP BY trigramme
+            ORDER BY COUNT(*)
+            LIMIT ?
+        )
+        SELECT m.normalise, m.original, m.traduction
+        FROM memoire_trigrammes t
+        JOIN memoire_traductions m ON m.id = t.memoire_id
+        WHERE t.trigramme IN (SELECT trigramme FROM rares)
+        GROUP BY m.id
+        ORDER BY COUNT(*) DESC
+        LIMIT ?
+    ''', (trigrammes(normalise), TRIGRAMMES_RARES, CANDIDATS_MAX))
+    candidats += c.fetchall()
+    conn.close()
+    return candidats
+
+# Annuaire des projets (projets.lister_projets)
+
+def requete_annuaire(recherche, createur):
+    """Mots de recherche dans le créateur ou la description, mots de createur dans le créateur seul ; None sans aucun mot"""
+    termes = [requete_tsquery(recherche) if recherche else None]
+    requete_createur = requete_tsquery(createur) if createur else None
+    if requete_createur:
+        # Poids A : le créateur dans le document du projet (document_projet_sql)
+        termes.append(' & '.join(terme + ('A' if terme.endswith(':*') else ':A')
+                                 for terme in requete_createur.split(' & ')))
+    termes = [terme for terme in termes if terme]
+    return ' & '.join(termes) if termes else None
+
+def filtres_annuaire(c, recherche='', createur='', prefixe=''):
+    """Conditions sur la table projects (et leurs paramètres) pour une recherche dans l'annuaire"""
+    filtres, parametres = [], []
+    if prefixe:
+        # LIKE préfixe, servi par l'index idx_projects_prefixe (text_pattern_ops)
+        filtres.append('id LIKE ?')
+        parametres.append(prefixe.replace('\\', '\\\\').replace('_', '\\_').replace('%', '\\%') + '%')
+    requete = requete_annuaire(recherche, createur)
+    if requete:
+        filtres.append(f"{document_projet_sql} @@ to_tsquery('simple', ?)")
+        parametres.append(requete)
+    return filtres, parametres
+
+# Contenus des tableurs (blobs.py) : table blobs
+
+def stocker_blob(empreinte, donnees):
+    conn = get_connection()
+    c = conn.cursor()
+    # Contenu déjà présent : seule sa date est rafraîchie, comme pour un fichier
+    c.execute('''
+        INSERT INTO blobs (empreinte, donnees, utilise) VALUES (?, ?, ?)
+        ON CONFLICT (empreinte) DO UPDATE SET utilise = excluded.utilise
+    ''', (empreinte, bytes(donnees), time.time()))
+    conn.commit()
+    conn.close()
+
+def lire_blob(empreinte):
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute('SELECT donnees FROM blobs WHERE empreinte = ?', (empreinte,))
+    ligne = c.fetchone()
+    conn.close()
+    if ligne is None:
+        raise FileNotFoundError(f"Blob introuvable : {empreinte}")
+    return bytes(ligne[0])
+
+def supprimer_blobs_orphelins(empreinte=None):
+    """Supprimer les blobs anciens non référencés (seulement empreinte si elle est donnée) ; retourne leur nombre"""
+    filtre = 'AND empreinte = ?' if empreinte else ''
+    conn = get_connection()
+    c = conn.cursor()
+    c.execute(f'''
+        DELETE FROM blobs
+        WHERE utilise < ? {filtre}
+          AND NOT EXISTS (SELECT 1 FROM tableurs_paroles WHERE empreinte = blobs.empreinte)
+    ''', (time.time() - blobs.DELAI_GRACE, *([empreinte] if empreinte else [])))
+    supprimes = c.rowcount
+    conn.commit()
+    conn.close()
+    return supprimes
+
+def liberer_blob_si_orphelin(empreinte):
+    return supprimer_blobs_orphelins(empreinte) > 0
+
+def collecter_blobs_orphelins():
+    return supprimer_blobs_orphelins()
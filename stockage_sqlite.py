@@ -0,0 +1,535 @@
+"""Stockage SQLite de la base : fichier projects.db, ou un fichier par projet avec la répartition
+
+Toutes les requêtes propres à SQLite sont ici : schéma et migrations (PRAGMA user_version),
+index FTS5 de la recherche, de la mémoire de traduction et de l'annuaire, triggers de
+révision et stockage des tableurs en fichiers. stockage_serveur a les mêmes fonctions
+pour PostgreSQL ; les modules passent par connexion.stockage() pour choisir.
+"""
+import os
+import re
+import sqlite3
+import tempfile
+import time
+import blobs
+import schema
+from connexion import (get_connection, connecter, reparti, bases_attachees, chemins_bases, chemin_base_projet,
+                       CHEMIN_BASE, DOSSIER_BASES_PROJETS, PLAGE_MORCEAUX)
+from recherche import texte_indexable
+from memoire import trigrammes, empreinte_ligne, CANDIDATS_MAX, TRIGRAMMES_RARES
+from morceaux_back import ECART_ORDRE
+from paroles import materialiser_fragments_manquants
+
+# IS [NOT] DISTINCT FROM (3.39), RETURNING (3.35), UPDATE ... FROM (3.33), utilisés par les requêtes communes
+VERSION_SQLITE_MIN = (3, 39, 0)
+
+TYPES = {'identifiant': 'INTEGER PRIMARY KEY AUTOINCREMENT', 'entier': 'INTEGER', 'octets': 'BLOB'}
+
+# Horodatage au même format que datetime.isoformat(), calculé par SQLite
+horodatage_sql = "strftime('%Y-%m-%dT%H:%M:%f', 'now', 'localtime')"
+
+def debuter_ecriture(c):
+    """Ouvrir la transaction avec le verrou d'écriture : les écritures de la base sont sérialisées"""
+    c.execute('BEGIN IMMEDIATE')
+
+# Schéma
+
+def ajouter_colonne(c, table, colonne, definition):
+    """Ajouter une colonne à une table existante si elle n'existe pas encore"""
+    colonnes = [ligne[1] for ligne in c.execute(f'PRAGMA table_info({table})')]
+    if colonne not in colonnes:
+        c.execute(f'ALTER TABLE {table} ADD COLUMN {colonne} {definition}')
+
+def creer_triggers_revision(c):
+    """Créer les triggers qui incrémentent les révisions et alimentent le journal des modifications.
+
+    La révision d'un projet augmente à chaque modification de ses morceaux ou de
+    leurs tableurs ; la révision d'un morceau prend alors la valeur de la révision
+    du projet, ce qui permet de retrouver les morceaux modifiés depuis une révision.
+    Chaque modification est aussi ajoutée à journal_modifications.
+    """
+    incrementer_projet = f"""
+        UPDATE projects
+        SET revision = revision + 1, modified_date = {horodatage_sql}
+        WHERE id = {{projet}};"""
+    estampiller_morceau = """
+        UPDATE morceaux
+        SET revision = COALESCE((SELECT revision FROM projects WHERE id = {projet}), revision + 1)
+        WHERE id = {morceau};"""
+    journaliser = f"""
+        INSERT INTO journal_modifications (projet_id, morceau_id, revision, objet, operation, date)
+        VALUES ({{projet}}, {{morceau}}, (SELECT revision FROM projects WHERE id = {{projet}}),
+                '{{objet}}', '{{operation}}', {horodatage_sql});"""
+    projet_du_tableur = "(SELECT projet_id FROM morceaux WHERE id = {ligne}.morceau_id)"
+
+    colonnes_morceau = ['projet_id', 'ordre', 'air', 'extrait_de', 'compositeur', 'annee', 'text_status']
+    morceau_modifie = ' OR '.join(f'NEW.{col} IS NOT OLD.{col}' for col in colonnes_morceau)
+    colonnes_projet = ['creator', 'description', 'concert_frame']
+    projet_modifie = ' OR '.join(f'NEW.{col} IS NOT OLD.{col}' for col in colonnes_projet)
+
+    triggers = {
+        'morceaux_revision_insert': f"""
+            AFTER INSERT ON morceaux
+            BEGIN
+                {incrementer_projet.format(projet='NEW.projet_id')}
+                {estampiller_morceau.format(projet='NEW.projet_id', morceau='NEW.id')}
+                {journaliser.format(projet='NEW.projet_id', morceau='NEW.id', objet='morceau', operation='insert')}
+            END""",
+        'morceaux_revision_update': f"""
+            AFTER UPDATE OF {', '.join(colonnes_morceau)} ON morceaux
+            WHEN {morceau_modifie}
+            BEGIN
+                {incrementer_projet.format(projet='NEW.projet_id')}
+                {estampiller_morceau.format(projet='NEW.projet_id', morceau='NEW.id')}
+                {journaliser.format(projet='NEW.projet_id', morceau='NEW.id', objet='morceau', operation='update')}
+            END""",
+        'morceaux_revision_delete': f"""
+            AFTER DELETE ON morceaux
+            BEGIN
+                {incrementer_projet.format(projet='OLD.projet_id')}
+                {journaliser.format(projet='OLD.projet_id', morceau='OLD.id', objet='morceau', operation='delete')}
+            END""",
+        'projects_revision_update': f"""
+            AFTER UPDATE OF {', '.join(colonnes_projet)} ON projects
+            WHEN {projet_modifie}
+            BEGIN
+                {incrementer_projet.format(projet='NEW.id')}
+                {journaliser.format(projet='NEW.id', morceau='NULL', objet='projet', operation='update')}
+            END""",
+    }
+    # Seules les colonnes de contenu comptent : marquer un tableur comme indexé n'est pas une modification
+    colonnes_tableur = ['morceau_id', 'nom_fichier', 'donnees', 'empreinte']
+    for operation, ligne in [('insert', 'NEW'), ('update', 'NEW'), ('delete', 'OLD')]:
+        projet = projet_du_tableur.format(ligne=ligne)
+        evenement = f"UPDATE OF {', '.join(colonnes_tableur)}" if operation == 'update' else operation.upper()
+        triggers[f'tableurs_paroles_revision_{operation}'] = f"""
+            AFTER {evenement} ON tableurs_paroles
+            BEGIN
+                {incrementer_projet.format(projet=projet)}
+                {estampiller_morceau.format(projet=projet, morceau=f'{ligne}.morceau_id')}
+                {journaliser.format(projet=projet, morceau=f'{ligne}.morceau_id', objet='paroles', operation=operation)}
+            END"""
+
+    # Les triggers sont recréés à chaque changement de version du schéma
+    for nom, corps in triggers.items():
+        c.execute(f'DROP TRIGGER IF EXISTS {nom}')
+        c.execute(f'CREATE TRIGGER {nom} {corps}')
+
+def migrer_tableurs_vers_blobs(c):
+    """Déplacer les tableurs encore stockés dans la base vers le stockage par empreinte"""
+    c.execute('SELECT id FROM tableurs_paroles WHERE empreinte IS NULL AND donnees IS NOT NULL')
+    for (tableur_id,) in c.fetchall():
+        donnees = c.execute('SELECT donnees FROM tableurs_paroles WHERE id = ?', (tableur_id,)).fetchone()[0]
+        c.execute('UPDATE tableurs_paroles SET empreinte = ?, taille = ?, donnees = NULL WHERE id = ?',
+                  (blobs.stocker_blob(donnees), len(donnees), tableur_id))
+
+def initialiser():
+    """Créer ou mettre à jour le schéma de toutes les bases"""
+    if sqlite3.sqlite_version_info < VERSION_SQLITE_MIN:
+        raise RuntimeError(f"SQLite {'.'.join(map(str, VERSION_SQLITE_MIN))} ou plus récent est nécessaire "
+                           f"(version installée : {sqlite3.sqlite_version})")
+    # Le catalogue d'abord : il donne la liste des bases de projets (connexion.reparti)
+    initialiser_base(CHEMIN_BASE)
+    for chemin in chemins_bases()[1:]:
+        initialiser_base(chemin)
+
+def creer_base_projet(numero, projet):
+    """Créer la base d'un projet réparti : schéma complet, ligne du projet et plage d'identifiants de morceaux
+
+    projet : (id, created_date, modified_date, creator, description).
+    """
+    os.makedirs(DOSSIER_BASES_PROJETS, exist_ok=True)
+    chemin = chemin_base_projet(numero)
+    initialiser_base(chemin)
+    conn = connecter(chemin)
+    c = conn.cursor()
+    c.execute('''
+        INSERT INTO projects (id, created_date, modified_date, creator, description)
+        VALUES (?, ?, ?, ?, ?)
+    ''', projet)
+    # Les morceaux de cette base sont numérotés à partir de numero * PLAGE_MORCEAUX + 1
+    c.execute("INSERT INTO sqlite_sequence (name, seq) VALUES ('morceaux', ?)", (numero * PLAGE_MORCEAUX,))
+    conn.commit()
+    conn.close()
+
+def initialiser_base(chemin):
+    """Créer ou mettre à jour le schéma d'une base SQLite (la base des projets, ou une base de projet réparti)"""
+    conn = connecter(chemin)
+    c = conn.cursor()
+
+    # Base déjà à jour : une seule lecture, aucune écriture
+    version = c.execute('PRAGMA user_version').fetchone()[0]
+    if version == schema.version_schema:
+        conn.close()
+        return
+
+    # Pages libérées rendues au système par petites étapes (maintenance.py) : immédiat sur une base neuve ;
+    # une base existante n'est convertie que hors ligne (python maintenance.py convertir), jamais au démarrage
+    c.execute('PRAGMA auto_vacuum = INCREMENTAL')
+
+    schema.creer_tables(c, TYPES)
+    # Colonnes ajoutées depuis la création des premières bases : compteurs de révision (maintenus par
+    # des triggers), contenu des tableurs hors de la base (blobs.py), lignes de chaque diapositive
+    ajouter_colonne(c, 'projects', 'revision', 'INTEGER NOT NULL DEFAULT 0')
+    ajouter_colonne(c, 'morceaux', 'revision', 'INTEGER NOT NULL DEFAULT 0')
+    ajouter_colonne(c, 'tableurs_paroles', 'empreinte', 'TEXT')
+    ajouter_colonne(c, 'tableurs_paroles', 'taille', 'INTEGER')
+    ajouter_colonne(c, 'tableurs_paroles', 'indexe', 'INTEGER NOT NULL DEFAULT 0')
+    ajouter_colonne(c, 'fragments_tex', 'lignes_opera', 'TEXT')
+    ajouter_colonne(c, 'fragments_tex', 'lignes_poeme', 'TEXT')
+    # Schéma 12 : couples de la mémoire uniques par morceau (et non plus dans toute la mémoire) ; la table
+    # est reconstruite avec les mêmes id (index de trigrammes)
+    c.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'memoire_traductions'")
+    if 'UNIQUE (empreinte, traduction)' in c.fetchone()[0]:
+        schema.creer_table(c, 'memoire_traductions', TYPES, nom='memoire_traductions_12')
+        c.execute('INSERT INTO memoire_traductions_12 SELECT id, empreinte, normalise, original, traduction, morceau_id FROM memoire_traductions')
+        c.execute('DROP TABLE memoire_traductions')
+        c.execute('ALTER TABLE memoire_traductions_12 RENAME TO memoire_traductions')
+    schema.creer_index(c)
+    migrer_tableurs_vers_blobs(c)
+
+    # Index plein texte des paroles (recherche.py), alimenté à chaque sauvegarde de tableur ;
+    # les tableurs existants sont indexés à la première recherche (paroles.indexer_tableurs_manquants)
+    c.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS recherche_paroles USING fts5(
+            original, traduction,
+            morceau_id UNINDEXED, projet_id UNINDEXED, ligne UNINDEXED,
+            tokenize = 'unicode61 remove_diacritics 2'
+        )
+    ''')
+
+    # Index de trigrammes de la mémoire de traduction, pour les correspondances approchées
+    c.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS memoire_trigrammes USING fts5(
+            normalise, content = 'memoire_traductions', content_rowid = 'id', tokenize = 'trigram'
+        )
+    ''')
+    c.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS memoire_trigrammes_vocabulaire USING fts5vocab(memoire_trigrammes, row)
+    ''')
+    c.execute('DROP TRIGGER IF EXISTS memoire_traductions_insert')
+    c.execute('''
+        CREATE TRIGGER memoire_traductions_insert AFTER INSERT ON memoire_traductions
+        BEGIN
+            INSERT INTO memoire_trigrammes (rowid, normalise) VALUES (NEW.id, NEW.normalise);
+        END
+    ''')
+    c.execute('DROP TRIGGER IF EXISTS memoire_traductions_delete')
+    c.execute('''
+        CREATE TRIGGER memoire_traductions_delete AFTER DELETE ON memoire_traductions
+        BEGIN
+            INSERT INTO memoire_trigrammes (memoire_trigrammes, rowid, normalise) VALUES ('delete', OLD.id, OLD.normalise);
+        END
+    ''')
+    # Bases des projets répartis (connexion.reparti), dans le catalogue : base_<numero>.db
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS bases_projets (
+            numero INTEGER PRIMARY KEY AUTOINCREMENT,
+            projet_id TEXT UNIQUE NOT NULL
+        )
+    ''')
+    # Annuaire des projets (projets.lister_projets) : recherche par mots dans le créateur et la description
+    # (FTS5). La table projects n'a pas de clé entière (VACUUM peut renuméroter ses rowid) : annuaire_projets
+    # donne à chaque projet un numéro stable, rowid de sa ligne dans annuaire_recherche
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS annuaire_projets (
+            numero INTEGER PRIMARY KEY AUTOINCREMENT,
+            projet_id TEXT UNIQUE NOT NULL
+        )
+    ''')
+    c.execute('''
+        CREATE VIRTUAL TABLE IF NOT EXISTS annuaire_recherche USING fts5(
+            creator, description, tokenize = 'unicode61 remove_diacritics 2'
+        )
+    ''')
+    numero_annuaire = '(SELECT numero FROM annuaire_projets WHERE projet_id = {ligne}.id)'
+    triggers_annuaire = {
+        'projects_annuaire_insert': f'''
+            AFTER INSERT ON projects
+            BEGIN
+                INSERT INTO annuaire_projets (projet_id) VALUES (NEW.id);
+                INSERT INTO annuaire_recherche (rowid, creator, description)
+                VALUES ({numero_annuaire.format(ligne='NEW')}, NEW.creator, NEW.description);
+            END''',
+        'projects_annuaire_update': f'''
+            AFTER UPDATE OF creator, description ON projects
+            BEGIN
+                UPDATE annuaire_recherche SET creator = NEW.creator, description = NEW.description
+                WHERE rowid = {numero_annuaire.format(ligne='NEW')};
+            END''',
+        'projects_annuaire_delete': f'''
+            AFTER DELETE ON projects
+            BEGIN
+                DELETE FROM annuaire_recherche WHERE rowid = {numero_annuaire.format(ligne='OLD')};
+                DELETE FROM annuaire_projets WHERE projet_id = OLD.id;
+            END''',
+    }
+    for nom, corps in triggers_annuaire.items():
+        c.execute(f'DROP TRIGGER IF EXISTS {nom}')
+        c.execute(f'CREATE TRIGGER {nom} {corps}')
+    if version < 11:
+        # Projets existants inscrits à l'annuaire
+        c.execute('DELETE FROM annuaire_recherche')
+        c.execute('DELETE FROM annuaire_projets')
+        c.execute('INSERT INTO annuaire_projets (projet_id) SELECT id FROM projects ORDER BY created_date, id')
+        c.execute('''
+            INSERT INTO annuaire_recherche (rowid, creator, description)
+            SELECT a.numero, p.creator, p.description
+            FROM annuaire_projets a JOIN projects p ON p.id = a.projet_id
+        ''')
+    if version < 8:
+        # Fragments recalculés ci-dessous avec les lignes de chaque diapositive
+        c.execute('DELETE FROM fragments_tex')
+    materialiser_fragments_manquants(c)
+
+    if version < 6:
+        # Le statut du texte est désormais dérivé à l'enregistrement des tableurs (paroles.ecrire_tableur)
+        c.execute('''
+            UPDATE morceaux SET text_status = 'draft'
+            WHERE text_status = 'not_started' AND id IN (SELECT morceau_id FROM tableurs_paroles)
+        ''')
+
+    if version < 5:
+        # Passage des numéros d'ordre (1, 2, 3...) aux clés à écarts (morceaux_back.ECART_ORDRE)
+        c.execute('''
+            WITH rangs AS (
+                SELECT id, ROW_NUMBER() OVER (PARTITION BY projet_id ORDER BY ordre, id) * ? AS nouvel_ordre
+                FROM morceaux
+            )
+            UPDATE morceaux SET ordre = rangs.nouvel_ordre
+            FROM rangs
+            WHERE morceaux.id = rangs.id AND morceaux.ordre IS NOT rangs.nouvel_ordre
+        ''', (ECART_ORDRE,))
+
+    if version < 4:
+        # Les tableurs déjà indexés pour la recherche sont relus pour remplir la mémoire
+        c.execute('UPDATE tableurs_paroles SET indexe = 0')
+
+    creer_triggers_revision(c)
+
+    c.execute(f'PRAGMA user_version = {schema.version_schema}')
+    conn.commit()
+    conn.close()
+
+# Recherche dans les paroles (recherche.py)
+
+def requete_fts(texte):
+    """Transformer la saisie de l'utilisateur en requête FTS5 : tous les mots, le dernier en préfixe"""
+    mots = re.findall(r'\w+', texte_indexable(texte))
+    if not mots:
+        return None
+    termes = [f'"{mot}"' for mot in mots[:-1]] + [f'"{mots[-1]}"*']
+    return ' '.join(termes)
+
+def rechercher_paroles(texte, projet_id=None, limite=50):
+    """Lignes (projet_id, morceau_id, air, ligne, original, traduction) trouvées par l'index FTS5
+
+    Classées par pertinence, le texte trouvé entouré de **.
+    """
+    requete = requete_fts(texte)
+    if requete is None:
+        return []
+    if projet_id is None and reparti():
+        return rechercher_toutes_bases(requete, limite)
+    filtre_projet = 'AND r.projet_id = ?' if projet_id else ''
+    parametres = (requete, projet_id, limite) if projet_id else (requete, limite)
+    conn = get_connection(projet_id=projet_id)
+    c = conn.cursor()
+    c.execute(f'''
+        SELECT r.projet_id, r.morceau_id, m.air, r.ligne,
+               highlight(recherche_paroles, 0, '**', '**'),
+               highlight(recherche_paroles, 1, '**', '**')
+        FROM recherche_paroles r
+        JOIN morceaux m ON m.id = r.morceau_id
+        WHERE recherche_paroles MATCH ? {filtre_projet}
+        ORDER BY rank
+        LIMIT ?
+    ''', parametres)
+    result = c.fetchall()
+    conn.close()
+    return result
+
+def rechercher_toutes_bases(requete, limite):
+    """Recherche FTS5 dans tous les projets répartis (connexion.reparti), une requête par lot de bases attachées"""
+    result = []
+    for conn, schemas in bases_attachees():
+        selections = [f'''
+            SELECT r.projet_id, r.morceau_id, m.air, r.ligne,
+                   highlight(recherche_paroles, 0, '**', '**'),
+                   highlight(recherche_paroles, 1, '**', '**'),
+                   rank
+            FROM {schema}.recherche_paroles r
+            JOIN {schema}.morceaux m ON m.id = r.morceau_id
+            WHERE recherche_paroles MATCH ?
+        ''' for schema in schemas]
+        c = conn.cursor()
+        c.execute(' UNION ALL '.join(selections) + ' ORDER BY 7 LIMIT ?', (*[requete] * len(schemas), limite))
+        result += c.fetchall()
+    # Rangs BM25 calculés base par base, donc approximativement comparables : meilleurs résultats de tous les lots
+    result.sort(key=lambda ligne: ligne[6])
+    return [ligne[:6] for ligne in result[:limite]]
+
+# Mémoire de traduction (memoire.py)
+
+def requete_trigrammes(c, normalise, schema='main'):
+    """Requête FTS5 : au moins un des trigrammes les plus rares du vers cherché (dans la base schema)"""
+    candidats = trigrammes(normalise)
+    if not candidats:
+        return None
+    c.execute(f'''
+        SELECT term FROM {schema}.memoire_trigrammes_vocabulaire
+        WHERE term IN ({', '.join('?' * len(candidats))})
+        ORDER BY doc
+        LIMIT ?
+    ''', (*candidats, TRIGRAMMES_RARES))
+    rares = [ligne[0] for ligne in c.fetchall()]
+    if not rares:
+        return None
+    return ' OR '.join('"' + t.replace('"', '""') + '"' for t in rares)
+
+def candidats_base(c, normalise, schema='main'):
+    """Couples (normalise, original, traduction) candidats d'une base : exacts puis approchés"""
+    c.execute(f'''
+        SELECT normalise, original, traduction FROM {schema}.memoire_traductions
+        WHERE empreinte = ?
+        ORDER BY id DESC
+    ''', (empreinte_ligne(normalise),))
+    candidats = [ligne for ligne in c.fetchall() if ligne[0] == normalise]
+    requete = requete_trigrammes(c, normalise, schema)
+    if requete is not None:
+        c.execute(f'''
+            SELECT m.normalise, m.original, m.traduction
+            FROM {schema}.memoire_trigrammes t
+            JOIN {schema}.memoire_traductions m ON m.id = t.rowid
+            WHERE memoire_trigrammes MATCH ?
+            ORDER BY t.rank
+            LIMIT ?
+        ''', (requete, CANDIDATS_MAX))
+        candidats += c.fetchall()
+    return candidats
+
+def candidats_memoire(normalise):
+    """Couples (normalise, original, traduction) candidats pour un vers normalisé, les exacts en premier
+
+    Avec la répartition (connexion.reparti), la mémoire de chaque projet est interrogée.
+    """
+    candidats = []
+    for conn, schemas in bases_attachees():
+        c = conn.cursor()
+        for schema_base in schemas:
+            candidats += candidats_base(c, normalise, schema_base)
+    # Correspondances exactes d'abord, quelle que soit leur base
+    candidats.sort(key=lambda ligne: ligne[0] != normalise)
+    return candidats
+
+# Annuaire des projets (projets.lister_projets)
+
+# Recherche qui trouve au moins un projet sur PROPORTION_PARCOURS : la page est lue en parcourant l'index
+# de la date (environ PROPORTION_PARCOURS lignes par projet affiché) ; en dessous, les projets trouvés
+# sont lus par leur identifiant puis triés (moins d'un centième de la table)
+PROPORTION_PARCOURS = 100
+
+def requete_annuaire(recherche, createur):
+    """Mots de recherche dans le créateur ou la description, mots de createur dans le créateur seul ; None sans aucun mot"""
+    termes = [requete_fts(recherche) if recherche else None]
+    requete_createur = requete_fts(createur) if createur else None
+    if requete_createur:
+        termes.append(f'creator : ({requete_createur})')
+    termes = [f'({terme})' for terme in termes if terme]
+    return ' AND '.join(termes) if termes else None
+
+def filtres_annuaire(c, recherche='', createur='', prefixe=''):
+    """Conditions sur la table projects (et leurs paramètres) pour une recherche dans l'annuaire"""
+    filtres, parametres = [], []
+    if prefixe:
+        # Intervalle de la clé primaire : tous les identifiants qui commencent par prefixe
+        filtres.append('id >= ? AND id < ?')
+        parametres += [prefixe, prefixe + '\U0010ffff']
+    requete = requete_annuaire(recherche, createur)
+    if requete:
+        # Nombre de projets trouvés, compté jusqu'au seuil seulement (numero : nombre de projets inscrits)
+        inscrits = c.execute('SELECT COALESCE(MAX(numero), 0) FROM annuaire_projets').fetchone()[0]
+        seuil = max(inscrits // PROPORTION_PARCOURS, 1)
+        trouves = c.execute('''
+            SELECT COUNT(*) FROM (SELECT rowid FROM annuaire_recherche WHERE annuaire_recherche MATCH ? LIMIT ?)
+        ''', (requete, seuil)).fetchone()[0]
+        if trouves >= seuil:
+            filtres.append('''(SELECT numero FROM annuaire_projets WHERE projet_id = projects.id) IN (
+                SELECT rowid FROM annuaire_recherche WHERE annuaire_recherche MATCH ?
+            )''')
+        else:
+            filtres.append('''id IN (
+                SELECT a.projet_id FROM annuaire_recherche r JOIN annuaire_projets a ON a.numero = r.rowid
+                WHERE annuaire_recherche MATCH ?
+            )''')
+        parametres.append(requete)
+    return filtres, parametres
+
+# Contenus des tableurs (blobs.py) : un fichier par contenu dans blobs.DOSSIER_BLOBS
+
+def stocker_blob(empreinte, donnees):
+    chemin = blobs.chemin_blob(empreinte)
+    if os.path.exists(chemin):
+        # Contenu déjà présent : on rafraîchit sa date pour le protéger du ramasse-miettes
+        os.utime(chemin)
+        return
+
+    dossier = os.path.dirname(chemin)
+    os.makedirs(dossier, exist_ok=True)
+    # Écriture dans un fichier temporaire puis renommage atomique : un blob n'est jamais lu à moitié écrit
+    fd, chemin_temp = tempfile.mkstemp(dir=dossier, prefix='.tmp_')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(donnees)
+        os.replace(chemin_temp, chemin)
+    except Exception:
+        os.remove(chemin_temp)
+        raise
+
+def lire_blob(empreinte):
+    with open(blobs.chemin_blob(empreinte), 'rb') as f:
+        return f.read()
+
+def _supprimer_si_ancien(chemin, maintenant):
+    """Supprimer un fichier de blob s'il n'a pas été écrit ou réutilisé récemment"""
+    try:
+        if maintenant - os.path.getmtime(chemin) > blobs.DELAI_GRACE:
+            os.remove(chemin)
+            return True
+    except FileNotFoundError:
+        pass
+    return False
+
+def references_blobs(empreinte=None):
+    """Empreintes référencées par un tableur (seulement empreinte si elle est donnée)
+
+    Un même contenu peut servir à plusieurs projets : avec la répartition
+    (connexion.reparti), toutes les bases sont consultées.
+    """
+    filtre = 'empreinte = ?' if empreinte else 'empreinte IS NOT NULL'
+    references = set()
+    for conn, schemas in bases_attachees():
+        c = conn.cursor()
+        for schema_base in schemas:
+            c.execute(f'SELECT DISTINCT empreinte FROM {schema_base}.tableurs_paroles WHERE {filtre}',
+                      (empreinte,) if empreinte else ())
+            references.update(ligne[0] for ligne in c.fetchall())
+    return references
+
+def liberer_blob_si_orphelin(empreinte):
+    if empreinte in references_blobs(empreinte):
+        return False
+    return _supprimer_si_ancien(blobs.chemin_blob(empreinte), time.time())
+
+def collecter_blobs_orphelins():
+    references = references_blobs()
+
+    if not os.path.isdir(blobs.DOSSIER_BLOBS):
+        return 0
+    maintenant = time.time()
+    supprimes = 0
+    for dossier, _, fichiers in os.walk(blobs.DOSSIER_BLOBS):
+        for nom in fichiers:
+            # Les fichiers temporaires abandonnés (écriture interrompue) sont aussi collectés
+            if nom not in references and _supprimer_si_ancien(os.path.join(dossier, nom), maintenant):
+                supprimes += 1
+    return supprimes
@@ -1,11 +1,20 @@
 import pandas as pd
 import os 
-import numpy 
-import sqlite3
+from connexion import get_connection
 import streamlit as st
 import tempfile
-import subprocess
 import base64
+import collections
+import hashlib
+import io
+import json
+import re
+import functools
+import threading
+from pypdf import PdfReader, PdfWriter
+from bac_a_sable import executer_pdflatex
+from traces import etape, tracer
+from diapositives import Concert, construire_morceau, decouper
 
 template_opera = """
 \\begin{frame}{}
@@ -52,17 +61,17 @@ template_titre_frame = """
 \end{frame}"""
 template_titre = "opera compositeur year\\\\  « air »"
 
-def clean(entry):
-    if type(entry) in (float, numpy.float64):
-        return artificial_space
-    return entry.replace('[', '').replace(']', '')
+def texte_cellule(texte):
+    """Texte d'une cellule de la représentation intermédiaire (diapositives.Morceau) pour beamer"""
+    return artificial_space if texte is None else texte
 
 def cleartitle(entry):
     # garder uniquement les lettres sans accents sans espaces
     return ''.join(e for e in entry if e.isalnum())
 
+@tracer('sqlite.get_morceau')
 def get_morceau(morceau_id):
-    conn = sqlite3.connect('projects.db')
+    conn = get_connection(morceau_id=morceau_id)
     c = conn.cursor()
     c.execute('''
         SELECT id, ordre, air, compositeur, annee, extrait_de 
@@ -74,54 +83,208 @@ def get_morceau(morceau_id):
     conn.close()
     return result[0]
 
-def generate_frame_title(morceau_id, mode='opera'):
-    morceau = get_morceau(morceau_id)
+@tracer('generate_frame_title')
+def generate_frame_title(morceau_id, mode='opera', morceau=None):
+    if morceau is None:
+        morceau = get_morceau(morceau_id)
     air, compositeur, annee, extrait_de = morceau[2], morceau[3], morceau[4], morceau[5]
     title = template_titre.replace("air", air).replace("compositeur", compositeur)
     title = title.replace("opera", f"\\textbf{{\\textit{{extrait_de}}}} -- ".replace("extrait_de", extrait_de)) if len(extrait_de) > 0 else title.replace("opera", "")
     title = title.replace("year", f"({str(annee)})") if len(annee) >0 else title.replace("year", "")
     return template_titre_frame.replace("titre", title) if mode=='opéra' else title
 
+def rendre_diapo(diapo, mode='opera', title=""):
+    """Code beamer d'une diapositive de texte (diapositives.Diapo)"""
+    if mode == 'opéra':
+        originaux, traductions = diapo.originaux, diapo.traductions
+        it_1, fr_1 = texte_cellule(originaux[0]), texte_cellule(traductions[0])
+        if len(originaux) == 1:
+            it_2 = fr_2 = artificial_space
+        else:
+            it_2, fr_2 = texte_cellule(originaux[1]), texte_cellule(traductions[1])
+        return template_opera.replace("original_1", it_1).replace("original_2", it_2).replace("francais_1", fr_1).replace("francais_2", fr_2)
+    original_text = " \\\\ ".join(texte_cellule(texte) for texte in diapo.originaux)
+    traduction_text = " \\\\ ".join(texte_cellule(texte) for texte in diapo.traductions)
+    if diapo.avec_titre:
+        content = template_poeme.replace("titre", f"{title} \\\\ \\vspace{{0.5cm}}")
+    else:
+        content = template_poeme.replace('titre', '')
+    return content.replace("original", original_text+"\\\\").replace("francais", traduction_text+"\\\\")
+
+def rendre_diapos(diapos, mode='opera', title=""):
+    """Code beamer des diapositives de texte d'un morceau ; title : titre affiché sur la première (mode poème)"""
+    if mode not in ('opéra', 'poème'):
+        return ""
+    return "".join(rendre_diapo(diapo, mode=mode, title=title) + "\n" for diapo in diapos)
+
+@tracer('generate_text')
 def generate_text(paroles_df, mode='opera', title=""):  
-    tex_slides = ""  
-    max_lignes_poem = 100
-    df = paroles_df
+    return rendre_diapos(decouper(paroles_df, mode), mode=mode, title=title)
+
+frame_blank = "\\begin{frame}{} \\end{frame}\n"
+
+@tracer('generate_concert')
+def generate_concert(morceau_ids, charger_paroles, mode='poème', use_text=True, add_blank=False, morceaux=None):
+    """Assembler les diapositives de tous les morceaux d'un concert, dans l'ordre donné
+
+    charger_paroles : fonction qui retourne le DataFrame des paroles d'un morceau.
+    morceaux : lignes (id, ordre, air, compositeur, annee, extrait_de, ...) déjà lues,
+    par identifiant, pour ne pas relire chaque morceau dans la base.
+    """
+    morceaux = morceaux or {}
+    concert = Concert(mode, [
+        construire_morceau(morceau_id, charger_paroles(morceau_id) if use_text else None,
+                           morceau=morceaux.get(morceau_id) or get_morceau(morceau_id))
+        for morceau_id in morceau_ids
+    ], textes=use_text, blanche=add_blank)
+    return rendre_concert(concert)
+
+def rendre_concert(concert):
+    """Code beamer d'un concert (diapositives.Concert)"""
+    latex_content = ""
+    blank = frame_blank if concert.blanche else ""
+    for morceau in concert.morceaux:
+        with etape('morceau', morceau=morceau.id):
+            frame_title = generate_frame_title(morceau.id, mode=concert.mode, morceau=morceau.ligne_morceau())
+            texte = rendre_diapos(morceau.diapos(concert.mode), mode=concert.mode, title=frame_title) if concert.textes else ""
+        if concert.mode == 'opéra':
+            latex_content += frame_title + "\n" + texte + "\n" + blank + "\n"
+        elif concert.mode == 'poème':
+            latex_content += texte + "\n" + blank + "\n"
+    return latex_content
+
+# Fragments TeX matérialisés : titres et textes de chaque morceau, pour les deux modes, recalculés
+# à l'écriture (métadonnées ou paroles) et non à chaque rendu. Dans le texte poème, le titre est
+# remplacé par ce marqueur, substitué à l'assemblage : modifier un titre ne relit pas le tableur.
+MARQUEUR_TITRE = '%TITRE_MORCEAU%'
+
+def materialiser_titres(c, morceau_id):
+    """Recalculer les titres d'un morceau (dans la transaction du curseur c)"""
+    c.execute('SELECT id, ordre, air, compositeur, annee, extrait_de FROM morceaux WHERE id = ?', (morceau_id,))
+    morceau = c.fetchone()
+    c.execute('''
+        INSERT INTO fragments_tex (morceau_id, titre_opera, titre_poeme) VALUES (?, ?, ?)
+        ON CONFLICT (morceau_id) DO UPDATE SET titre_opera = excluded.titre_opera, titre_poeme = excluded.titre_poeme
+    ''', (morceau_id, generate_frame_title(morceau_id, mode='opéra', morceau=morceau),
+          generate_frame_title(morceau_id, mode='poème', morceau=morceau)))
+
+def lignes_par_diapo(paroles_df, mode='opera'):
+    """Lignes du tableur de chaque diapositive produite par generate_text, dans l'ordre
+
+    Chaque élément est [première, dernière] (numérotées à partir de 1), ou None pour
+    une diapositive sans ligne (coupure en tête de texte).
+    """
+    return [diapo.plage() for diapo in decouper(paroles_df, mode)]
+
+def materialiser_textes(c, morceau_id, paroles_df):
+    """Recalculer les textes d'un morceau à partir de ses paroles (dans la transaction du curseur c)"""
+    morceau = construire_morceau(morceau_id, paroles_df)
+    diapos_opera, diapos_poeme = morceau.diapos('opéra'), morceau.diapos('poème')
+    c.execute('''
+        INSERT INTO fragments_tex (morceau_id, texte_opera, texte_poeme, lignes_opera, lignes_poeme) VALUES (?, ?, ?, ?, ?)
+        ON CONFLICT (morceau_id) DO UPDATE SET texte_opera = excluded.texte_opera, texte_poeme = excluded.texte_poeme,
+            lignes_opera = excluded.lignes_opera, lignes_poeme = excluded.lignes_poeme
+    ''', (morceau_id, rendre_diapos(diapos_opera, mode='opéra'),
+          rendre_diapos(diapos_poeme, mode='poème', title=MARQUEUR_TITRE),
+          json.dumps([diapo.plage() for diapo in diapos_opera]),
+          json.dumps([diapo.plage() for diapo in diapos_poeme])))
+
+@tracer('sqlite.assembler_concert')
+def assembler_concert(projet_id, mode='poème', use_text=True, add_blank=False):
+    """Assembler les diapositives d'un concert à partir des fragments matérialisés, en une requête ordonnée
+
+    Produit le même document que generate_concert, sans relire ni régénérer les morceaux.
+    """
+    blank = frame_blank if add_blank else ""
     if mode == 'opéra':
-        while len(df) !=0:
-            fr_1 = clean(df.iloc[0]["Traduction"])
-            it_1 = clean(df.iloc[0]["Original"])
-            if len(df) == 1:
-                fr_2 = artificial_space
-                it_2 = artificial_space
-                df = []
-            else:
-                fr_2 = clean(df.iloc[1]["Traduction"])
-                it_2 = clean(df.iloc[1]["Original"])
-                if len(df) >= 2:
-                    df = df[2:]
-            content = template_opera.replace("original_1", it_1).replace("original_2", it_2).replace("francais_1", fr_1).replace("francais_2", fr_2)
-            tex_slides += content + "\n"
-    elif mode == 'poème':
-        title_done = False
-        while len(df) !=0:
-            original_lines = []
-            traduction_lines = []
-            for i in range(len(df)):
-                if df.iloc[i]["Original"] == "COUPURE":
-                    break
-                original_lines.append(clean(df.iloc[i]["Original"]))
-                traduction_lines.append(clean(df.iloc[i]["Traduction"]))
-            original_text = " \\\\ ".join(original_lines)
-            traduction_text = " \\\\ ".join(traduction_lines)
-            if not title_done:
-                content = template_poeme.replace("titre", f"{title} \\\\ \\vspace{{0.5cm}}")
-                title_done = True
-            else: 
-                content = template_poeme.replace('titre', '')
-            content = content.replace("original", original_text+"\\\\").replace("francais", traduction_text+"\\\\")
-            tex_slides += content + "\n"
-            df = df[i+1:]
-    return tex_slides
+        fragment = "f.titre_opera || :saut || {texte} || :saut || :blank || :saut"
+        texte = "COALESCE(f.texte_opera, '')"
+    else:
+        fragment = "{texte} || :saut || :blank || :saut"
+        texte = "replace(COALESCE(f.texte_poeme, ''), :marqueur, f.titre_poeme)"
+    conn = get_connection(projet_id=projet_id)
+    c = conn.cursor()
+    c.execute(f'''
+        SELECT {fragment.format(texte=texte if use_text else "''")}
+        FROM morceaux m
+        JOIN fragments_tex f ON f.morceau_id = m.id
+        WHERE m.projet_id = :projet
+        ORDER BY m.ordre, m.id
+    ''', {'projet': projet_id, 'blank': blank, 'marqueur': MARQUEUR_TITRE, 'saut': '\n'})
+    result = c.fetchall()
+    conn.close()
+    return ''.join(ligne[0] for ligne in result)
+
+@tracer('sqlite.diapositives_concert')
+def diapositives_concert(projet_id, mode='poème', use_text=True, add_blank=False):
+    """Diapositives de chaque morceau du document produit par assembler_concert (mêmes options, même ordre)
+
+    Retourne une liste de (morceau_id, air, diapos) ; diapos donne pour chaque
+    diapositive du morceau ses lignes du tableur ([première, dernière]) ou None
+    (titre, diapositive blanche).
+    """
+    conn = get_connection(projet_id=projet_id)
+    c = conn.cursor()
+    c.execute(f'''
+        SELECT m.id, m.air, f.{'lignes_opera' if mode == 'opéra' else 'lignes_poeme'}
+        FROM morceaux m
+        JOIN fragments_tex f ON f.morceau_id = m.id
+        WHERE m.projet_id = ?
+        ORDER BY m.ordre, m.id
+    ''', (projet_id,))
+    result = c.fetchall()
+    conn.close()
+    morceaux = []
+    for morceau_id, air, lignes in result:
+        diapos = [None] if mode == 'opéra' else []
+        if use_text and lignes:
+            diapos += json.loads(lignes)
+        if add_blank:
+            diapos.append(None)
+        morceaux.append((morceau_id, air, diapos))
+    return morceaux
+
+# Pages de chaque diapositive, écrites par beamer dans le fichier .nav
+_pages_diapo = re.compile(r'\\beamer@framepages\s*\{(\d+)\}\{(\d+)\}')
+
+def pages_des_diapositives(nav):
+    """Pages [(première, dernière)] de chaque diapositive du document, dans l'ordre, lues dans le .nav"""
+    return [(int(debut), int(fin)) for debut, fin in _pages_diapo.findall(nav)]
+
+def index_pages(morceaux, pages):
+    """Associer à chaque morceau ses pages dans le PDF compilé
+
+    morceaux : résultat de diapositives_concert ; pages : résultat de
+    pages_des_diapositives. Les diapositives qui précèdent les morceaux viennent de
+    la diapositive de titre du concert, de longueur libre : elles sont déduites du
+    total. Retourne une liste de dictionnaires (morceau_id, air, premiere_page,
+    derniere_page, diapos : [(première page, dernière page, lignes)]), ou None si le
+    document ne correspond pas aux morceaux.
+    """
+    en_tete = len(pages) - sum(len(diapos) for _, _, diapos in morceaux)
+    if en_tete < 0:
+        return None
+    index = []
+    position = en_tete
+    for morceau_id, air, diapos in morceaux:
+        diapos_pages = [(*pages[position + i], lignes) for i, lignes in enumerate(diapos)]
+        position += len(diapos)
+        if diapos_pages:
+            index.append({'morceau_id': morceau_id, 'air': air,
+                          'premiere_page': diapos_pages[0][0], 'derniere_page': diapos_pages[-1][1],
+                          'diapos': diapos_pages})
+    return index
+
+@functools.lru_cache(maxsize=32)
+def extraire_pages(pdf_bytes, premiere, derniere):
+    """PDF réduit aux pages premiere à derniere (numérotées à partir de 1) d'un PDF déjà compilé"""
+    lecteur = PdfReader(io.BytesIO(pdf_bytes))
+    ecrivain = PdfWriter()
+    for numero in range(premiere - 1, min(derniere, len(lecteur.pages))):
+        ecrivain.add_page(lecteur.pages[numero])
+    sortie = io.BytesIO()
+    ecrivain.write(sortie)
+    return sortie.getvalue()
 
 default_tex = r"""
     \documentclass[14pt,aspectratio=169]{beamer}
@@ -203,55 +366,128 @@ default_tex_poeme = r"""
     \end{document}
     """
 
-def make_latex(frames, mode='opera'):
+# Dernières compilations du processus, par empreinte du code LaTeX : l'aperçu compilé par le
+# préchauffage (prechauffage.py) ou par une autre session n'est pas recompilé
+COMPILATIONS_MAX = 16
+_compilations = collections.OrderedDict()
+_verrou_compilations = threading.Lock()
+
+@tracer('compile_latex')
+def compile_latex(frames, mode='opera', basse_priorite=False, annule=None, lance=None):
+    """Compiler les diapositives avec pdflatex
+
+    Retourne (content, pdf_bytes, result, pages) : le code LaTeX complet, le PDF (None
+    si la compilation a échoué ou a été arrêtée), le résultat de pdflatex
+    (bac_a_sable.Compilation) et les pages de chaque diapositive
+    (pages_des_diapositives). basse_priorite :
+    pdflatex est lancé avec une priorité réduite (compilations de fond). annule,
+    lance : arrêt de la compilation (bac_a_sable.executer_pdflatex) ; une compilation
+    annulée n'est pas gardée.
+    """
     content = default_tex.replace("%CONTENT", frames)
+    cle = hashlib.sha256(content.encode()).hexdigest()
+    with _verrou_compilations:
+        if cle in _compilations:
+            _compilations.move_to_end(cle)
+            return (content, *_compilations[cle])
 
     with tempfile.TemporaryDirectory() as tmpdir:
 
         tex_path = os.path.join(tmpdir, "doc.tex")
         pdf_path = os.path.join(tmpdir, "doc.pdf")
+        nav_path = os.path.join(tmpdir, "doc.nav")
 
         # Écrire le .tex
         with open(tex_path, "w") as f:
             f.write(content)
 
-        # Compiler
-        result = subprocess.run(
-            ["pdflatex", "-interaction=nonstopmode", tex_path],
-            cwd=tmpdir,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE
-        )
-
-        if os.path.exists(pdf_path):
+        # Compiler (limites de temps, de mémoire et d'écriture : bac_a_sable.py)
+        with etape('pdflatex', mode=mode) as mesure:
+            result = executer_pdflatex(tex_path, tmpdir, basse_priorite=basse_priorite, annule=annule, lance=lance)
+            mesure.etiqueter(arret=result.arret, **result.ressources)
 
+        pdf_bytes = None
+        # Un PDF partiel écrit avant l'arrêt forcé n'est pas affiché
+        if result.arret is None and os.path.exists(pdf_path):
             # Lire le PDF pour affichage
             with open(pdf_path, "rb") as f:
                 pdf_bytes = f.read()
+        pages = []
+        if pdf_bytes is not None and os.path.exists(nav_path):
+            with open(nav_path, encoding="utf-8", errors="replace") as f:
+                pages = pages_des_diapositives(f.read())
+
+    if result.arret == 'annule':
+        return content, pdf_bytes, result, pages
+    with _verrou_compilations:
+        _compilations[cle] = (pdf_bytes, result, pages)
+        while len(_compilations) > COMPILATIONS_MAX:
+            _compilations.popitem(last=False)
+    return content, pdf_bytes, result, pages
+
+def format_lignes(lignes):
+    if lignes is None:
+        return ""
+    premiere, derniere = lignes
+    return f"ligne {premiere}" if premiere == derniere else f"lignes {premiere} à {derniere}"
+
+def choisir_pages(pdf_bytes, index):
+    """Choix d'un morceau dans l'aperçu : retourne le PDF à afficher (ses seules pages, ou tout le concert)"""
+    choix = st.selectbox(
+        "Aller au morceau",
+        [None] + list(range(len(index))),
+        format_func=lambda i: "Tout le concert" if i is None else
+            f"{i + 1}. {index[i]['air']} (p. {index[i]['premiere_page']}–{index[i]['derniere_page']})",
+        key="aller_au_morceau"
+    )
+    if choix is None:
+        return pdf_bytes
+    entree = index[choix]
+    with st.expander("Pages et lignes du tableur"):
+        st.dataframe(pd.DataFrame(
+            [{'Pages': f"{debut}–{fin}" if fin > debut else str(debut), 'Lignes': format_lignes(lignes)}
+             for debut, fin, lignes in entree['diapos']]
+        ), hide_index=True)
+    with etape('extraction_pages', pages=entree['derniere_page'] - entree['premiere_page'] + 1):
+        return extraire_pages(pdf_bytes, entree['premiere_page'], entree['derniere_page'])
+
+def make_latex(frames, mode='opera', morceaux=None):
+    """Compiler et afficher l'aperçu ; morceaux (diapositives_concert) permet d'afficher un seul morceau"""
+    content, pdf_bytes, result, pages = compile_latex(frames, mode=mode)
+
+    if pdf_bytes is not None:
+        pdf_affiche = pdf_bytes
+        if morceaux is not None:
+            index = index_pages(morceaux, pages)
+            if index:
+                pdf_affiche = choisir_pages(pdf_bytes, index)
+
+        # --- Affichage PDF dans le navigateur ---
+        with etape('base64', octets=len(pdf_affiche)):
+            base64_pdf = base64.b64encode(pdf_affiche).decode("utf-8")
+        pdf_display = (
+            f'<iframe src="data:application/pdf;base64,{base64_pdf}#zoom=page-width" '
+            f'width="80%" height="600px" type="application/pdf"></iframe>'
+        )
 
-            # --- Affichage PDF dans le navigateur ---
-            base64_pdf = base64.b64encode(pdf_bytes).decode("utf-8")
-            pdf_display = (
-                f'<iframe src="data:application/pdf;base64,{base64_pdf}#zoom=page-width" '
-                f'width="80%" height="600px" type="application/pdf"></iframe>'
-            )
-
-            st.markdown(pdf_display, unsafe_allow_html=True)
-            col_pdf, col_tex = st.columns(2)
-            # --- Bouton de téléchargement ---
-            with col_pdf:
-                st.download_button("Télécharger le PDF", pdf_bytes, file_name="surtitres.pdf")
-            with col_tex:
-                st.download_button("Télécharger le code LaTeX", content, file_name="surtitres.tex")
-
-        else:
-            st.error("Erreur de compilation ❌")
-            def safe_decode(data):
-                try:
-                    return data.decode("utf-8")
-                except UnicodeDecodeError:
-                    return data.decode("latin-1")
-
-            st.text(safe_decode(result.stdout))
-            st.text(safe_decode(result.stderr))
-            st.download_button("Télécharger le code LaTeX", content, file_name="surtitres.tex")
\ No newline at end of file
+        st.markdown(pdf_display, unsafe_allow_html=True)
+        col_pdf, col_tex = st.columns(2)
+        # --- Bouton de téléchargement ---
+        with col_pdf:
+            st.download_button("Télécharger le PDF", pdf_bytes, file_name="surtitres.pdf")
+        with col_tex:
+            st.download_button("Télécharger le code LaTeX", content, file_name="surtitres.tex")
+
+    else:
+        st.error("Erreur de compilation ❌")
+        if result.arret is not None:
+            st.error(f"Compilation arrêtée : {result.motif_arret()}")
+        def safe_decode(data):
+            try:
+                return data.decode("utf-8")
+            except UnicodeDecodeError:
+                return data.decode("latin-1")
+
+        st.text(safe_decode(result.stdout))
+        st.text(safe_decode(result.stderr))
+        st.download_button("Télécharger le code LaTeX", content, file_name="surtitres.tex")
\ No newline at end of file
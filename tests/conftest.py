@@ -0,0 +1,31 @@
+"""Configuration des tests : une base SQLite neuve, dans un dossier temporaire, pour toute la session.
+
+Les modules de l'application lisent SURTITRES_BASE à leur import : la variable est
+fixée ici, avant que les tests ne les importent.
+"""
+import os
+import sys
+import tempfile
+import pytest
+
+DOSSIER = tempfile.mkdtemp(prefix='surtitres-tests-')
+os.environ.setdefault('SURTITRES_BASE', os.path.join(DOSSIER, 'projects.db'))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture(scope='session')
+def base():
+    from utils import init_databases
+    init_databases()
+
+
+@pytest.fixture
+def projet(base, request):
+    """Projet de douze morceaux (avec leurs fragments TeX), propre au test"""
+    from projets import create_project
+    from morceaux_back import ajouter_morceau
+    projet_id = f'test_{request.node.name}'
+    create_project(projet_id, 'tests', 'Projet de test')
+    for i in range(12):
+        ajouter_morceau(projet_id, None, f'Air {i + 1}', 'Compositeur', '1900', 'Opéra')
+    return projet_id
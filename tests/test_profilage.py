@@ -0,0 +1,50 @@
+from profilage import profiler_requetes, totaux_par_page, normaliser_requete
+
+
+def test_liste_des_morceaux(projet):
+    from morceaux_back import charger_morceaux
+    with profiler_requetes('test_liste') as profil:
+        morceaux = charger_morceaux(projet)
+    assert len(morceaux) == 12
+    assert profil.connexions == 1
+    assert profil.requetes == 1
+    assert profil.lignes == 12
+    assert profil.requetes_n_plus_un() == []
+    assert totaux_par_page['test_liste'] == {'executions': 1, 'connexions': 1, 'requetes': 1, 'lignes': 12}
+
+
+def test_rendu_du_concert(projet):
+    from surtitres import assembler_concert, diapositives_concert
+    with profiler_requetes('test_rendu') as profil:
+        document = assembler_concert(projet, mode='opéra')
+        diapositives = diapositives_concert(projet, mode='opéra')
+    assert len(diapositives) == 12
+    assert document.count(r'\begin{frame}') == sum(len(diapos) for _, _, diapos in diapositives)
+    # Une requête par rendu, quel que soit le nombre de morceaux
+    assert profil.connexions == 2
+    assert profil.requetes == 2
+    assert profil.lignes == 24
+    assert profil.requetes_n_plus_un() == []
+
+
+def test_motif_n_plus_un(projet):
+    from morceaux_back import charger_morceaux, get_morceau
+    with profiler_requetes('test_n_plus_un') as profil:
+        for morceau in charger_morceaux(projet):
+            get_morceau(morceau[0])
+    assert profil.connexions == 13
+    assert profil.requetes == 13
+    [(requete, nombre)] = profil.requetes_n_plus_un()
+    assert nombre == 12
+    assert requete == normaliser_requete(
+        'SELECT id, ordre, air, compositeur, annee, extrait_de, text_status FROM morceaux WHERE id = ? ORDER BY ordre')
+
+
+def test_requetes_des_triggers(base):
+    from projets import create_project
+    with profiler_requetes('test_triggers') as profil:
+        create_project('test_triggers', 'tests', 'Projet de test')
+    assert profil.requetes == 1
+    assert profil.transactions == 1
+    # Inscription à l'annuaire (trigger projects_annuaire_insert, et tables internes de son index FTS5)
+    assert profil.requetes_triggers > 0
@@ -0,0 +1,186 @@
+"""Écritures et lectures de la base sur les deux stockages (stockage_sqlite, stockage_serveur)
+
+Le cas PostgreSQL a besoin d'un serveur : SURTITRES_TEST_POSTGRES donne l'URL d'une base
+d'administration (postgresql://utilisateur@hote/postgres), sur laquelle une base de test est
+créée puis supprimée. Sans cette variable, seul SQLite est testé.
+"""
+import collections
+import os
+import urllib.parse
+import uuid
+import pandas as pd
+import pytest
+
+URL_POSTGRES = os.environ.get('SURTITRES_TEST_POSTGRES')
+
+
+@pytest.fixture(scope='module', params=['sqlite', 'postgresql'])
+def moteur(request, base):
+    if request.param == 'sqlite':
+        yield request.param
+        return
+    if not URL_POSTGRES:
+        pytest.skip('SURTITRES_TEST_POSTGRES non défini')
+    psycopg = pytest.importorskip('psycopg')
+    import base_serveur
+    import connexion
+    import diapositives
+    import paroles
+    from utils import init_databases
+
+    nom = f'surtitres_test_{uuid.uuid4().hex[:12]}'
+    url = urllib.parse.urlsplit(URL_POSTGRES)._replace(path=f'/{nom}').geturl()
+    with psycopg.connect(URL_POSTGRES, autocommit=True) as admin:
+        admin.execute(f'CREATE DATABASE {nom}')
+    try:
+        with pytest.MonkeyPatch.context() as patch:
+            patch.setattr(connexion, 'BASE', url)
+            # Les identifiants de morceaux de la base neuve reprennent à 1 : textes en mémoire oubliés
+            patch.setattr(diapositives, '_morceaux_en_memoire', collections.OrderedDict())
+            patch.setattr(paroles, '_paroles_en_memoire', collections.OrderedDict())
+            init_databases()
+            yield request.param
+            base_serveur.fermer(url)
+    finally:
+        with psycopg.connect(URL_POSTGRES, autocommit=True) as admin:
+            admin.execute(f'DROP DATABASE IF EXISTS {nom} WITH (FORCE)')
+
+
+def nouveau_projet(nombre_morceaux=0, createur='tests', description='Projet de test'):
+    from projets import create_project
+    from morceaux_back import ajouter_morceau
+    projet_id = f'test_{uuid.uuid4().hex[:12]}'
+    create_project(projet_id, createur, description)
+    morceaux = [ajouter_morceau(projet_id, None, f'Air {i + 1}', 'Compositeur', '1900', 'Opéra')
+                for i in range(nombre_morceaux)]
+    return projet_id, morceaux
+
+
+def airs(projet_id):
+    from morceaux_back import charger_morceaux
+    return [morceau[2] for morceau in charger_morceaux(projet_id)]
+
+
+def test_schema_deja_a_jour(moteur):
+    from connexion import get_connection
+    from utils import init_databases
+    init_databases()
+    conn = get_connection()
+    assert conn.execute('SELECT COUNT(*) FROM morceaux WHERE id < 0').fetchone() == (0,)
+    conn.close()
+
+
+def test_ordre_des_morceaux(moteur):
+    from connexion import get_connection
+    from morceaux_back import ajouter_morceau, deplacer_morceau, charger_morceaux
+    projet_id, (premier, deuxieme, troisieme) = nouveau_projet(3)
+    assert ajouter_morceau(projet_id, 1, 'Ouverture', '', '', '') is not None
+    assert deplacer_morceau(troisieme, 2)
+    assert airs(projet_id) == ['Ouverture', 'Air 3', 'Air 1', 'Air 2']
+
+    # Clés consécutives : le déplacement entre deux voisins renumérote le projet
+    conn = get_connection(projet_id=projet_id)
+    conn.executemany('UPDATE morceaux SET ordre = ? WHERE id = ?',
+                     [(10 + i, morceau[0]) for i, morceau in enumerate(charger_morceaux(projet_id))])
+    conn.commit()
+    conn.close()
+    assert deplacer_morceau(deuxieme, 2)
+    assert airs(projet_id) == ['Ouverture', 'Air 2', 'Air 3', 'Air 1']
+    conn = get_connection(projet_id=projet_id)
+    ordres = [ligne[0] for ligne in conn.execute(
+        'SELECT ordre FROM morceaux WHERE projet_id = ? ORDER BY ordre', (projet_id,)).fetchall()]
+    conn.close()
+    assert all(suivant - precedent > 1 for precedent, suivant in zip(ordres, ordres[1:]))
+
+
+def test_modifications_concurrentes(moteur):
+    from morceaux_back import mettre_a_jour_morceau, get_morceau, get_revision_morceau
+    projet_id, (morceau_id,) = nouveau_projet(1)
+    _, ordre, *valeurs = get_morceau(morceau_id)
+    base = (get_revision_morceau(morceau_id), [ordre, *valeurs])
+
+    # Deux éditeurs partis du même affichage : champs différents fusionnés, même champ refusé
+    assert mettre_a_jour_morceau(morceau_id, ordre, 'Air modifié', *valeurs[1:], base=base)
+    assert mettre_a_jour_morceau(morceau_id, ordre, valeurs[0], 'Autre compositeur', *valeurs[2:], base=base)
+    assert get_morceau(morceau_id)[2:4] == ('Air modifié', 'Autre compositeur')
+    assert not mettre_a_jour_morceau(morceau_id, ordre, 'Autre air', *valeurs[1:], base=base)
+    assert get_morceau(morceau_id)[2] == 'Air modifié'
+
+
+def test_paroles_recherche_et_memoire(moteur):
+    from flux import lire_modifications
+    from memoire import suggerer_traductions
+    from paroles import sauvegarder_paroles_vers_tableur, charger_paroles_depuis_tableur
+    from recherche import rechercher_paroles
+    projet_id, (morceau_id,) = nouveau_projet(1)
+    paroles = pd.DataFrame({'Original': ['Là ci darem la mano', 'Vorrei e non vorrei'],
+                            'Traduction': ['Là nous nous donnerons la main', 'Je voudrais et ne voudrais pas']})
+    assert sauvegarder_paroles_vers_tableur(morceau_id, paroles, 'Air 1')
+    assert charger_paroles_depuis_tableur(morceau_id).values.tolist() == paroles.values.tolist()
+
+    [trouve] = rechercher_paroles('darem', projet_id=projet_id)
+    assert (trouve['morceau_id'], trouve['ligne']) == (morceau_id, 1)
+    assert '**darem**' in trouve['original']
+    assert any(r['morceau_id'] == morceau_id for r in rechercher_paroles('main'))
+    assert rechercher_paroles('donneRONS la', projet_id=projet_id)
+
+    [suggestion] = suggerer_traductions('Vorrei, e non vorrei !')
+    assert suggestion == {'similarite': 1.0, 'original': 'Vorrei e non vorrei',
+                          'traduction': 'Je voudrais et ne voudrais pas'}
+    assert suggerer_traductions('Vorrei e non vorei')[0]['traduction'] == 'Je voudrais et ne voudrais pas'
+
+    # Une traduction corrigée remplace l'ancienne dans la mémoire
+    paroles.loc[1, 'Traduction'] = 'Je voudrais, je ne voudrais pas'
+    assert sauvegarder_paroles_vers_tableur(morceau_id, paroles, 'Air 1')
+    assert [s['traduction'] for s in suggerer_traductions('Vorrei e non vorrei')] == ['Je voudrais, je ne voudrais pas']
+
+    _, modifications = lire_modifications(projet_id, 0)
+    assert [(m['objet'], m['operation']) for m in modifications] == [
+        ('morceau', 'insert'), ('paroles', 'insert'), ('morceau', 'update'), ('paroles', 'update')]
+
+
+def test_suppression_et_blobs(moteur, monkeypatch):
+    import blobs
+    from blobs import lire_blob, collecter_blobs_orphelins
+    from connexion import get_connection
+    from memoire import suggerer_traductions
+    from morceaux_back import supprimer_morceau
+    from paroles import sauvegarder_paroles_vers_tableur
+    from recherche import rechercher_paroles
+    projet_id, (morceau_id,) = nouveau_projet(1)
+    paroles = pd.DataFrame({'Original': ['Una furtiva lagrima'], 'Traduction': ['Une larme furtive']})
+    assert sauvegarder_paroles_vers_tableur(morceau_id, paroles, 'Air 1')
+    conn = get_connection(projet_id=projet_id)
+    [(empreinte,)] = conn.execute('SELECT empreinte FROM tableurs_paroles WHERE morceau_id = ?', (morceau_id,)).fetchall()
+    conn.close()
+    assert lire_blob(empreinte)
+
+    assert supprimer_morceau(morceau_id)
+    assert rechercher_paroles('furtiva', projet_id=projet_id) == []
+    assert suggerer_traductions('Una furtiva lagrima') == []
+    # Le blob orphelin est gardé pendant le délai de grâce, puis collecté
+    assert lire_blob(empreinte)
+    monkeypatch.setattr(blobs, 'DELAI_GRACE', -1)
+    assert collecter_blobs_orphelins() >= 1
+    with pytest.raises(FileNotFoundError):
+        lire_blob(empreinte)
+
+
+def test_annuaire(moteur):
+    from projets import lister_projets
+    # Mot propre au test, sans chiffres
+    marque = uuid.uuid4().hex[:8].translate(str.maketrans('0123456789', 'ghijklmnop'))
+    projets = [nouveau_projet(createur=f'Ensemble {marque}', description=f'Récital {i}')[0] for i in range(3)]
+    autre, _ = nouveau_projet(createur='Soliste', description=f'Concert de l’ensemble {marque}')
+
+    trouves, suivant = lister_projets(recherche=f'ensemble {marque}', limite=10)
+    assert [p[0] for p in trouves] == [autre] + projets[::-1]
+    assert suivant is None
+    trouves, _ = lister_projets(createur=marque, limite=10)
+    assert [p[0] for p in trouves] == projets[::-1]
+    page, suivant = lister_projets(createur=marque, limite=2)
+    assert [p[0] for p in page] == projets[:0:-1]
+    page, suivant = lister_projets(createur=marque, limite=2, apres=suivant)
+    assert [p[0] for p in page] == projets[:1] and suivant is None
+    trouves, _ = lister_projets(prefixe=projets[0][:-2], limite=10)
+    assert projets[0] in [p[0] for p in trouves]
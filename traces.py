@@ -0,0 +1,153 @@
+import contextvars
+import functools
+import itertools
+import json
+import os
+import sys
+import threading
+import time
+
+# Traces activées pour tout le processus : SURTITRES_TRACES=1 (lignes JSON dans SURTITRES_TRACES_FICHIER,
+# "-" pour la sortie d'erreur). Sinon, elles ne sont collectées que pour les exécutions en mode débogage.
+TRACES_ACTIVES = os.environ.get('SURTITRES_TRACES', '') not in ('', '0')
+FICHIER_TRACES = os.environ.get('SURTITRES_TRACES_FICHIER', 'traces.jsonl')
+
+# Étape en cours et étapes terminées de l'exécution courante (propres à chaque thread de script)
+_etape_courante = contextvars.ContextVar('etape_courante', default=None)
+_collecte = contextvars.ContextVar('collecte_etapes', default=None)
+
+_compteur = itertools.count(1)
+_verrou_fichier = threading.Lock()
+
+# Indiquer si les étapes doivent être mesurées dans le contexte courant
+def actives():
+    return TRACES_ACTIVES or _collecte.get() is not None
+
+# Étape sans effet, partagée, utilisée quand les traces sont désactivées
+class _EtapeInactive:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def etiqueter(self, **tags):
+        pass
+
+_ETAPE_INACTIVE = _EtapeInactive()
+
+# Intervalle de temps mesuré, imbriqué dans l'étape en cours
+class Etape:
+    __slots__ = ('id', 'nom', 'tags', 'parent', 'profondeur', 'debut', 'duree', '_jeton')
+
+    def __init__(self, nom, tags):
+        self.id = next(_compteur)
+        self.nom = nom
+        self.tags = tags
+
+    # Ajouter des étiquettes connues seulement pendant l'étape
+    def etiqueter(self, **tags):
+        self.tags.update(tags)
+
+    def __enter__(self):
+        parent = _etape_courante.get()
+        self.parent = parent.id if parent else None
+        self.profondeur = parent.profondeur + 1 if parent else 0
+        if parent:
+            # Les étiquettes (projet, morceau) sont héritées de l'étape parente
+            self.tags = {**parent.tags, **self.tags}
+        self._jeton = _etape_courante.set(self)
+        self.debut = time.perf_counter()
+        return self
+
+    def __exit__(self, type_exc, exc, tb):
+        self.duree = time.perf_counter() - self.debut
+        _etape_courante.reset(self._jeton)
+        if type_exc is not None:
+            self.tags['erreur'] = type_exc.__name__
+        collecte = _collecte.get()
+        if collecte is not None:
+            collecte.append(self)
+        if TRACES_ACTIVES:
+            _ecrire(self)
+        return False
+
+    def en_dict(self):
+        return {'id': self.id, 'parent': self.parent, 'nom': self.nom, 'profondeur': self.profondeur,
+                'duree_ms': round(self.duree * 1000, 3), **self.tags}
+
+# Écrire une étape terminée sous forme de ligne JSON
+def _ecrire(etape):
+    ligne = json.dumps({'date': time.time(), **etape.en_dict()}, ensure_ascii=False, default=str)
+    with _verrou_fichier:
+        if FICHIER_TRACES == '-':
+            print(ligne, file=sys.stderr)
+        else:
+            with open(FICHIER_TRACES, 'a') as f:
+                f.write(ligne + '\n')
+
+# Mesurer un bloc : with etape('pdflatex', projet=...):
+def etape(nom, **tags):
+    if not actives():
+        return _ETAPE_INACTIVE
+    return Etape(nom, tags)
+
+# Décorateur mesurant chaque appel de la fonction comme une étape
+def tracer(nom):
+    def decorateur(fonction):
+        @functools.wraps(fonction)
+        def enveloppe(*args, **kwargs):
+            if not actives():
+                return fonction(*args, **kwargs)
+            with Etape(nom, {}):
+                return fonction(*args, **kwargs)
+        return enveloppe
+    return decorateur
+
+# Collecter (ou non) les étapes de l'exécution courante, pour le panneau de débogage
+def configurer_collecte(active):
+    # Appelée au début de chaque exécution : une exécution interrompue (st.rerun) ne laisse jamais la collecte active
+    _collecte.set([] if active else None)
+
+# Arrêter la collecte et retourner les étapes terminées, dans l'ordre de leur début
+def terminer_collecte():
+    collecte = _collecte.get() or []
+    _collecte.set(None)
+    return sorted(collecte, key=lambda e: e.debut)
+
+# Résumer les étapes par chemin (racine > ... > étape), dans l'ordre de l'arbre : appels, durée totale et part du temps
+def resume_flamme(etapes):
+    par_id = {e.id: e for e in etapes}
+    total = sum(e.duree for e in etapes if e.parent not in par_id) or 1e-9
+    chemins = {}
+    for e in etapes:
+        noms = [e.nom]
+        parent = par_id.get(e.parent)
+        while parent is not None:
+            noms.append(parent.nom)
+            parent = par_id.get(parent.parent)
+        chemin = tuple(reversed(noms))
+        agregat = chemins.setdefault(chemin, {'appels': 0, 'duree': 0.0, 'debut': e.debut})
+        agregat['appels'] += 1
+        agregat['duree'] += e.duree
+
+    # Parcours en profondeur : chaque étape suivie de ses sous-étapes, dans l'ordre de début
+    ordonnes = []
+    def parcourir(prefixe):
+        enfants = sorted((c for c in chemins if c[:-1] == prefixe), key=lambda c: chemins[c]['debut'])
+        for chemin in enfants:
+            ordonnes.append(chemin)
+            parcourir(chemin)
+    parcourir(())
+
+    return [
+        {
+            'étape': "· " * (len(chemin) - 1) + chemin[-1],
+            'appels': chemins[chemin]['appels'],
+            'total (ms)': round(chemins[chemin]['duree'] * 1000, 2),
+            'part': round(chemins[chemin]['duree'] / total, 3),
+        }
+        for chemin in ordonnes
+    ]